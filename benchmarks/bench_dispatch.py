@@ -0,0 +1,116 @@
+"""
+Measure how many events per second the agent's key dispatch path can
+consume for a stream that is mostly non-key noise and unmapped keys, as a
+mouse or keyboard shares the bus with a remote.
+
+``legacy`` replays the pre-0.2 implementation (an evdev event object per
+event and a ``KeyEvent`` per key event) for comparison, and
+``many_bindings`` shows that the cost does not depend on how many keys are
+bound.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_dispatch
+"""
+from __future__ import print_function, unicode_literals
+
+import time
+
+import evdev
+import mock
+
+from mopidy_evtdev import agent, keymap
+
+NUM_EVENTS = 200000
+
+# Codes well clear of those in the event stream
+MANY_BINDINGS = ['%d = stop' % code for code in range(300, 700)]
+
+
+class NullPlayback(object):
+
+    def stop(self):
+        pass
+
+
+class NullCore(object):
+
+    playback = NullPlayback()
+
+
+def make_events():
+    ecodes = evdev.ecodes
+    pattern = [
+        (ecodes.EV_REL, ecodes.REL_X, 3),
+        (ecodes.EV_REL, ecodes.REL_Y, -2),
+        (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        (ecodes.EV_KEY, ecodes.KEY_A, 1),
+        (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        (ecodes.EV_KEY, ecodes.KEY_A, 0),
+        (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        (ecodes.EV_KEY, ecodes.KEY_STOP, 1),
+        (ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        (ecodes.EV_KEY, ecodes.KEY_STOP, 0),
+    ]
+    events = []
+    for i in range(NUM_EVENTS):
+        etype, code, value = pattern[i % len(pattern)]
+        events.append((i // 1000, i % 1000, etype, code, value))
+    return events
+
+
+def legacy(a, events):
+    KeyEvent = evdev.events.KeyEvent
+    ecode_map = dict((code, a.key_table.press[code])
+                     for code in range(keymap.KEY_CNT)
+                     if a.key_table.press[code] is not None)
+    last_key_event = None
+    last_event = None
+    for (sec, usec, etype, code, value) in events:
+        event = evdev.events.InputEvent(sec, usec, etype, code, value)
+        if (event.type in evdev.events.event_factory and
+                evdev.events.event_factory[event.type] is KeyEvent):
+            key_event = KeyEvent(event)
+            if (last_event and last_key_event and
+                    last_key_event.keycode == key_event.keycode and
+                    last_key_event.keystate in (KeyEvent.key_down,
+                                                KeyEvent.key_hold) and
+                    key_event.keystate == KeyEvent.key_up):
+                if ((event.timestamp() - last_event.timestamp()) <=
+                        agent.EvtDevAgent.MAX_TIME_INTERVAL and
+                        key_event.scancode in ecode_map.keys()):
+                    ecode_map[key_event.scancode]()
+                last_key_event = None
+                last_event = None
+            else:
+                last_key_event = key_event
+                last_event = event
+
+
+def current(a, events):
+    handle_event = a._handle_event
+    for (sec, usec, etype, code, value) in events:
+        handle_event(sec, usec, etype, code, value)
+
+
+def main():
+    events = make_events()
+    with mock.patch('evdev.util.list_devices', return_value=[]), \
+            mock.patch('gobject.timeout_add'), \
+            mock.patch('gobject.source_remove'):
+        a = agent.EvtDevAgent(NullCore(), '/dev/input', [], 10, 10)
+        many = agent.EvtDevAgent(NullCore(), '/dev/input', [], 10, 10,
+                                 keymap=MANY_BINDINGS)
+        for (name, func, instance) in (('legacy', legacy, a),
+                                       ('current', current, a),
+                                       ('many_bindings', current, many)):
+            start = time.time()
+            func(instance, events)
+            elapsed = time.time() - start
+            print('%-14s %12.0f events/s' % (name, len(events) / elapsed))
+        a.stop()
+        many.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Measure the delay between an event's kernel timestamp and its handler being
+invoked, for each engine, while the GLib main loop is kept busy by other
+work (as GStreamer bus messages and other extensions' timers would).
+
+Events are written to pipes standing in for input devices, so no
+``/dev/uinput`` access is required.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_engine
+"""
+from __future__ import division, print_function, unicode_literals
+
+import threading
+import time
+
+import evdev
+import gobject
+import mock
+
+from mopidy_evtdev import agent, engine
+
+from .fakes import PipeInputDevice, VirtualClock
+
+NUM_PRESSES = 200
+PRESS_INTERVAL = 0.005
+LOAD_PERIOD_MS = 10
+LOAD_BUSY = 0.008
+
+
+def load_main_loop():
+    time.sleep(LOAD_BUSY)
+    return True
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench(engine_name):
+    device = PipeInputDevice('/nonexistent/event0', VirtualClock(step=None),
+                             key_codes=[evdev.ecodes.KEY_STOP])
+    latencies = []
+    done = threading.Event()
+
+    def on_press():
+        state = a.key_states.slots[a.current_slot][evdev.ecodes.KEY_STOP]
+        event = state.sec + state.usec / 1e6
+        latencies.append(time.time() - event)
+        if (len(latencies) == NUM_PRESSES):
+            done.set()
+
+    if (engine_name == 'epoll'):
+        eng = engine.EpollEngine()
+    else:
+        eng = engine.GObjectEngine()
+    eng.start()
+    with mock.patch('evdev.util.list_devices', return_value=[device.fn]), \
+            mock.patch('evdev.device.InputDevice', return_value=device):
+        a = agent.EvtDevAgent(mock.Mock(), '/dev/input', [], 10, 10,
+                              bulk_read=True, engine=eng)
+    a.key_table.press[evdev.ecodes.KEY_STOP] = on_press
+    for i in range(NUM_PRESSES):
+        device.emit_click(evdev.ecodes.KEY_STOP)
+        time.sleep(PRESS_INTERVAL)
+    done.wait(10)
+    a.stop()
+    eng.stop()
+    device.destroy()
+    return latencies
+
+
+def main():
+    gobject.threads_init()
+    loop = gobject.MainLoop()
+    gobject.timeout_add(LOAD_PERIOD_MS, load_main_loop)
+    thread = threading.Thread(target=loop.run)
+    thread.daemon = True
+    thread.start()
+    print('%-8s %10s %10s %10s' % ('engine', 'p50 (ms)', 'p99 (ms)',
+                                   'max (ms)'))
+    for engine_name in ('gobject', 'epoll'):
+        latencies = bench(engine_name)
+        print('%-8s %10.2f %10.2f %10.2f' % (
+            engine_name, percentile(latencies, 50) * 1e3,
+            percentile(latencies, 99) * 1e3, max(latencies) * 1e3))
+    loop.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Measure the steady state cost of a device refresh as the number of input
+nodes grows.  Device nodes, their device numbers, sysfs metadata and GLib
+sources are all mocked so only the agent's own reconciliation work is
+timed.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_refresh
+"""
+from __future__ import print_function, unicode_literals
+
+import timeit
+
+import mock
+
+from mopidy_evtdev import agent, sysfs
+
+NODE_COUNTS = (10, 100, 1000, 5000)
+REPEAT = 50
+
+
+def bench_refresh(num_nodes):
+    device_names = ['/dev/input/event%d' % i for i in range(num_nodes)]
+    infos = dict((name, sysfs.DeviceInfo(name, 'Device %d' % i, '', ''))
+                 for (i, name) in enumerate(device_names))
+    with mock.patch('evdev.util.list_devices',
+                    return_value=device_names), \
+            mock.patch('evdev.device.InputDevice'), \
+            mock.patch('gobject.io_add_watch'), \
+            mock.patch('gobject.source_remove'), \
+            mock.patch('gobject.timeout_add'), \
+            mock.patch.object(sysfs.DeviceInfoCache, 'lookup',
+                              side_effect=infos.get), \
+            mock.patch.object(agent.EvtDevAgent, '_node_key',
+                              side_effect=lambda name: (13, hash(name))):
+        a = agent.EvtDevAgent(mock.Mock(), '/dev/input',
+                              ['Device 1*', 're:^Device 9$'], 10, 10)
+        elapsed = timeit.timeit(a._refresh_timeout_callback, number=REPEAT)
+        a.stop()
+    return elapsed / REPEAT
+
+
+def main():
+    print('%8s %14s %14s' % ('nodes', 'refresh (us)', 'per node (us)'))
+    for num_nodes in NODE_COUNTS:
+        elapsed = bench_refresh(num_nodes) * 1e6
+        print('%8d %14.1f %14.3f' % (num_nodes, elapsed,
+                                     elapsed / num_nodes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Replay an event log recorded with the ``record_file`` option through the
+agent as fast as possible, against a fake core, to get a performance
+baseline from a real-world trace.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_replay events.log
+"""
+from __future__ import division, print_function, unicode_literals
+
+import sys
+import time
+
+import mock
+
+from mopidy_evtdev import agent
+from mopidy_evtdev.record import EventLog, replay
+
+from .fakes import FakeCore, ManualEngine
+
+
+def main(path):
+    log = EventLog(path)
+    core = FakeCore()
+    with mock.patch('evdev.util.list_devices', return_value=[]):
+        a = agent.EvtDevAgent(core, '/dev/input', [], 10, 10,
+                              engine=ManualEngine())
+    a.update_playback_state(core.state)
+    a.update_volume(core.volume)
+    a.update_mute(core.mute)
+    start = time.time()
+    num_events = replay(a, log)
+    elapsed = time.time() - start
+    a.stop()
+    log.close()
+    print('%d events from %d devices in %.3fs (%.0f events/s)' % (
+        num_events, len(log.devices), elapsed, num_events / elapsed))
+    for (command, count) in sorted(core.calls.items()):
+        print('  %-12s %d' % (command, count))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
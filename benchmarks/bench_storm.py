@@ -0,0 +1,168 @@
+"""
+Event storm benchmarks for the whole agent pipeline: devices backed by
+pipes carrying real ``struct input_event`` streams are read, decoded and
+dispatched to a fake core, with no ``/dev/uinput`` or GLib main loop
+required.
+
+For each scenario this reports throughput, CPU time per event, dispatch
+latency percentiles (from the agent's own latency statistics) and the cost
+of a device refresh.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_storm [scenario ...]
+"""
+from __future__ import division, print_function, unicode_literals
+
+import resource
+import sys
+import time
+import timeit
+
+import evdev
+import mock
+
+from mopidy_evtdev import agent
+
+from .fakes import FakeCore, ManualEngine, PipeInputDevice, VirtualClock
+
+ecodes = evdev.ecodes
+REFRESH_REPEAT = 20
+
+
+class Scenario(object):
+    """
+    A set of devices and a function generating one round of input on them.
+    """
+
+    def __init__(self, name, num_remotes, num_mice, rounds, noise=0,
+                 core_delay=0, dispatch_queue=0, clock_step=None,
+                 overlap=False, read_batch=0):
+        self.name = name
+        self.num_remotes = num_remotes
+        self.num_mice = num_mice
+        self.rounds = rounds
+        self.noise = noise
+        self.core_delay = core_delay
+        self.dispatch_queue = dispatch_queue
+        self.clock_step = clock_step
+        self.overlap = overlap
+        self.read_batch = read_batch
+
+    def emit_round(self, remotes, mice, flush):
+        for mouse in mice:
+            mouse.emit([(ecodes.EV_REL, ecodes.REL_X, 1),
+                        (ecodes.EV_SYN, ecodes.SYN_REPORT, 0)] * self.noise)
+        if (self.overlap):
+            # Every remote's key goes down before any is released, and the
+            # presses are read in separate wakeups
+            for value in (1, 0):
+                for remote in remotes:
+                    remote.emit([(ecodes.EV_KEY, ecodes.KEY_PLAYPAUSE, value),
+                                 (ecodes.EV_SYN, ecodes.SYN_REPORT, 0)])
+                flush()
+        else:
+            for remote in remotes:
+                remote.emit_click(ecodes.KEY_PLAYPAUSE)
+        flush()
+        return len(mice) * self.noise * 2 + len(remotes) * 4
+
+
+SCENARIOS = [
+    Scenario('many_devices', num_remotes=200, num_mice=0, rounds=20),
+    Scenario('noise', num_remotes=1, num_mice=8, rounds=200, noise=50),
+    Scenario('key_storm', num_remotes=1, num_mice=0, rounds=5000),
+    Scenario('slow_core', num_remotes=4, num_mice=0, rounds=200,
+             core_delay=0.005, dispatch_queue=32),
+    # Presses spread further apart than MAX_TIME_INTERVAL are all rejected
+    Scenario('slow_presses', num_remotes=1, num_mice=0, rounds=100,
+             clock_step=agent.EvtDevAgent.MAX_TIME_INTERVAL),
+    # Presses overlapping across devices are each recognised
+    Scenario('overlap', num_remotes=16, num_mice=0, rounds=500,
+             overlap=True),
+    # A chatty device drained in one go, or read fairly in batches with the
+    # remote served first
+    Scenario('chatty', num_remotes=4, num_mice=1, rounds=100, noise=1000),
+    Scenario('chatty_fair', num_remotes=4, num_mice=1, rounds=100,
+             noise=1000, read_batch=64),
+]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(scenario):
+    clock = VirtualClock(time.time(), scenario.clock_step)
+    remotes = [PipeInputDevice('/nonexistent/event%d' % i, clock,
+                               'Remote %d' % i)
+               for i in range(scenario.num_remotes)]
+    mice = [PipeInputDevice('/nonexistent/event%d' % (i + len(remotes)),
+                            clock, 'Mouse %d' % i,
+                            key_codes=[ecodes.BTN_LEFT])
+            for i in range(scenario.num_mice)]
+    devices = dict((d.fn, d) for d in remotes + mice)
+    core = FakeCore(scenario.core_delay)
+    engine = ManualEngine()
+    # Mice are named explicitly so they are watched, as they would be on a
+    # host that lists them in 'devices'
+    with mock.patch('evdev.util.list_devices', return_value=list(devices)), \
+            mock.patch('evdev.device.InputDevice',
+                       side_effect=devices.get):
+        a = agent.EvtDevAgent(core, '/dev/input', ['/nonexistent/*'], 10, 10,
+                              bulk_read=True, engine=engine,
+                              dispatch_queue=scenario.dispatch_queue,
+                              latency_stats=True,
+                              read_batch=scenario.read_batch)
+        a.update_playback_state(core.state)
+        a.update_volume(core.volume)
+        a.update_mute(core.mute)
+
+        num_events = 0
+        start_cpu = cpu_time()
+        start = time.time()
+
+        def flush():
+            while (engine.run_once()):
+                pass
+
+        for i in range(scenario.rounds):
+            num_events += scenario.emit_round(remotes, mice, flush)
+        elapsed = time.time() - start
+        elapsed_cpu = cpu_time() - start_cpu
+
+        refresh = timeit.timeit(a._refresh_timeout_callback,
+                                number=REFRESH_REPEAT) / REFRESH_REPEAT
+        stats = a.get_latency_stats()
+        a.stop()
+    for device in devices.values():
+        device.destroy()
+
+    dispatch = stats['actions'].get('_play_pause', {}).get(
+        'dispatch', {'count': 0, 'p50': 0, 'p99': 0})
+    return {'events': num_events,
+            'events_per_sec': num_events / elapsed,
+            'cpu_per_event_us': elapsed_cpu * 1e6 / num_events,
+            'dispatched': dispatch['count'],
+            'dispatch_p50_us': dispatch['p50'],
+            'dispatch_p99_us': dispatch['p99'],
+            'refresh_us': refresh * 1e6}
+
+
+def main(names):
+    print('%-14s %8s %12s %10s %10s %10s %10s %11s' % (
+        'scenario', 'events', 'events/s', 'cpu/ev us', 'dispatched',
+        'p50 us', 'p99 us', 'refresh us'))
+    for scenario in SCENARIOS:
+        if (names and scenario.name not in names):
+            continue
+        r = run(scenario)
+        print('%-14s %8d %12.0f %10.2f %10d %10d %10d %11.1f' % (
+            scenario.name, r['events'], r['events_per_sec'],
+            r['cpu_per_event_us'], r['dispatched'], r['dispatch_p50_us'],
+            r['dispatch_p99_us'], r['refresh_us']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
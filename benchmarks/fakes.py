@@ -0,0 +1,233 @@
+"""
+Stand-ins used by the benchmarks to drive the agent headless on plain
+Linux: pipe backed input devices that carry real ``struct input_event``
+byte streams, a deterministic clock for event timestamps, a core whose
+commands resolve after a configurable delay, and an engine that is stepped
+by hand instead of running a main loop.
+"""
+from __future__ import division, unicode_literals
+
+import collections
+import heapq
+import os
+import select
+import threading
+import time
+
+import evdev
+import pykka
+
+from mopidy.core import PlaybackState
+
+from mopidy_evtdev.engine import PRIORITY_DEFAULT
+from mopidy_evtdev.reader import INPUT_EVENT
+
+
+class VirtualClock(object):
+    """
+    Source of event timestamps.  Each call to :meth:`tick` advances the
+    clock by ``step`` seconds, so timestamps (and therefore the agent's
+    ``MAX_TIME_INTERVAL`` checks) do not depend on how fast the benchmark
+    runs.  With ``step=None`` the clock follows real time instead.
+    """
+
+    def __init__(self, start=1000000000.0, step=0.001):
+        self.now = start
+        self.step = step
+
+    def tick(self, seconds=None):
+        if (self.step is None):
+            self.now = time.time()
+        else:
+            self.now += self.step if seconds is None else seconds
+        return (int(self.now), int(round((self.now % 1) * 1000000)))
+
+
+class PipeInputDevice(object):
+    """
+    Behaves enough like ``evdev.device.InputDevice`` for the agent, but its
+    fd is the read end of a pipe that :meth:`emit` writes events into.
+    """
+
+    def __init__(self, fn, clock, name='Pipe Input Device', key_codes=None):
+        self.fn = fn
+        self.name = name
+        self.phys = fn
+        self.uniq = ''
+        self.clock = clock
+        self.key_codes = key_codes or [evdev.ecodes.KEY_PLAYPAUSE]
+        self.fd, self.wfd = os.pipe()
+        self.closed = False
+
+    def capabilities(self):
+        return {evdev.ecodes.EV_KEY: self.key_codes}
+
+    def emit(self, events):
+        """Write ``(type, code, value)`` tuples stamped by the clock."""
+        data = []
+        for (etype, code, value) in events:
+            sec, usec = self.clock.tick()
+            data.append(INPUT_EVENT.pack(sec, usec, etype, code, value))
+        os.write(self.wfd, b''.join(data))
+
+    def emit_click(self, code):
+        self.emit([(evdev.ecodes.EV_KEY, code, 1),
+                   (evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0),
+                   (evdev.ecodes.EV_KEY, code, 0),
+                   (evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0)])
+
+    def read_one(self):
+        r, _, _ = select.select([self.fd], [], [], 0)
+        if (not r):
+            return None
+        data = os.read(self.fd, INPUT_EVENT.size)
+        return evdev.events.InputEvent(*INPUT_EVENT.unpack(data))
+
+    def close(self):
+        # The agent closes devices it drops; the benchmark owns the pipe
+        self.closed = True
+
+    def destroy(self):
+        os.close(self.fd)
+        os.close(self.wfd)
+
+
+class _DelayedExecutor(object):
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue = []
+        self.seq = 0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, delay, func):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.queue, (time.time() + delay, self.seq, func))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while (not self.queue or self.queue[0][0] > time.time()):
+                    self.cond.wait(self.queue[0][0] - time.time()
+                                   if self.queue else None)
+                func = heapq.heappop(self.queue)[2]
+            func()
+
+
+class _FakePlayback(object):
+
+    def __init__(self, core):
+        self.core = core
+
+    def _resolve(self, name, value=None):
+        self.core.calls[name] += 1
+        future = pykka.ThreadingFuture()
+        if (self.core.delay):
+            self.core.executor.submit(self.core.delay,
+                                      lambda: future.set(value))
+        else:
+            future.set(value)
+        return future
+
+    @property
+    def state(self):
+        return self._resolve('state', self.core.state)
+
+    @property
+    def volume(self):
+        return self._resolve('volume', self.core.volume)
+
+    @property
+    def mute(self):
+        return self._resolve('mute', self.core.mute)
+
+    def __getattr__(self, name):
+        return lambda *args: self._resolve(name)
+
+
+class FakeCore(object):
+    """
+    Core whose playback commands return Pykka futures that resolve
+    ``delay`` seconds later, counting how often each command was called.
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.state = PlaybackState.PLAYING
+        self.volume = 50
+        self.mute = False
+        self.calls = collections.Counter()
+        self.executor = _DelayedExecutor() if delay else None
+        self.playback = _FakePlayback(self)
+
+
+class ManualEngine(object):
+    """
+    Engine that is stepped by calling :meth:`run_once`, which dispatches
+    every readable fd once, in order of priority, and any timeouts that are
+    due.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tag = 0
+        self.watches = {}
+        self.timeouts = {}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def io_add_watch(self, fd, callback, *args, **kwargs):
+        priority = kwargs.get('priority', PRIORITY_DEFAULT)
+        with self.lock:
+            self.tag += 1
+            self.watches[self.tag] = (fd, callback, args, priority)
+            return self.tag
+
+    def timeout_add(self, interval, callback, *args):
+        with self.lock:
+            self.tag += 1
+            self.timeouts[self.tag] = (time.time() + interval / 1000,
+                                       interval, callback, args)
+            return self.tag
+
+    def source_remove(self, tag):
+        with self.lock:
+            self.watches.pop(tag, None)
+            self.timeouts.pop(tag, None)
+
+    def run_once(self, timeout=0):
+        """Returns the number of callbacks that were dispatched."""
+        with self.lock:
+            fds = dict((w[0], (w[3], tag))
+                       for (tag, w) in self.watches.items())
+            timeouts = list(self.timeouts.items())
+        dispatched = 0
+        r = select.select(list(fds), [], [], timeout)[0] if fds else []
+        r.sort(key=fds.get)
+        for fd in r:
+            tag = fds[fd][1]
+            watch = self.watches.get(tag)
+            if (watch is not None):
+                dispatched += 1
+                if (not watch[1](fd, select.POLLIN, *watch[2])):
+                    self.source_remove(tag)
+        now = time.time()
+        for (tag, timeout) in timeouts:
+            (deadline, interval, callback, args) = timeout
+            if (deadline <= now and tag in self.timeouts):
+                dispatched += 1
+                if (callback(*args)):
+                    with self.lock:
+                        self.timeouts[tag] = (now + interval / 1000,
+                                              interval, callback, args)
+                else:
+                    self.source_remove(tag)
+        return dispatched
@@ -1,258 +1,1450 @@
 from __future__ import unicode_literals
 
+import errno
 import logging
-import gobject
+import os
+import threading
+import time
+
 import evdev
+import pykka
 
-from mopidy.core import PlaybackState
+from . import profiling as profiling_lib
+from . import trace as trace_lib
+from .dispatch import CommandDispatcher
+from .engine import (GObjectEngine, IO_ERR, IO_HUP, PRIORITY_DEFAULT,
+                     PRIORITY_LOW)
+from .futures import FutureWatcher
+from .hotplug import HotplugMonitor
+from .keymap import (ACTIONS, DEFAULT_KEYMAP, HOLD, HOLD_ACTIONS, LONG,
+                     PRESS, KeyTable, parse_action, parse_binding)
+from .keystate import KeyStateTable
+from .latency import LatencyStats
+from .matcher import DeviceMatcher
+from .ratelimit import RateLimiter
+from .reader import EventReader
+from .record import EventRecorder
+from .sysfs import DeviceInfo, DeviceInfoCache
+from .timerwheel import TimerWheel
 
 logger = logging.getLogger(__name__)
 
+EV_KEY = evdev.ecodes.EV_KEY
+EV_SYN = evdev.ecodes.EV_SYN
+KEY_DOWN = evdev.events.KeyEvent.key_down
+KEY_HOLD = evdev.events.KeyEvent.key_hold
+SYN_DROPPED = evdev.ecodes.SYN_DROPPED
+SYN_REPORT = evdev.ecodes.SYN_REPORT
+
 
 class EvtDevAgent(object):
 
     MAX_TIME_INTERVAL = 5.0   # Maximum number of seconds between events
+    HOTPLUG_REFRESH = 60      # Minimum fallback refresh period for hotplug
+    QUARANTINE_BACKOFF = 1.0  # Initial quarantine for flooding devices
+    QUARANTINE_MAX = 300.0    # Maximum quarantine for flooding devices
+    PROBE_THREADS = 8         # Maximum new devices probed in parallel
+    SEEK_STEP = 10000         # Default seek step in milliseconds
+    SEEK_HOLD_GAP = 0.5       # Seconds between repeats that end a hold
+    SEEK_ACCEL_PERIOD = 1.0   # Seconds held for each doubling of speed
+    SEEK_ACCEL_MAX = 8        # Maximum speed-up of a held seek
+    SEEK_TIMEOUT = 2.0        # Seconds to wait for core to finish a seek
+    SKIP_TIMEOUT = 5.0        # Seconds to wait for core to change track
+    TOGGLE_TIMEOUT = 2.0      # Seconds to wait for core to play or pause
+    REMOTE_HANDLERS = 256     # Handlers kept for actions from elsewhere
+
+    # Queueing policies for commands run on the dispatcher worker, keyed by
+    # handler name; anything not listed is queued in order
+    DISPATCH_POLICIES = {
+        '_play_pause': CommandDispatcher.DEDUPE,
+        '_set_volume': CommandDispatcher.LATEST,
+        '_hold_seek_forward': CommandDispatcher.LATEST,
+        '_hold_seek_backward': CommandDispatcher.LATEST,
+    }
+    DISPATCH_DEDUPE_THRESHOLD = 2
 
-    def __init__(self, core, dev_dir, devices, vol_step_size, refresh):
+    # Callbacks timed while profiling: reading devices, finding and probing
+    # them, timers and running commands against core
+    PROFILED_CALLBACKS = (
+        '_fd_ready_callback', '_fd_bulk_ready_callback', '_hotplug_callback',
+        '_refresh_timeout_callback', '_probe_devices',
+        '_long_press_callback', '_volume_timeout_callback',
+        '_quarantine_timeout_callback', '_run_action')
+
+    def __init__(self, core, dev_dir, devices, vol_step_size, refresh,
+                 hotplug=False, bulk_read=False, vol_coalesce=0,
+                 dispatch_queue=0, engine=None, latency_stats=False,
+                 record_file=None, event_limit=0, action_limit=0,
+                 read_batch=0, autostart=True, refresh_min=None,
+                 refresh_max=None, keymap=None, long_press=800,
+                 trace_size=0, trace_file=None, profile=False,
+                 profile_sample=0, profile_file=None):
 
         self.core = core
+        self.engine = engine or GObjectEngine()
         self.dev_dir = dev_dir
-        self.permitted_devices = devices
+        self.permitted_devices = DeviceMatcher(devices)
         self.vol_step_size = vol_step_size
+        self.vol_coalesce = vol_coalesce
+        self.vol_target = None
+        self.vol_timestamp = None
         self.refresh = refresh
-        self.last_key_event = None
-        self.last_event = None
+
+        # The refresh period adapts between refresh_min and refresh_max:
+        # short after a device has gone, as it is likely to come back, and
+        # growing for as long as nothing changes
+        self.refresh_min = min(refresh_min or refresh, refresh)
+        self.refresh_max = max(refresh_max or refresh, refresh)
+        self.refresh_interval = refresh
+        self.refresh_soon = False
         self.curr_input_devices = {}
         self.event_sources = {}
+        self.hotplug_enabled = hotplug
+        self.hotplug = None
+        self.device_info = DeviceInfoCache()
+        self.bulk_read = bulk_read
+        self.read_batch = read_batch
+        self.readers = {}
+        self.skipped_devices = set()
+
+        # Nodes found not to be wanted are remembered, by device number and
+        # inode, so they are not probed again until they are re-created;
+        # new nodes are probed in parallel by a pool made when first needed
+        self.rejected_devices = {}
+        self.probe_pool = None
+
+        # Shadow of the core playback state kept up to date by the frontend
+        # from CoreListener events; None means unknown, in which case we
+        # have to fall back to asking core
+        self.playback_state = None
+        self.volume = None
+        self.mute = None
+
+        # Core commands are run by a worker thread when a dispatch queue is
+        # configured, so reading input never waits on core
+        self.dispatcher = None
+        if (dispatch_queue):
+            self.dispatcher = CommandDispatcher(
+                dispatch_queue, EvtDevAgent.DISPATCH_POLICIES,
+                EvtDevAgent.DISPATCH_DEDUPE_THRESHOLD)
+            self.dispatcher.start()
+
+        # Latency of each pipeline stage, measured from the kernel's event
+        # timestamp, is only recorded when asked for
+        self.latency = None
+        self.futures = FutureWatcher(self.engine)
+        if (latency_stats):
+            self.latency = LatencyStats()
+
+        # Raw events may be recorded for later replay, see record.py
+        self.recorder = None
+        if (record_file):
+            self.recorder = EventRecorder(record_file)
+            logger.info('Recording input events to %s', record_file)
 
-        # Setup dict map of ecode events to handler functions
-        self.ecode_map = {
-            evdev.ecodes.KEY_PLAYCD: self._play_pause,
-            evdev.ecodes.KEY_PLAY: self._play_pause,
-            evdev.ecodes.KEY_PLAYPAUSE: self._play_pause,
-            evdev.ecodes.KEY_PAUSE: self._play_pause,
-            evdev.ecodes.KEY_PAUSECD: self._play_pause,
-            evdev.ecodes.KEY_STOP: self._stop,
-            evdev.ecodes.KEY_STOPCD: self._stop,
-            evdev.ecodes.KEY_NEXTSONG: self._next_track,
-            evdev.ecodes.KEY_PREVIOUSSONG: self._prev_track,
-            evdev.ecodes.KEY_VOLUMEUP: self._volume_up,
-            evdev.ecodes.KEY_VOLUMEDOWN: self._volume_down,
-            evdev.ecodes.KEY_MUTE: self._mute
-        }
+        # The most recent decisions about events and devices are traced in a
+        # ring, dumped on stop when there is a trace file, see trace.py
+        self.trace = None
+        self.trace_file = trace_file
+        if (trace_size):
+            self.trace = trace_lib.TraceRing(trace_size)
+
+        # The agent's callbacks can be profiled, from start up or switched
+        # on and off while running
+        self.profiler = None
+        self.profiling = False
+        self.profile_file = profile_file
+        if (profile):
+            self._set_profiling(
+                profiling_lib.CallbackProfiler(profile_sample))
+
+        # Devices that flood us with events or actions are quarantined, i.e.
+        # no longer read, for a while
+        self.limiter = None
+        if (event_limit or action_limit):
+            self.limiter = RateLimiter(event_limit, action_limit,
+                                       EvtDevAgent.QUARANTINE_BACKOFF,
+                                       EvtDevAgent.QUARANTINE_MAX)
+
+        # Key presses are tracked separately for every device and keycode;
+        # events with no known device (e.g. replayed) share a slot
+        self.key_states = KeyStateTable(EvtDevAgent.MAX_TIME_INTERVAL)
+        self.dropping = set()
+        self._select_device(None)
+
+        # The configured bindings, on top of the default media keys, are
+        # compiled into tables indexed by key code.  Long presses and any
+        # other gesture timers all run from one timer wheel.
+        self.key_table = KeyTable(
+            [parse_binding(binding)
+             for binding in DEFAULT_KEYMAP + tuple(keymap or ())],
+            self._resolve_key, self._resolve_action)
+        self.long_press = long_press
+        self.timers = TimerWheel(self.engine)
+        self.remote_handlers = {}
+
+        # At most one seek is sent to core at a time; any asked for
+        # meanwhile only move the target, which is sent once core is done
+        self.seek_lock = threading.Lock()
+        self.seek_target = None
+        self.seek_step = None
+        self.seek_sent = None
+        self.seek_future = None
+        self.seek_time = None
+        self.seek_run = None
+
+        # Likewise for track changes, where the skips asked for meanwhile
+        # are added up and sent as one, and play/pause, where a toggle is
+        # ignored until core has acted on the last one
+        self.skip_lock = threading.Lock()
+        self.skip_pending = 0
+        self.skip_time = None
+        self.skip_seq = 0
+        self.toggle_lock = threading.Lock()
+        self.toggle_state = None
+        self.toggle_future = None
+        self.toggle_time = None
+        self.command_stats = {'skips': 0, 'skips_collapsed': 0,
+                              'toggles': 0, 'toggles_ignored': 0}
+
+        if (autostart):
+            self._start_callback()
+
+    def start(self):
+        """
+        Start watching devices without waiting for them to be discovered;
+        discovery runs from the engine as soon as it is idle.
+        """
+        tag = self.engine.timeout_add(0, self._start_callback)
+        self.event_sources['start'] = tag
+
+    def _start_callback(self):
+        self.event_sources.pop('start', None)
+        # Hotplug notifications let us react to devices as they come and go,
+        # in which case the refresh timeout only acts as a slow fallback
+        if (self.hotplug_enabled):
+            self._register_hotplug_monitor()
 
         # This will initiate a refresh of all attached devices and
         # initiate timeouts
         self._refresh_timeout_callback()
+        return False
 
     def stop(self):
         self._deregister_event_sources()
+        self._close_hotplug_monitor()
         self._close_current_input_devices()
+        if (self.dispatcher is not None):
+            logger.debug('Dispatch stats: %s', self.dispatcher.get_stats())
+            self.dispatcher.stop()
+        self.futures.stop()
+        self.timers.stop()
+        if (self.probe_pool is not None):
+            self.probe_pool.close()
+            self.probe_pool.join()
+            self.probe_pool = None
+        if (self.latency is not None):
+            self.latency.log()
+        if (self.limiter is not None):
+            logger.debug('Rate limit stats: %s', self.limiter.get_stats())
+        logger.debug('Command stats: %s', self.command_stats)
+        if (self.recorder is not None):
+            self.recorder.close()
+            self.recorder = None
+        if (self.trace is not None and self.trace_file):
+            self.dump_trace()
+        if (self.profiling):
+            self.profiler.log()
+            if (self.profile_file):
+                self.dump_profile()
 
-    @staticmethod
-    def _is_max_time_interval_elapsed(first, second):
-        return ((second.timestamp() - first.timestamp()) >
-                EvtDevAgent.MAX_TIME_INTERVAL)
+    def dump_trace(self, path=None):
+        """
+        Dump the trace to ``path``, by default the configured trace file,
+        and return the path, or None when not tracing or there is nowhere
+        to dump it.
+        """
+        if (self.trace is None):
+            return None
+        path = path or self.trace_file
+        if (not path):
+            logger.warning('Unable to dump trace: no trace_file is set')
+            return None
+        try:
+            count = self.trace.dump(path)
+        except (IOError, OSError) as e:
+            logger.warning('Unable to dump trace to %s: %s', path, e)
+            return None
+        logger.info('Dumped %d trace records to %s', count, path)
+        return path
 
-    @staticmethod
-    def _is_key_event_type(event):
-        return (event.type in evdev.events.event_factory and
-                evdev.events.event_factory[event.type] is
-                evdev.events.KeyEvent)
+    def enable_profiling(self, sample=0):
+        """
+        Start timing the agent's callbacks afresh, and profiling every
+        ``sample`` th of them with cProfile if ``sample`` is set.  Takes
+        effect from the engine, so may be called from any thread.
+        """
+        self.engine.timeout_add(0, self._set_profiling,
+                                profiling_lib.CallbackProfiler(sample))
+
+    def disable_profiling(self, dump=False):
+        """
+        Stop profiling, from the engine, keeping the statistics so far, and
+        then, if ``dump`` is set, dump the sampled profile as
+        :meth:`dump_profile` does.
+        """
+        self.engine.timeout_add(0, self._disable_profiling_callback, dump)
+
+    def _disable_profiling_callback(self, dump):
+        self._set_profiling(None)
+        if (dump):
+            self.dump_profile()
+        return False
+
+    def get_profile_stats(self):
+        if (self.profiler is None):
+            return None
+        return self.profiler.snapshot()
+
+    def dump_profile(self, path=None):
+        """
+        Dump the sampled profile to ``path``, by default the configured
+        profile file, and return the path, or None when there is no profile
+        or nowhere to dump it.
+        """
+        if (self.profiler is None or not self.profiler.sample):
+            return None
+        path = path or self.profile_file
+        if (not path):
+            logger.warning('Unable to dump profile: no profile_file is set')
+            return None
+        try:
+            path = self.profiler.dump(path)
+        except (IOError, OSError) as e:
+            logger.warning('Unable to dump profile to %s: %s', path, e)
+            return None
+        if (path is not None):
+            logger.info('Dumped profile to %s', path)
+        return path
+
+    def _set_profiling(self, profiler):
+        # Wrappers are installed over the callbacks as instance attributes,
+        # so there is no cost at all while not profiling
+        for name in EvtDevAgent.PROFILED_CALLBACKS:
+            self.__dict__.pop(name, None)
+        if (profiler is not None):
+            for name in EvtDevAgent.PROFILED_CALLBACKS:
+                setattr(self, name, profiler.wrap(name, getattr(self, name)))
+            self.profiler = profiler
+            logger.info('Profiling started')
+        elif (self.profiling):
+            self.profiler.log()
+            logger.info('Profiling stopped')
+        self.profiling = profiler is not None
+
+        # Sources already registered hold the callbacks they were given, so
+        # are registered again
+        for device_name in list(self.curr_input_devices):
+            if (device_name in self.event_sources):
+                self._deregister_event_source(device_name)
+                self._register_io_watch(device_name)
+        if ('hotplug' in self.event_sources):
+            self._deregister_event_source('hotplug')
+            self.event_sources['hotplug'] = self.engine.io_add_watch(
+                self.hotplug.fileno(), self._hotplug_callback)
+        if ('timeout' in self.event_sources):
+            self._deregister_event_source('timeout')
+            self._register_refresh_timeout()
+        return False
+
+    def get_dispatch_stats(self):
+        if (self.dispatcher is None):
+            return None
+        return self.dispatcher.get_stats()
+
+    def get_command_stats(self):
+        return dict(self.command_stats)
+
+    def get_latency_stats(self):
+        if (self.latency is None):
+            return None
+        return self.latency.snapshot()
+
+    def get_rate_limit_stats(self):
+        if (self.limiter is None):
+            return None
+        return self.limiter.get_stats()
+
+    def _perform(self, handler, timestamp=None):
+        if (self.dispatcher is None):
+            self._run_action(handler, timestamp)
+        else:
+            self.dispatcher.submit(handler.__name__, self._run_action,
+                                   handler, timestamp)
+
+    def _run_action(self, handler, timestamp):
+        # Handlers return the future of the core command they issued so the
+        # time until core has acted on it can be measured
+        if (self.latency is None or timestamp is None):
+            handler()
+            return
+        name = handler.__name__
+        self.latency.record_action(name, 'dispatch', time.time() - timestamp)
+        future = handler()
+        if (future is not None):
+            self.futures.watch(future, self._action_ack_callback, name,
+                               timestamp)
 
-    def _is_supported_ecode(self, ecode):
-        return ecode in self.ecode_map.keys()
+    def _action_ack_callback(self, value, name, timestamp):
+        self.latency.record_action(name, 'ack', time.time() - timestamp)
+
+    def update_playback_state(self, state):
+        self.playback_state = state
+
+    def update_volume(self, volume):
+        self.volume = volume
+
+    def update_mute(self, mute):
+        self.mute = mute
+
+    def _get_playback_state(self):
+        if (self.playback_state is None):
+            return self.core.playback.state.get()
+        return self.playback_state
+
+    def _get_volume(self):
+        if (self.volume is None):
+            return self.core.playback.volume.get()
+        return self.volume
+
+    def _get_mute(self):
+        if (self.mute is None):
+            return self.core.playback.mute.get()
+        return self.mute
+
+    def _select_device(self, device_name):
+        # Subsequent events are attributed to this device
+        self.current_device = device_name
+        self.current_slot = self.key_states.allocate(device_name)
 
     def _fd_ready_callback(self, source, cb_condition, input_device):
+        if (cb_condition & (IO_HUP | IO_ERR)):
+            return self._device_hung_up(input_device.fn)
+        self._select_device(input_device.fn)
+        # With a read batch set, a device with more events queued is left
+        # for the next iteration of the main loop so other devices get a
+        # look in
+        count = 0
         try:
             event = input_device.read_one()
             while (event):
-                logger.debug('Received device event: %s', event)
+                if (self.limiter is not None and
+                        not self.limiter.allow_events(input_device.fn, 1,
+                                                      time.time())):
+                    self._quarantine_device(input_device.fn)
+                    return False
+                if (self.latency is not None):
+                    self.latency.record_device(
+                        input_device.fn, 'wakeup',
+                        time.time() - event.timestamp())
+                if (self.recorder is not None):
+                    self.recorder.record(input_device.fn, event.sec,
+                                         event.usec, event.type, event.code,
+                                         event.value)
                 self._handle_key_event(event)
+                count += 1
+                if (count == self.read_batch):
+                    break
                 event = input_device.read_one()
-        except IOError:
+        except IOError as e:
             # The device has no more data or the handle has been closed
             # Either way we just ignore this here since it will get cleaned up
-            # later
-            pass
+            # later, though a real error brings the next refresh forward
+            if (e.errno not in (errno.EAGAIN, errno.EINTR)):
+                self._refresh_soon()
+        return True
+
+    def _fd_bulk_ready_callback(self, source, cb_condition, reader):
+        if (cb_condition & (IO_HUP | IO_ERR)):
+            return self._device_hung_up(reader.fn)
+        try:
+            events = reader.read(self.read_batch or None)
+        except (IOError, OSError):
+            # As above, errors are left for the next refresh to clean up
+            self._refresh_soon()
+            return True
+        if (self.limiter is not None and events and
+                not self.limiter.allow_events(reader.fn, len(events),
+                                              time.time())):
+            self._quarantine_device(reader.fn)
+            return False
+        self._select_device(reader.fn)
+        if (self.latency is not None):
+            now = time.time()
+            for event in events:
+                self.latency.record_device(
+                    reader.fn, 'wakeup', now - (event[0] + event[1] * 1e-6))
+        if (self.recorder is not None):
+            for event in events:
+                self.recorder.record(reader.fn, *event)
+        for (sec, usec, etype, code, value) in events:
+            self._handle_event(sec, usec, etype, code, value)
+        return True
+
+    def _device_hung_up(self, device_name):
+        # The device has gone or failed, so watching it would only see the
+        # hang up again.  It is closed, its watch removed by returning
+        # False, and the next refresh brought forward to open it again if
+        # its node is still there.
+        logger.info('Input device hung up: %s', device_name)
+        self.event_sources.pop(device_name, None)
+        self._close_input_device(device_name)
+        self._refresh_soon()
+        return False
+
+    def _hotplug_callback(self, source, cb_condition):
+        try:
+            changes = self.hotplug.read_changes()
+        except OSError as e:
+            logger.warning('Hotplug monitor failed, reverting to polling: %s',
+                           e)
+            # Returning False removes the source, so just forget its tag
+            self.event_sources.pop('hotplug', None)
+            self._close_hotplug_monitor()
+            return False
+        for (action, device_name) in changes:
+            logger.debug('Hotplug %s: %s', action, device_name)
+            if (action == HotplugMonitor.ADDED):
+                self._add_device(device_name)
+            elif (action == HotplugMonitor.REMOVED):
+                self._remove_device(device_name)
+            else:
+                self._reconcile_devices()
         return True
 
     def _refresh_timeout_callback(self):
-        self._cleanup_stale_devices()
-        self._open_permitted_devices()
-        self._register_io_watches()
+        self.refresh_soon = False
+        (added, removed) = self._reconcile_devices()
+        if (removed):
+            self.refresh_interval = self.refresh_min
+        elif (added):
+            self.refresh_interval = self.refresh
+        else:
+            self.refresh_interval = min(self.refresh_interval * 2,
+                                        self.refresh_max)
         self._register_refresh_timeout()
         return False
 
+    def _refresh_soon(self):
+        # Called on I/O errors, which usually mean a device has gone; the
+        # next refresh is brought forward to refresh_min, even with hotplug
+        # as a device can fail without its node going.  The timeout is only
+        # re-armed the first time so a device that keeps failing can't hold
+        # the refresh off.
+        if (not self.refresh_soon):
+            self.refresh_soon = True
+            self.refresh_interval = self.refresh_min
+            self._deregister_event_source('timeout')
+            self._register_refresh_timeout()
+
     def _handle_key_event(self, event):
-        if (EvtDevAgent._is_key_event_type(event)):
-            key_event = evdev.events.KeyEvent(event)
-
-            logger.debug('Received key event: %s', key_event)
-
-            # Allowed state transitions take the form:
-            #
-            # KEY_PRESS(n): CODE=X, STATE=DOWN/HOLD ->
-            #               KEY_PRESS(n+1): CODE=X, STATE=UP
-            #
-            # NOTES:
-            # 1) Any transition from n to n+1 where codes do not match or
-            # state does not transition from DOWN/HOLD to UP are ignored.
-            # 2) On a valid transition the last key event is cleared, else
-            # the last key event is assigned with the current key event.
-            # 3) A maximum time interval between key presses is checked and if
-            # the interval is exceeded the key press is ignored.
-
-            if (self.last_event and
-                self.last_key_event and
-                (self.last_key_event.keycode ==
-                 key_event.keycode) and
-                (self.last_key_event.keystate ==
-                 evdev.events.KeyEvent.key_down or
-                 self.last_key_event.keystate ==
-                 evdev.events.KeyEvent.key_hold) and
-                (key_event.keystate ==
-                 evdev.events.KeyEvent.key_up)):
-
-                if (EvtDevAgent._is_max_time_interval_elapsed(
-                        self.last_event, event)):
-                    logger.debug(
-                        'Detected interval too long between key presses')
-                elif (self._is_supported_ecode(key_event.scancode)):
-                    logger.debug('Received completed key press transition: %s',
-                                 key_event)
-                    self.ecode_map[key_event.scancode]()
+        self._handle_event(event.sec, event.usec, event.type, event.code,
+                           event.value)
+
+    def _handle_event(self, sec, usec, etype, code, value):
+        # Non-key events (e.g. from mice) and unbound keys are the bulk of
+        # the traffic on most hosts, so they are dropped using only integer
+        # comparisons and a table lookup before any object is constructed
+        trace = self.trace
+        if (etype != EV_KEY):
+            if (etype == EV_SYN):
+                if (code == SYN_DROPPED):
+                    if (trace is not None):
+                        trace.record(sec, usec, self.current_slot, etype,
+                                     code, value, trace_lib.DROPPED)
+                    self._start_resync()
+                elif (code == SYN_REPORT and self.dropping and
+                        self.current_slot in self.dropping):
+                    # Only the end of a whole report, not of one contact's
+                    # part of it (SYN_MT_REPORT), ends the resync
+                    if (trace is not None):
+                        trace.record(sec, usec, self.current_slot, etype,
+                                     code, value, trace_lib.RESYNC)
+                    self._resync(sec, usec)
+            return
+        key_table = self.key_table
+        if (code >= len(key_table.bound) or not key_table.bound[code]):
+            if (trace is not None):
+                trace.record(sec, usec, self.current_slot, etype, code,
+                             value, trace_lib.UNBOUND)
+            return
+        if (self.dropping and self.current_slot in self.dropping):
+            if (trace is not None):
+                trace.record(sec, usec, self.current_slot, etype, code,
+                             value, trace_lib.RESYNCING)
+            return
+
+        # Allowed state transitions, for each device and keycode X, take
+        # the form:
+        #
+        # KEY_PRESS(n): CODE=X, STATE=DOWN/HOLD ->
+        #               KEY_PRESS(n+1): CODE=X, STATE=UP
+        #
+        # NOTES:
+        # 1) Events for other keys or devices in between do not affect the
+        # transition, so overlapping presses on one device and presses
+        # interleaved across devices are all recognised.
+        # 2) An UP without a preceding DOWN/HOLD is ignored.
+        # 3) A maximum time interval between key presses is checked and if
+        # the interval is exceeded the key press is ignored.
+        # 4) Keys without a binding never take part in a transition.
+        # 5) A key going DOWN while the other keys of a chord are held
+        # performs the chord, and a key still held long_press ms after going
+        # DOWN performs its long press; either way the keys involved then
+        # do nothing when they come UP.
+        # 6) A key bound to a hold performs it on every repeat while it is
+        # held, and then does nothing when it comes UP.  Only the first
+        # repeat counts towards the action limit, so a hold is limited as
+        # the single key press it is.
+
+        slot = self.current_slot
+        result = self.key_states.update(slot, code, sec, usec, value)
+        handler = None
+        limit = True
+        decision = trace_lib.KEY
+        if (value == KEY_DOWN):
+            chords = key_table.chords[code]
+            if (chords is not None):
+                handler = self._match_chord(slot, chords)
+            if (handler is not None):
+                decision = trace_lib.CHORD
+            elif (key_table.long[code] is not None):
+                self.timers.schedule(self.long_press,
+                                     self._long_press_callback,
+                                     self.current_device, slot, code,
+                                     self.key_states.get(slot,
+                                                         code).presses)
+        elif (value == KEY_HOLD):
+            handler = key_table.hold[code]
+            if (handler is not None):
+                state = self.key_states.get(slot, code)
+                if (state.holding or not state.consumed):
+                    limit = not state.holding
+                    state.consumed = True
+                    state.holding = True
+                    decision = trace_lib.HOLD
                 else:
-                    logger.debug('Received unsupported key press event: %s',
-                                 key_event)
-                self.last_key_event = None
-                self.last_event = None
+                    handler = None
+        elif (result == KeyStateTable.EXPIRED):
+            decision = trace_lib.EXPIRED
+        elif (result == KeyStateTable.COMPLETE):
+            decision = trace_lib.COMPLETE
+            handler = key_table.press[code]
+        # Every key event is traced with what was made of it, before the
+        # action it performs
+        if (trace is not None):
+            trace.record(sec, usec, slot, etype, code, value, decision)
+        if (handler is not None):
+            self._trigger(handler, sec, usec, limit)
+
+    def _match_chord(self, slot, chords):
+        # Returns the handler of the chord completed, if any, whose keys
+        # then do nothing when they come up
+        for (codes, handler) in chords:
+            for code in codes:
+                if (not self.key_states.is_down(slot, code)):
+                    break
             else:
-                self.last_key_event = key_event
-                self.last_event = event
+                for code in codes:
+                    self.key_states.get(slot, code).consumed = True
+                return handler
+        return None
+
+    def _long_press_callback(self, device_name, slot, code, presses):
+        # The key must still be down from the same press, on the same device
+        if (self.key_states.names.get(device_name) != slot):
+            return
+        state = self.key_states.get(slot, code)
+        if (not self.key_states.is_down(slot, code) or
+                state.presses != presses or state.consumed):
+            return
+        if (self.trace is not None):
+            self.trace.record_now(slot, EV_KEY, code, state.value,
+                                  trace_lib.LONG)
+        state.consumed = True
+        self.current_device = device_name
+        self._trigger(self.key_table.long[code], state.sec, state.usec)
+
+    def _trigger(self, handler, sec, usec, limit=True):
+        timestamp = None
+        if (self.latency is not None):
+            timestamp = sec + usec * 1e-6
+        self._dispatch(handler, timestamp, limit)
+
+    def _dispatch(self, handler, timestamp, limit=True):
+        if (limit and not self._allow_action()):
+            return
+        if (timestamp is not None):
+            self.latency.record_device(self.current_device, 'complete',
+                                       time.time() - timestamp)
+        self._perform(handler, timestamp)
+
+    def _allow_action(self):
+        if (self.limiter is not None and
+                not self.limiter.allow_action(self.current_device,
+                                              time.time())):
+            self._quarantine_device(self.current_device)
+            return False
+        return True
+
+    def perform_action(self, device_name, action, arg=None, gesture=PRESS,
+                       timestamp=None):
+        """
+        Perform an action triggered by a key on a device that some other
+        process reads, e.g. the broker, as if it had come from one of our
+        own devices.
+        """
+        try:
+            key = self._parse_remote_action(action, arg, gesture)
+        except ValueError as e:
+            logger.warning('Ignoring action from %s: %s', device_name, e)
+            return
+        handler = self.remote_handlers.get(key)
+        if (handler is None):
+            handler = self._resolve_action(*key)
+            if (handler is None):
+                return
+            if (len(self.remote_handlers) >= EvtDevAgent.REMOTE_HANDLERS):
+                # Arguments make for any number of keys, so rather than
+                # grow without bound the handlers are resolved afresh
+                self.remote_handlers.clear()
+            self.remote_handlers[key] = handler
+        self.current_device = device_name
+        if (self.latency is None):
+            timestamp = None
+        # Holds were limited where the device is read, and we can't tell
+        # their first repeat from the rest
+        self._dispatch(handler, timestamp, gesture != HOLD)
+
+    def _parse_remote_action(self, action, arg, gesture):
+        # Actions from other processes are checked as key bindings are,
+        # with any argument taken as text, and anything else is rejected
+        if (not isinstance(action, basestring)):
+            raise ValueError('Invalid action %r' % (action,))
+        if (gesture is None):
+            gesture = PRESS
+        elif (gesture not in (PRESS, LONG, HOLD)):
+            raise ValueError('Unknown key gesture %r' % (gesture,))
+        if (arg is not None):
+            if (isinstance(arg, bool) or
+                    not isinstance(arg, (basestring, int, long))):
+                raise ValueError('Invalid argument %r for action %r' %
+                                 (arg, action))
+            arg = unicode(arg)
+        return (action, parse_action(action, arg), gesture)
+
+    def _resolve_key(self, name):
+        if (name.isdigit()):
+            return int(name)
+        code = getattr(evdev.ecodes, name, None)
+        if (not isinstance(code, int)):
+            return None
+        return code
+
+    def _resolve_action(self, action, arg, gesture=PRESS):
+        method = ACTIONS[action]
+        if (gesture == HOLD):
+            method = HOLD_ACTIONS.get(action, method)
+        if (method is None):
+            return None
+        handler = getattr(self, method)
+        if (arg is None):
+            return handler
+
+        def bound_handler():
+            return handler(arg)
+
+        # Dispatch policies and statistics go by the handler's name
+        bound_handler.__name__ = handler.__name__
+        return bound_handler
+
+    def _start_resync(self):
+        # The device's buffer overflowed so the kernel dropped events; the
+        # rest of the current report is discarded and the key state read
+        # back from the device at its end
+        logger.info('Input events dropped by %s, resynchronising',
+                    self.current_device)
+        self.dropping.add(self.current_slot)
+
+    def _resync(self, sec, usec):
+        self.dropping.discard(self.current_slot)
+        active = ()
+        device = self.curr_input_devices.get(self.current_device)
+        if (device is not None):
+            try:
+                active = device.active_keys()
+            except (IOError, OSError) as e:
+                logger.debug('Unable to read keys from %s: %s',
+                             self.current_device, e)
+        self.key_states.resync(self.current_slot,
+                               [c for c in active
+                                if self.key_table.is_bound(c)],
+                               sec, usec)
 
     def _play_pause(self):
-        state = self.core.playback.state.get()
-        if (state == PlaybackState.PLAYING):
-            self.core.playback.pause()
-            logger.info('Paused playback')
-        elif (state == PlaybackState.PAUSED):
-            self.core.playback.resume()
-            logger.info('Resumed playback')
-        else:
-            self.core.playback.play()
-            logger.info('Started playback')
+        # A toggle is only acted on once core has acknowledged the last one
+        # and, when we are told of state changes, the state has changed;
+        # otherwise it would be based on the state the last toggle changed
+        with self.toggle_lock:
+            if (self.toggle_time is not None and
+                    time.time() - self.toggle_time <
+                    EvtDevAgent.TOGGLE_TIMEOUT and
+                    (self.toggle_future is not None or
+                     self.playback_state == self.toggle_state)):
+                self.command_stats['toggles_ignored'] += 1
+                logger.debug('Ignored play/pause: last one in progress')
+                return None
+            from mopidy.core import PlaybackState
+            state = self._get_playback_state()
+            if (state == PlaybackState.PLAYING):
+                future = self.core.playback.pause()
+                logger.info('Paused playback')
+            elif (state == PlaybackState.PAUSED):
+                future = self.core.playback.resume()
+                logger.info('Resumed playback')
+            else:
+                future = self.core.playback.play()
+                logger.info('Started playback')
+            self.command_stats['toggles'] += 1
+            self.toggle_state = state
+            self.toggle_future = future
+            self.toggle_time = time.time()
+            self.futures.watch(future, self._toggle_ack_callback, future)
+        return future
+
+    def _toggle_ack_callback(self, value, future):
+        with self.toggle_lock:
+            if (future is self.toggle_future):
+                self.toggle_future = None
 
     def _stop(self):
-        self.core.playback.stop()
+        future = self.core.playback.stop()
         logger.info('Stopped playback')
+        return future
 
     def _volume_up(self):
-        volume = self.core.playback.volume.get()
-        if (volume is not None):
-            volume = min(100, volume + self.vol_step_size)
-            self.core.playback.set_volume(volume)
-            self.core.playback.set_mute(False)
-            logger.info('Set volume +%d to %d',
-                        self.vol_step_size, volume)
+        return self._change_volume(self.vol_step_size)
 
     def _volume_down(self):
-        volume = self.core.playback.volume.get()
-        if (volume is not None):
-            volume = max(0, volume - self.vol_step_size)
-            self.core.playback.set_volume(volume)
+        return self._change_volume(-self.vol_step_size)
+
+    def _change_volume(self, step):
+        # Steps are accumulated onto a pending target which is only sent to
+        # core once the coalescing window closes, so a burst of presses
+        # costs a single set_volume().  Each step is clamped individually
+        # to behave exactly as if every press had been sent.
+        volume = self.vol_target
+        if (volume is None):
+            volume = self._get_volume()
+            if (volume is None):
+                return None
+        self.vol_target = max(0, min(100, volume + step))
+        if (not self.vol_coalesce):
+            return self._set_volume()
+        if ('volume' not in self.event_sources):
+            self.vol_timestamp = time.time()
+            tag = self.engine.timeout_add(self.vol_coalesce,
+                                          self._volume_timeout_callback)
+            self.event_sources['volume'] = tag
+        return None
+
+    def _volume_timeout_callback(self):
+        self.event_sources.pop('volume', None)
+        self._perform(self._set_volume, self.vol_timestamp)
+        return False
+
+    def _set_volume(self):
+        volume = self.vol_target
+        if (volume is None):
+            return None
+        self.vol_target = None
+        future = self.core.playback.set_volume(volume)
+        if (self.volume is not None):
+            self.volume = volume
+        if (self.mute is not False):
             self.core.playback.set_mute(False)
-            logger.info('Set volume -%d to %d',
-                        self.vol_step_size, volume)
+            if (self.mute is not None):
+                self.mute = False
+        logger.info('Set volume to %d', volume)
+        return future
 
     def _mute(self):
-        mute = self.core.playback.mute.get()
+        mute = self._get_mute()
         if (mute is not None):
             state = {True: 'on', False: 'off'}
             mute = not mute
-            self.core.playback.set_mute(mute)
             logger.info('Set mute: %s', state[mute])
+            return self.core.playback.set_mute(mute)
+        return None
 
     def _next_track(self):
-        self.core.playback.next()
-        logger.info('Selected next track')
+        return self._skip(1)
 
     def _prev_track(self):
-        self.core.playback.previous()
-        logger.info('Selected previous track')
+        return self._skip(-1)
 
-    @staticmethod
-    def _open_device_list(devices):
-        return map(evdev.device.InputDevice, devices)
+    def _skip(self, count):
+        # Only one track change is sent to core at a time; skips asked for
+        # meanwhile (negative ones going back) are added up and sent as one
+        # once core is done
+        with self.skip_lock:
+            now = time.time()
+            if (self.skip_time is not None and
+                    now - self.skip_time < EvtDevAgent.SKIP_TIMEOUT):
+                self.skip_pending += count
+                self.command_stats['skips_collapsed'] += 1
+                return None
+            count += self.skip_pending
+            self.skip_pending = 0
+            self.skip_time = now
+            self.skip_seq += 1
+            seq = self.skip_seq
+        # Sent without the lock held, as skipping several tracks has to ask
+        # core where to
+        future = self._change_track(count)
+        if (future is None):
+            with self.skip_lock:
+                if (seq == self.skip_seq):
+                    self.skip_time = None
+        else:
+            self.command_stats['skips'] += 1
+            self.futures.watch(future, self._skip_ack_callback, seq)
+        return future
+
+    def _skip_ack_callback(self, value, seq):
+        with self.skip_lock:
+            if (seq != self.skip_seq):
+                return
+            self.skip_time = None
+            if (not self.skip_pending):
+                return
+        # Called from the engine, so the skips are sent as any other command
+        self._perform(self._flush_skips)
+
+    def _flush_skips(self):
+        with self.skip_lock:
+            if (self.skip_time is not None or not self.skip_pending):
+                return None
+        return self._skip(0)
+
+    def _change_track(self, count):
+        if (count == 1):
+            future = self.core.playback.next()
+            logger.info('Selected next track')
+        elif (count == -1):
+            future = self.core.playback.previous()
+            logger.info('Selected previous track')
+        elif (count):
+            future = self._skip_tracks(count)
+        else:
+            future = None
+        return future
+
+    def _skip_tracks(self, count):
+        # While playing, the track ``count`` tracks on (as the tracklist's
+        # modes have it) is played straight away instead of changing track
+        # once for each, which would start every track in between.  Core
+        # is asked where that is a track at a time, each answer being
+        # picked up by the future watcher so we never wait on core.
+        # Otherwise, or where core can't tell us (before Mopidy 0.19),
+        # core is asked to change track once for each.
+        from mopidy.core import PlaybackState
+        playback = self.core.playback
+        step = getattr(self.core.tracklist,
+                       'next_track' if count > 0 else 'previous_track', None)
+        if (step is None or
+                self._get_playback_state() != PlaybackState.PLAYING):
+            change = playback.next if count > 0 else playback.previous
+            for i in range(abs(count)):
+                future = change()
+            logger.info('Skipped %d tracks', count)
+            return future
+        done = pykka.ThreadingFuture()
+        self.futures.watch(playback.current_tl_track,
+                           self._skip_current_callback, done, step, count)
+        return done
+
+    def _skip_current_callback(self, value, done, step, count):
+        if (isinstance(value, Exception)):
+            done.set_exception((type(value), value, None))
+            return
+        self._skip_step_callback(value, done, step, count, abs(count),
+                                 value, value)
+
+    def _skip_step_callback(self, value, done, step, count, remaining,
+                            current, target):
+        if (isinstance(value, Exception)):
+            done.set_exception((type(value), value, None))
+            return
+        if (value is not None):
+            target = value
+            if (remaining):
+                self.futures.watch(step(target), self._skip_step_callback,
+                                   done, step, count, remaining - 1, current,
+                                   target)
+                return
+        if (target is None or target == current):
+            # Nowhere to go, which core deals with as for a single skip
+            future = self._change_track(1 if count > 0 else -1)
+        else:
+            logger.info('Skipped %d tracks', count)
+            future = self.core.playback.play(tl_track=target)
+        self.futures.watch(future, self._chain_done_callback, done)
+
+    def _chain_done_callback(self, value, done):
+        # Settles the future handed back for a chain of core calls
+        if (isinstance(value, Exception)):
+            done.set_exception((type(value), value, None))
+        else:
+            done.set(value)
+
+    def _quarantine_device(self, device_name):
+        # The device is left open, but not read, until the quarantine ends
+        if (device_name not in self.event_sources):
+            return
+        self._deregister_event_source(device_name)
+        self.key_states.reset(self.key_states.allocate(device_name))
+        delay = self.limiter.quarantine(device_name, time.time())
+        logger.warning('Quarantined %s for %.0f seconds: too many events',
+                       device_name, delay)
+        if (self.trace is not None):
+            self._trace_device(device_name, trace_lib.QUARANTINE, int(delay))
+        tag = self.engine.timeout_add(int(delay * 1000),
+                                      self._quarantine_timeout_callback,
+                                      device_name)
+        self.event_sources[('quarantine', device_name)] = tag
+
+    def _quarantine_timeout_callback(self, device_name):
+        self.event_sources.pop(('quarantine', device_name), None)
+        if (device_name in self.curr_input_devices):
+            logger.info('Released %s from quarantine', device_name)
+            if (self.trace is not None):
+                self._trace_device(device_name, trace_lib.RELEASE)
+            self._discard_pending_events(device_name)
+            self.limiter.release(device_name)
+            self._register_io_watch(device_name)
+        return False
+
+    def _discard_pending_events(self, device_name):
+        # Whatever queued up while quarantined is stale
+        try:
+            reader = self.readers.get(device_name)
+            if (reader is not None):
+                reader.read()
+            else:
+                device = self.curr_input_devices[device_name]
+                while (device.read_one()):
+                    pass
+        except (IOError, OSError):
+            pass
+
+    def _seek_forward(self, step=None):
+        return self._seek(step or EvtDevAgent.SEEK_STEP)
+
+    def _seek_backward(self, step=None):
+        return self._seek(-(step or EvtDevAgent.SEEK_STEP))
+
+    def _seek(self, step):
+        # Seeks build on the last position asked for while it may not have
+        # been reached yet.  Otherwise core is asked where playback is, any
+        # steps taken until the future watcher picks up its answer adding
+        # up, so we never wait on core.
+        with self.seek_lock:
+            if (self.seek_target is not None):
+                return self._seek_to(max(0, self.seek_target + step))
+            if (self.seek_step is not None):
+                self.seek_step += step
+                return None
+            self.seek_step = step
+        done = pykka.ThreadingFuture()
+        self.futures.watch(self.core.playback.time_position,
+                           self._seek_position_callback, done)
+        return done
+
+    def _seek_position_callback(self, position, done):
+        with self.seek_lock:
+            step = self.seek_step
+            self.seek_step = None
+            if (isinstance(position, Exception)):
+                done.set_exception((type(position), position, None))
+                return
+            if (position is None):
+                done.set(None)
+                return
+            future = self._seek_to(max(0, position + step))
+        if (future is None):
+            done.set(None)
+        else:
+            self.futures.watch(future, self._chain_done_callback, done)
+
+    def _hold_seek_forward(self, step=None):
+        return self._hold_seek(step or EvtDevAgent.SEEK_STEP)
+
+    def _hold_seek_backward(self, step=None):
+        return self._hold_seek(-(step or EvtDevAgent.SEEK_STEP))
+
+    def _hold_seek(self, step):
+        # The first repeat of a hold seeks one step, after which the
+        # position moves on by a step for every second held, twice as fast
+        # for every SEEK_ACCEL_PERIOD held up to SEEK_ACCEL_MAX times.
+        # Going by the time passed rather than counting repeats means any
+        # repeats dropped along the way are made up for.
+        now = time.time()
+        run = self.seek_run
+        if (run is None or now - run[1] > EvtDevAgent.SEEK_HOLD_GAP or
+                (run[2] > 0) != (step > 0)):
+            self.seek_run = [now, now, step]
+            return self._seek(step)
+        speed = min(2 ** int((now - run[0]) / EvtDevAgent.SEEK_ACCEL_PERIOD),
+                    EvtDevAgent.SEEK_ACCEL_MAX)
+        elapsed = now - run[1]
+        run[1] = now
+        return self._seek(int(step * speed * elapsed))
+
+    def _seek_to(self, position):
+        # Called with the seek lock held
+        self.seek_target = position
+        if (self.seek_future is not None and
+                time.time() - self.seek_time < EvtDevAgent.SEEK_TIMEOUT):
+            return None
+        return self._send_seek()
+
+    def _send_seek(self):
+        position = self.seek_target
+        logger.info('Seek to %d ms', position)
+        future = self.core.playback.seek(position)
+        self.seek_sent = position
+        self.seek_future = future
+        self.seek_time = time.time()
+        self.futures.watch(future, self._seek_ack_callback, future)
+        return future
+
+    def _seek_ack_callback(self, value, future):
+        with self.seek_lock:
+            if (future is not self.seek_future):
+                return
+            self.seek_future = None
+            if (self.seek_target != self.seek_sent):
+                self._send_seek()
+            else:
+                self.seek_target = None
+
+    def _toggle_random(self):
+        return self._toggle_mode('random')
+
+    def _toggle_repeat(self):
+        return self._toggle_mode('repeat')
+
+    def _toggle_single(self):
+        return self._toggle_mode('single')
+
+    def _toggle_mode(self, mode):
+        # Core is asked for the mode and then to set the opposite once the
+        # future watcher has picked up its answer, so we never wait on core
+        done = pykka.ThreadingFuture()
+        self.futures.watch(getattr(self.core.tracklist, mode),
+                           self._toggle_mode_callback, done, mode)
+        return done
+
+    def _toggle_mode_callback(self, value, done, mode):
+        if (isinstance(value, Exception)):
+            done.set_exception((type(value), value, None))
+            return
+        value = not value
+        logger.info('Set %s: %s', mode, value)
+        future = getattr(self.core.tracklist, 'set_' + mode)(value)
+        self.futures.watch(future, self._chain_done_callback, done)
+
+    def _shuffle(self):
+        future = self.core.tracklist.shuffle()
+        logger.info('Shuffled tracklist')
+        return future
+
+    def _clear_tracklist(self):
+        future = self.core.tracklist.clear()
+        logger.info('Cleared tracklist')
+        return future
+
+    def _load_playlist(self, uri):
+        done = pykka.ThreadingFuture()
+        self.futures.watch(self.core.playlists.lookup(uri),
+                           self._load_playlist_callback, done, uri)
+        return done
+
+    def _load_playlist_callback(self, playlist, done, uri):
+        if (isinstance(playlist, Exception)):
+            done.set_exception((type(playlist), playlist, None))
+            return
+        if (playlist is None):
+            logger.warning('Playlist not found: %s', uri)
+            done.set(None)
+            return
+        self.core.tracklist.clear()
+        self.core.tracklist.add(tracks=playlist.tracks)
+        logger.info('Loaded playlist %s', playlist.name)
+        self.futures.watch(self.core.playback.play(),
+                           self._chain_done_callback, done)
 
     def _close_input_device(self, device_name):
+        if (self.trace is not None):
+            self._trace_device(device_name, trace_lib.CLOSE)
+        self.readers.pop(device_name, None)
+        self.dropping.discard(self.key_states.names.get(device_name))
+        self.key_states.release(device_name)
+        self._deregister_event_source(('quarantine', device_name))
+        if (self.limiter is not None):
+            self.limiter.forget(device_name)
         try:
             device = self.curr_input_devices.pop(device_name)
             device.close()
         except OSError:
             pass
 
+    @staticmethod
+    def _node_key(device_name):
+        try:
+            st = os.stat(device_name)
+        except OSError:
+            return None
+        return (st.st_rdev, st.st_ino)
+
+    def _is_rejected_device(self, device_name):
+        key = self.rejected_devices.get(device_name)
+        if (key is None):
+            return False
+        if (key == self._node_key(device_name)):
+            return True
+        del self.rejected_devices[device_name]
+        return False
+
+    def _reject_device(self, device_name, key):
+        # Nodes that could not be identified are probed again next time
+        if (key is not None):
+            self.rejected_devices[device_name] = key
+        return None
+
+    def _open_permitted_device(self, device_name):
+        # Where the kernel publishes the device identity and capabilities in
+        # sysfs we can decide whether a device is wanted without opening it
+        key = self._node_key(device_name)
+        info = self.device_info.lookup(device_name)
+        if (info is not None and
+                (not self._is_permitted_device(info) or
+                 not self._is_capable_device(info))):
+            return self._reject_device(device_name, key)
+        try:
+            device = evdev.device.InputDevice(device_name)
+        except (OSError, IOError) as e:
+            # Typically the node exists but udev has not yet granted us
+            # access to it; a later refresh or IN_ATTRIB will retry
+            logger.debug('Unable to open %s: %s', device_name, e)
+            return None
+        if ((info is None and not self._is_permitted_device(device)) or
+                ((info is None or info.key_codes is None) and
+                 not self._is_capable_device(device))):
+            device.close()
+            return self._reject_device(device_name, key)
+        return device
+
+    def _add_device(self, device_name):
+        if (device_name in self.curr_input_devices):
+            return
+        self.device_info.invalidate(device_name)
+        self.rejected_devices.pop(device_name, None)
+        device = self._open_permitted_device(device_name)
+        if (device is not None):
+            self.curr_input_devices[device_name] = device
+            self._register_io_watch(device_name)
+            logger.info('Added input device: %s', device_name)
+
+    def _remove_device(self, device_name):
+        self.device_info.invalidate(device_name)
+        self.rejected_devices.pop(device_name, None)
+        self.skipped_devices.discard(device_name)
+        if (device_name in self.curr_input_devices):
+            self._deregister_event_source(device_name)
+            self._close_input_device(device_name)
+            logger.info('Removed input device: %s', device_name)
+
+    def _register_hotplug_monitor(self):
+        try:
+            self.hotplug = HotplugMonitor(self.dev_dir)
+        except OSError as e:
+            logger.warning('Hotplug detection unavailable for %s: %s',
+                           self.dev_dir, e)
+            return
+        tag = self.engine.io_add_watch(self.hotplug.fileno(),
+                                       self._hotplug_callback)
+        self.event_sources['hotplug'] = tag
+
+    def _close_hotplug_monitor(self):
+        if (self.hotplug is not None):
+            self.hotplug.close()
+            self.hotplug = None
+
+    def _get_refresh_period(self):
+        if (self.refresh_soon):
+            return self.refresh_min
+        if (self.hotplug is not None):
+            return max(self.refresh_interval, EvtDevAgent.HOTPLUG_REFRESH)
+        return self.refresh_interval
+
     def _register_refresh_timeout(self):
-        tag = gobject.timeout_add(int(self.refresh * 1000),
-                                  self._refresh_timeout_callback)
+        tag = self.engine.timeout_add(
+            int(self._get_refresh_period() * 1000),
+            self._refresh_timeout_callback)
         self.event_sources['timeout'] = tag
-        logger.debug('Event sources: %s', self.event_sources)
 
-    def _register_io_watches(self):
-        for device_name in self.curr_input_devices.keys():
-            if (device_name not in self.event_sources.keys()):
-                logger.debug('Adding io watch for: %s', device_name)
-                device = self.curr_input_devices[device_name]
-                tag = gobject.io_add_watch(device.fd, gobject.IO_IN,
-                                           self._fd_ready_callback,
-                                           device)
-                self.event_sources[device_name] = tag
-        logger.debug('Event sources: %s', self.event_sources)
+    def _register_io_watch(self, device_name):
+        if (device_name not in self.event_sources):
+            if (self.trace is not None):
+                self._trace_device(device_name, trace_lib.WATCH)
+            device = self.curr_input_devices[device_name]
+            priority = self._get_watch_priority(device_name)
+            if (self.bulk_read):
+                reader = EventReader(device.fd, device_name)
+                self.readers[device_name] = reader
+                tag = self.engine.io_add_watch(device.fd,
+                                               self._fd_bulk_ready_callback,
+                                               reader, priority=priority)
+            else:
+                tag = self.engine.io_add_watch(device.fd,
+                                               self._fd_ready_callback,
+                                               device, priority=priority)
+            self.event_sources[device_name] = tag
+
+    def _trace_device(self, device_name, decision, value=0):
+        slot = self.key_states.allocate(device_name)
+        self.trace.name_slot(slot, device_name)
+        self.trace.record_now(slot, 0, 0, value, decision)
+
+    def _get_watch_priority(self, device_name):
+        # When reading in batches, devices that can't emit any key we handle
+        # (such as explicitly permitted mice) are only read once devices
+        # with keys have been
+        if (not self.read_batch):
+            return PRIORITY_DEFAULT
+        info = self.device_info.lookup(device_name)
+        if (info is not None and info.key_codes is not None):
+            key_codes = info.key_codes
+        else:
+            device = self.curr_input_devices[device_name]
+            try:
+                key_codes = device.capabilities().get(EV_KEY, [])
+            except (IOError, OSError):
+                return PRIORITY_DEFAULT
+        for code in key_codes:
+            if (self.key_table.is_bound(code)):
+                return PRIORITY_DEFAULT
+        return PRIORITY_LOW
 
     def _deregister_event_source(self, source):
         tag = self.event_sources.pop(source, None)
         if (tag is not None):
-            gobject.source_remove(tag)
+            self.engine.source_remove(tag)
 
     def _deregister_event_sources(self):
         for source in self.event_sources.keys():
             self._deregister_event_source(source)
 
-    def _cleanup_stale_devices(self):
-        device_list = evdev.util.list_devices(self.dev_dir)
-        for device_name in self.curr_input_devices.keys():
-            if (device_name not in device_list):
-                self._deregister_event_source(device_name)
-                self._close_input_device(device_name)
-
-    def _open_permitted_devices(self):
-        available_input_devices = \
-            EvtDevAgent._open_device_list(
-                evdev.util.list_devices(self.dev_dir))
-        for device in available_input_devices:
-            # We allow permitted devices to be a reference by their
-            # device path, name or physical address for flexibility.
-            #
-            # EXAMPLES:
-            #
-            # 1) 'isa0060/serio0/input0' is a physical device instance
-            # which is a keyboard called 'AT Translated Set 2 keyboard'.
-            # 2) 'AT Translated Set 2 keyboard' would permit all
-            # physical devices that share this name.
-            # 3) '00:11:67:D2:AB:EE' is a device name for bluetooth; sadly
-            # evdev does not see this as its physical address which would be
-            # more logical (real name is actually 'BTS-06' but this is not
-            # available from evdev).
-            if ((not self.permitted_devices or
-                 unicode(device.fn) in self.permitted_devices or
-                 unicode(device.name) in self.permitted_devices or
-                 unicode(device.phys) in self.permitted_devices
-                 ) and device.fn not in self.curr_input_devices.keys()):
-                self.curr_input_devices[device.fn] = device
-            else:
-                device.close()
-            logger.debug('Registered devices: %s',
-                         self.curr_input_devices.keys())
+    def _is_permitted_device(self, device):
+        # We allow permitted devices to be a reference by their
+        # device path, name, physical address or unique id for flexibility.
+        #
+        # EXAMPLES:
+        #
+        # 1) 'isa0060/serio0/input0' is a physical device instance
+        # which is a keyboard called 'AT Translated Set 2 keyboard'.
+        # 2) 'AT Translated Set 2 keyboard' would permit all
+        # physical devices that share this name.
+        # 3) '00:11:67:D2:AB:EE' is a device name for bluetooth; sadly
+        # evdev does not see this as its physical address which would be
+        # more logical (real name is actually 'BTS-06' but this is not
+        # available from evdev).  The kernel usually reports the same
+        # address as the device's unique id.
+        #
+        # Globs and regular expressions (prefixed with 're:') may be used
+        # to permit whole families of devices, see DeviceMatcher.
+        return (not self.permitted_devices or
+                self.permitted_devices.match(
+                    unicode(device.fn), unicode(device.name),
+                    unicode(device.phys),
+                    unicode(getattr(device, 'uniq', None))))
+
+    def _is_capable_device(self, device):
+        # Devices that were explicitly permitted are always watched, but
+        # when watching everything there is no point waking up for mice,
+        # touchpads or accelerometers that can't emit any key we handle.
+        # Capabilities missing from sysfs are resolved after opening.
+        if (self.permitted_devices):
+            return True
+        if (isinstance(device, DeviceInfo)):
+            key_codes = device.key_codes
+            if (key_codes is None):
+                return True
+        else:
+            key_codes = device.capabilities().get(EV_KEY, [])
+        for code in key_codes:
+            if (self.key_table.is_bound(code)):
+                self.skipped_devices.discard(device.fn)
+                return True
+        if (device.fn not in self.skipped_devices):
+            self.skipped_devices.add(device.fn)
+            logger.info('Skipping %s (%s): no supported key codes',
+                        device.fn, device.name)
+        return False
+
+    def _reconcile_devices(self):
+        # A single directory listing is diffed against the open devices;
+        # only nodes that have appeared are probed and only nodes that have
+        # gone are closed, so steady state costs one stat per node that is
+        # not wanted
+        device_list = set(evdev.util.list_devices(self.dev_dir))
+        curr_devices = set(self.curr_input_devices)
+        removed = curr_devices - device_list
+        for device_name in removed:
+            self._deregister_event_source(device_name)
+            self._close_input_device(device_name)
+        self.device_info.prune(device_list)
+        self.skipped_devices &= device_list
+        for device_name in set(self.rejected_devices) - device_list:
+            del self.rejected_devices[device_name]
+        added = set()
+        new_devices = [device_name
+                       for device_name in device_list - curr_devices
+                       if not self._is_rejected_device(device_name)]
+        for (device_name, device) in zip(new_devices,
+                                         self._probe_devices(new_devices)):
+            if (device is not None):
+                self.curr_input_devices[device_name] = device
+                self._register_io_watch(device_name)
+                added.add(device_name)
+        if (added or removed):
+            logger.debug('Registered devices: %s (added %s, removed %s)',
+                         self.curr_input_devices.keys(), added, removed)
+        return (added, removed)
+
+    def _probe_devices(self, device_names):
+        # Opening a device can block for a while (e.g. while udev is still
+        # setting it up), so when several appear at once, typically on
+        # startup, they are probed in parallel
+        if (len(device_names) < 2):
+            return [self._open_permitted_device(device_name)
+                    for device_name in device_names]
+        if (self.probe_pool is None):
+            from multiprocessing.pool import ThreadPool
+            self.probe_pool = ThreadPool(EvtDevAgent.PROBE_THREADS)
+        return self.probe_pool.map(self._open_permitted_device, device_names)
 
     def _close_current_input_devices(self):
         logger.debug('Closing: %s',
@@ -0,0 +1,404 @@
+from __future__ import unicode_literals
+
+import argparse
+import collections
+import errno
+import json
+import logging
+import os
+import signal
+import socket
+
+from .agent import EvtDevAgent
+from .engine import EpollEngine
+from .keymap import ACTIONS, PRESS, parse_binding
+from .matcher import DeviceMatcher
+
+logger = logging.getLogger(__name__)
+
+# Made, if need be, in a directory of its own that only the broker's user
+# and group may use
+DEFAULT_SOCKET = '/run/mopidy-evtdev/broker.sock'
+
+# An action published by the broker for a key on one of its devices
+Action = collections.namedtuple('Action', ['action', 'arg', 'gesture'])
+
+
+def encode(message):
+    """Encode a message as one line of JSON."""
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode('ascii')
+
+
+def decode_lines(buf, data):
+    """
+    Split ``data`` appended to the partial line ``buf`` into messages.
+    Returns ``(messages, buf)`` where ``buf`` holds whatever follows the
+    last complete line; lines which are not valid JSON are skipped.
+    """
+    lines = (buf + data).split(b'\n')
+    messages = []
+    for line in lines[:-1]:
+        if (not line.strip()):
+            continue
+        try:
+            messages.append(json.loads(line.decode('utf-8')))
+        except ValueError:
+            logger.warning('Ignoring malformed message: %r', line)
+    return (messages, lines[-1])
+
+
+class PublishingAgent(EvtDevAgent):
+    """
+    An agent which, instead of performing the actions its devices' keys
+    are bound to, passes them to ``publish(identity, action, timestamp)``.
+    ``identity`` is the device's ``(path, name, phys, uniq)`` and ``action``
+    an :class:`Action`.
+
+    The agent never touches core, so it is given none.
+    """
+
+    def __init__(self, publish, *args, **kwargs):
+        self.publish = publish
+        super(PublishingAgent, self).__init__(None, *args, **kwargs)
+
+    def _resolve_action(self, action, arg, gesture=PRESS):
+        if (ACTIONS[action] is None):
+            return None
+        return Action(action, arg, gesture)
+
+    def _trigger(self, action, sec, usec, limit=True):
+        if (limit and not self._allow_action()):
+            return
+        self.publish(self._identify(self.current_device), action,
+                     sec + usec * 1e-6)
+
+    def _identify(self, device_name):
+        device = self.curr_input_devices.get(device_name)
+        if (device is None):
+            return (device_name or '', '', '', '')
+        return (unicode(device.fn), unicode(device.name),
+                unicode(device.phys), unicode(getattr(device, 'uniq', '')))
+
+
+class BrokerServer(object):
+    """
+    Publishes actions to the subscribers connected to a Unix domain
+    socket.
+
+    A subscriber first sends a line ``{"devices": [<pattern>, ...]}`` with
+    the devices it wants actions for, matched as by the ``devices``
+    setting (an empty list meaning all of them), and from then on is sent
+    a line for each action::
+
+        {"device": <path>, "name": <name>, "phys": <phys>, "uniq": <uniq>,
+         "action": <action>, "arg": <arg>, "gesture": <gesture>,
+         "time": <timestamp>}
+
+    The socket is only open to the broker's user and group.  Sends never
+    block: a subscriber that has fallen so far behind that
+    :attr:`SNDBUF` bytes are waiting for it is disconnected, as by the
+    time it caught up its actions would be stale anyway, and picks up
+    from the latest once it reconnects.
+    """
+
+    SNDBUF = 16384   # bytes
+
+    def __init__(self, engine, path):
+        self.engine = engine
+        self.path = path
+        self.sock = None
+        self.tag = None
+        self.subscribers = {}
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        if (os.path.exists(self.path)):
+            # Only a socket left behind by a broker that has gone away may
+            # be replaced
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.unlink(self.path)
+            else:
+                raise IOError(errno.EADDRINUSE, 'Broker already running',
+                              self.path)
+            finally:
+                probe.close()
+        directory = os.path.dirname(self.path)
+        if (directory and not os.path.isdir(directory)):
+            os.makedirs(directory, 0o750)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o660)
+        self.sock.listen(16)
+        self.tag = self.engine.io_add_watch(self.sock.fileno(),
+                                            self._accept_callback)
+        logger.info('Broker listening on %s', self.path)
+
+    def stop(self):
+        for fd in list(self.subscribers.keys()):
+            self._close_subscriber(fd)
+        if (self.sock is not None):
+            self.engine.source_remove(self.tag)
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def get_stats(self):
+        return {'subscribers': len(self.subscribers),
+                'published': self.published,
+                'dropped': self.dropped}
+
+    def publish(self, identity, action, timestamp):
+        data = None
+        for (fd, subscriber) in list(self.subscribers.items()):
+            matcher = subscriber[2]
+            if (matcher is None or (matcher and not matcher.match(*identity))):
+                continue
+            if (data is None):
+                (path, name, phys, uniq) = identity
+                data = encode({'device': path, 'name': name, 'phys': phys,
+                               'uniq': uniq, 'action': action.action,
+                               'arg': action.arg, 'gesture': action.gesture,
+                               'time': timestamp})
+            try:
+                sent = subscriber[0].send(data)
+            except socket.error as e:
+                if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                    sent = 0
+                else:
+                    logger.debug('Lost subscriber %d: %s', fd, e)
+                    self._close_subscriber(fd)
+                    continue
+            if (sent < len(data)):
+                # Its backlog is full, and a partly sent line would corrupt
+                # the stream anyway
+                logger.warning('Dropping subscriber %d: too far behind', fd)
+                self.dropped += 1
+                self._close_subscriber(fd)
+                continue
+            self.published += 1
+
+    def _accept_callback(self, source, cb_condition):
+        try:
+            (sock, address) = self.sock.accept()
+        except socket.error as e:
+            if (e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                logger.warning('Failed to accept subscriber: %s', e)
+            return True
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                        BrokerServer.SNDBUF)
+        fd = sock.fileno()
+        tag = self.engine.io_add_watch(fd, self._subscriber_callback, fd)
+        # Socket, io watch tag, device matcher (None until subscribed) and
+        # partial line received
+        self.subscribers[fd] = [sock, tag, None, b'']
+        return True
+
+    def _subscriber_callback(self, source, cb_condition, fd):
+        subscriber = self.subscribers.get(fd)
+        if (subscriber is None):
+            return False
+        try:
+            data = subscriber[0].recv(4096)
+        except socket.error as e:
+            if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                return True
+            data = b''
+        if (not data):
+            logger.debug('Subscriber %d disconnected', fd)
+            self._close_subscriber(fd)
+            return False
+        (messages, subscriber[3]) = decode_lines(subscriber[3], data)
+        for message in messages:
+            if (isinstance(message, dict) and 'devices' in message):
+                subscriber[2] = DeviceMatcher(message['devices'])
+                logger.info('Subscriber %d subscribed to %s', fd,
+                            message['devices'] or 'all devices')
+        return True
+
+    def _close_subscriber(self, fd):
+        subscriber = self.subscribers.pop(fd, None)
+        if (subscriber is not None):
+            self.engine.source_remove(subscriber[1])
+            subscriber[0].close()
+
+
+class BrokerClient(object):
+    """
+    Subscribes to the actions for ``devices`` from the broker listening on
+    ``path``, calling ``callback(message)`` from the engine for each one.
+    The broker is reconnected to, every ``retry`` milliseconds, whenever
+    it is not there.
+    """
+
+    RETRY = 2000   # milliseconds
+
+    def __init__(self, engine, path, devices, callback, retry=RETRY):
+        self.engine = engine
+        self.path = path
+        self.devices = list(devices or [])
+        self.callback = callback
+        self.retry = retry
+        self.sock = None
+        self.tag = None
+        self.buf = b''
+        self.warned = False
+
+    def start(self):
+        if (not self._connect()):
+            self._schedule_retry()
+
+    def stop(self):
+        self._disconnect()
+        if (self.tag is not None):
+            self.engine.source_remove(self.tag)
+            self.tag = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(encode({'devices': self.devices}))
+        except socket.error as e:
+            sock.close()
+            # Only warn once until we have been connected again
+            if (not self.warned):
+                logger.warning('Unable to connect to broker at %s: %s',
+                               self.path, e)
+                self.warned = True
+            return False
+        sock.setblocking(False)
+        self.sock = sock
+        self.buf = b''
+        self.warned = False
+        self.tag = self.engine.io_add_watch(sock.fileno(),
+                                            self._read_callback)
+        logger.info('Connected to broker at %s', self.path)
+        return True
+
+    def _disconnect(self):
+        if (self.sock is not None):
+            self.sock.close()
+            self.sock = None
+
+    def _schedule_retry(self):
+        self.tag = self.engine.timeout_add(self.retry,
+                                           self._retry_timeout_callback)
+
+    def _retry_timeout_callback(self):
+        if (self._connect()):
+            return False
+        return True
+
+    def _read_callback(self, source, cb_condition):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as e:
+            if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                return True
+            data = b''
+        if (not data):
+            logger.warning('Lost connection to broker at %s', self.path)
+            self._disconnect()
+            self._schedule_retry()
+            return False
+        (messages, self.buf) = decode_lines(self.buf, data)
+        for message in messages:
+            try:
+                self.callback(message)
+            except Exception:
+                logger.exception('Failed to handle message from broker')
+        return True
+
+
+def _binding(text):
+    try:
+        parse_binding(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def add_agent_arguments(parser):
+    """Add the options for a :class:`PublishingAgent` to ``parser``."""
+    parser.add_argument('--dev-dir', default='/dev/input')
+    parser.add_argument('--device', action='append', default=[],
+                        help='device pattern to read, as for "devices" '
+                             '(default: all devices with bound keys)')
+    parser.add_argument('--refresh', type=int, default=10)
+    parser.add_argument('--hotplug', action='store_true')
+    parser.add_argument('--keymap', action='append', default=[],
+                        type=_binding, help='key binding, as for "keymap"')
+    parser.add_argument('--long-press', type=int, default=800)
+    parser.add_argument('--event-limit', type=int, default=1000)
+    parser.add_argument('--action-limit', type=int, default=20)
+    parser.add_argument('--verbose', '-v', action='store_true')
+
+
+def parse_args(parser, argv=None):
+    """Parse the command line and set up logging as it asks."""
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(levelname)-8s %(name)s %(message)s')
+    return args
+
+
+def run_agent(args, engine, publish):
+    """
+    Read devices with a :class:`PublishingAgent` configured from ``args``,
+    passing the actions to ``publish``, until interrupted or terminated.
+    """
+    agent = PublishingAgent(publish, args.dev_dir, args.device, 0,
+                            args.refresh, hotplug=args.hotplug,
+                            bulk_read=True, engine=engine,
+                            event_limit=args.event_limit,
+                            action_limit=args.action_limit,
+                            autostart=False, keymap=args.keymap,
+                            long_press=args.long_press)
+    engine.start()
+    agent.start()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    try:
+        while (not stopping):
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    agent.stop()
+
+
+def main(argv=None):
+    """
+    Run a broker which reads the input devices on this host and publishes
+    the actions their keys perform to the Mopidy instances subscribed to
+    it.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m mopidy_evtdev.broker',
+        description='Publish input device key actions to Mopidy-EvtDev.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='socket to listen on (default: %(default)s)')
+    add_agent_arguments(parser)
+    args = parse_args(parser, argv)
+
+    engine = EpollEngine()
+    server = BrokerServer(engine, args.socket)
+    server.start()
+    run_agent(args, engine, server.publish)
+    server.stop()
+    engine.stop()
+    logger.info('Broker stopped: %s', server.get_stats())
+
+
+if __name__ == '__main__':
+    main()
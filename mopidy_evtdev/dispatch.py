@@ -0,0 +1,112 @@
+from __future__ import unicode_literals
+
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CommandDispatcher(object):
+    """
+    Runs commands on a dedicated worker thread, fed from a bounded queue, so
+    whoever submits them never waits on Mopidy core.
+
+    Each command has a name which selects its queueing policy:
+
+    - :attr:`FIFO` queues every command (the default),
+    - :attr:`LATEST` replaces a command of the same name that is still
+      queued, e.g. only the most recent volume target matters,
+    - :attr:`DEDUPE` drops the command if ``dedupe_threshold`` commands of
+      the same name are already queued, e.g. repeated play/pause toggles.
+
+    Commands are dropped rather than blocking when the queue is full.
+    """
+
+    FIFO = 'fifo'
+    LATEST = 'latest'
+    DEDUPE = 'dedupe'
+
+    def __init__(self, maxsize, policies=None, dedupe_threshold=1):
+        self.maxsize = maxsize
+        self.policies = policies or {}
+        self.dedupe_threshold = dedupe_threshold
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.submitted = 0
+        self.executed = 0
+        self.replaced = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run,
+                                       name='EvtDevDispatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        with self.cond:
+            self.running = False
+            self.queue.clear()
+            self.cond.notify()
+        if (self.thread is not None):
+            self.thread.join(timeout)
+            self.thread = None
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def get_stats(self):
+        return {'depth': self.depth, 'max_depth': self.max_depth,
+                'submitted': self.submitted, 'executed': self.executed,
+                'replaced': self.replaced, 'dropped': self.dropped}
+
+    def submit(self, name, func, *args):
+        """
+        Queue ``func(*args)`` to run on the worker thread.  Returns ``False``
+        if the command was dropped.
+        """
+        policy = self.policies.get(name, CommandDispatcher.FIFO)
+        with self.cond:
+            self.submitted += 1
+            if (policy == CommandDispatcher.LATEST):
+                for (i, command) in enumerate(self.queue):
+                    if (command[0] == name):
+                        self.queue[i] = (name, func, args)
+                        self.replaced += 1
+                        return True
+            elif (policy == CommandDispatcher.DEDUPE):
+                queued = sum(1 for command in self.queue
+                             if command[0] == name)
+                if (queued >= self.dedupe_threshold):
+                    self.dropped += 1
+                    logger.debug('Dropped duplicate command: %s', name)
+                    return False
+            if (len(self.queue) >= self.maxsize):
+                self.dropped += 1
+                logger.warning('Command queue full (%d), dropped: %s',
+                               self.maxsize, name)
+                return False
+            self.queue.append((name, func, args))
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while (self.running and not self.queue):
+                    self.cond.wait()
+                if (not self.running):
+                    return
+                (name, func, args) = self.queue.popleft()
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Command %s failed', name)
+            self.executed += 1
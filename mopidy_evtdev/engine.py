@@ -0,0 +1,225 @@
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Watch priorities, with the same values (and meaning) as GLib's: when
+# several watches are ready, those with the lowest value are served first
+PRIORITY_DEFAULT = 0
+PRIORITY_LOW = 300
+
+# Conditions passed to io callbacks, with the same values as GLib's (and
+# epoll's)
+IO_IN = 1
+IO_ERR = 8
+IO_HUP = 16
+
+
+class GObjectEngine(object):
+    """
+    Runs the agent's io watches and timeouts from the GLib main loop that
+    Mopidy already iterates.
+
+    Callbacks follow the GLib conventions: io callbacks are called with
+    ``(fd, condition, *args)``, timeout callbacks with ``(*args)``, and
+    returning ``False`` removes the source.  Io watches are called when the
+    fd is readable, hung up or in error, and may be given a ``priority``.
+    """
+
+    def __init__(self):
+        # Imported here so the broker and gateway nodes, which use epoll,
+        # don't need GLib
+        import gobject
+        self.gobject = gobject
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def io_add_watch(self, fd, callback, *args, **kwargs):
+        priority = kwargs.get('priority', PRIORITY_DEFAULT)
+        gobject = self.gobject
+        return gobject.io_add_watch(
+            fd, gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR, callback,
+            *args, priority=priority)
+
+    def timeout_add(self, interval, callback, *args):
+        return self.gobject.timeout_add(interval, callback, *args)
+
+    def source_remove(self, tag):
+        self.gobject.source_remove(tag)
+
+
+class EpollEngine(object):
+    """
+    Runs the agent's io watches and timeouts from a dedicated thread with
+    its own ``epoll`` loop, so input latency does not depend on how busy
+    the GLib main loop is.
+
+    Watches and timeouts may be added or removed from any thread; a wakeup
+    pipe makes the loop pick up changes immediately.  Callbacks use the same
+    conventions as :class:`GObjectEngine`; every ready watch is called once
+    per iteration of the loop, in order of priority.
+    """
+
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.epoll.register(self.wakeup_r, select.EPOLLIN)
+        self.lock = threading.RLock()
+        self.tags = itertools.count(1)
+        self.watches = {}
+        self.fds = {}
+        self.timeouts = {}
+        self.timers = []
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run,
+                                       name='EvtDevEpollEngine')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        self.running = False
+        self._wakeup()
+        if (self.thread is not None and
+                self.thread is not threading.current_thread()):
+            self.thread.join(timeout)
+        self.thread = None
+        self.epoll.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+    def io_add_watch(self, fd, callback, *args, **kwargs):
+        priority = kwargs.get('priority', PRIORITY_DEFAULT)
+        with self.lock:
+            tag = next(self.tags)
+            self.epoll.register(fd, select.EPOLLIN)
+            self.watches[tag] = (fd, callback, args, priority)
+            self.fds[fd] = tag
+        return tag
+
+    def timeout_add(self, interval, callback, *args):
+        with self.lock:
+            tag = next(self.tags)
+            self.timeouts[tag] = (interval, callback, args)
+            self._schedule(tag, interval)
+        self._wakeup()
+        return tag
+
+    def source_remove(self, tag):
+        with self.lock:
+            watch = self.watches.pop(tag, None)
+            if (watch is not None):
+                fd = watch[0]
+                if (self.fds.get(fd) == tag):
+                    del self.fds[fd]
+                    try:
+                        self.epoll.unregister(fd)
+                    except (IOError, OSError, ValueError):
+                        # Already closed, which also removes it from epoll
+                        pass
+            self.timeouts.pop(tag, None)
+
+    def _schedule(self, tag, interval):
+        heapq.heappush(self.timers, (time.time() + interval / 1000.0, tag))
+
+    def _wakeup(self):
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except OSError as e:
+            if (e.errno != errno.EAGAIN):
+                raise
+
+    def _drain_wakeup(self):
+        try:
+            while (os.read(self.wakeup_r, 4096)):
+                pass
+        except OSError as e:
+            if (e.errno != errno.EAGAIN):
+                raise
+
+    def _next_timeout(self):
+        with self.lock:
+            while (self.timers and self.timers[0][1] not in self.timeouts):
+                heapq.heappop(self.timers)
+            if (not self.timers):
+                return -1
+            return max(0, self.timers[0][0] - time.time())
+
+    def _invoke(self, tag, callback, *args):
+        try:
+            keep = callback(*args)
+        except Exception:
+            logger.exception('Engine callback failed')
+            keep = False
+        if (not keep):
+            self.source_remove(tag)
+        return keep
+
+    def _run_timers(self):
+        now = time.time()
+        while True:
+            with self.lock:
+                if (not self.timers or self.timers[0][0] > now):
+                    return
+                tag = heapq.heappop(self.timers)[1]
+                timeout = self.timeouts.get(tag)
+            if (timeout is None):
+                continue
+            (interval, callback, args) = timeout
+            if (self._invoke(tag, callback, *args)):
+                with self.lock:
+                    if (tag in self.timeouts):
+                        self._schedule(tag, interval)
+
+    def _run(self):
+        while (self.running):
+            try:
+                events = self.epoll.poll(self._next_timeout())
+            except (IOError, OSError) as e:
+                if (e.errno == errno.EINTR):
+                    continue
+                raise
+            ready = []
+            for (fd, mask) in events:
+                if (fd == self.wakeup_r):
+                    self._drain_wakeup()
+                    continue
+                with self.lock:
+                    tag = self.fds.get(fd)
+                    watch = self.watches.get(tag)
+                if (watch is not None):
+                    ready.append((watch[3], fd, mask, tag))
+            ready.sort()
+            for (_, fd, mask, tag) in ready:
+                with self.lock:
+                    watch = self.watches.get(tag)
+                if (watch is None):
+                    # Removed by an earlier callback
+                    continue
+                (_, callback, args, _) = watch
+                if (self._invoke(tag, callback, fd, mask, *args) and
+                        mask & (select.EPOLLHUP | select.EPOLLERR)):
+                    # The device has gone; stop polling it rather than spin
+                    # until it is cleaned up and its watch removed
+                    logger.debug('Removing watch for hung up fd %d', fd)
+                    self.source_remove(tag)
+            self._run_timers()
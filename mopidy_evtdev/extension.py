@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import imp
+import os
+
+from mopidy import config, ext, exceptions
+
+from . import __version__
+from .keymap import parse_binding
+
+
+class Keymap(config.List):
+    """
+    Config value for a list of key bindings, one per line, as accepted by
+    :func:`parse_binding`.
+    """
+
+    def deserialize(self, value):
+        values = super(Keymap, self).deserialize(value)
+        for binding in values:
+            parse_binding(binding)
+        return values
+
+
+class Extension(ext.Extension):
+
+    dist_name = 'Mopidy-EvtDev'
+    ext_name = 'evtdev'
+    version = __version__
+
+    def get_default_config(self):
+        conf_file = os.path.join(os.path.dirname(__file__), 'ext.conf')
+        return config.read(conf_file)
+
+    def get_config_schema(self):
+        schema = super(Extension, self).get_config_schema()
+        schema['dev_dir'] = config.Path()
+        schema['devices'] = config.List(optional=True)
+        schema['refresh'] = config.Integer(minimum=1)
+        schema['refresh_min'] = config.Integer(minimum=1, optional=True)
+        schema['refresh_max'] = config.Integer(minimum=1, optional=True)
+        schema['hotplug'] = config.Boolean()
+        schema['bulk_read'] = config.Boolean()
+        schema['vol_step_size'] = config.Integer(minimum=1, maximum=25)
+        schema['vol_coalesce'] = config.Integer(minimum=0, maximum=1000)
+        schema['dispatch_queue'] = config.Integer(minimum=0, maximum=1000)
+        schema['engine'] = config.String(choices=['gobject', 'epoll'])
+        schema['latency_stats'] = config.Boolean()
+        schema['record_file'] = config.Path(optional=True)
+        schema['event_limit'] = config.Integer(minimum=0)
+        schema['action_limit'] = config.Integer(minimum=0)
+        schema['read_batch'] = config.Integer(minimum=0)
+        schema['keymap'] = Keymap(optional=True)
+        schema['long_press'] = config.Integer(minimum=100, maximum=5000)
+        schema['broker_socket'] = config.Path(optional=True)
+        schema['gateway_host'] = config.Hostname()
+        schema['gateway_port'] = config.Port(optional=True)
+        schema['gateway_secret'] = config.Secret(optional=True)
+        schema['trace_size'] = config.Integer(minimum=0)
+        schema['trace_file'] = config.Path(optional=True)
+        schema['profile'] = config.Boolean()
+        schema['profile_sample'] = config.Integer(minimum=0)
+        schema['profile_file'] = config.Path(optional=True)
+        schema['trace_signal'] = config.String(
+            optional=True, choices=['SIGHUP', 'SIGUSR2'])
+        schema['profile_signal'] = config.String(
+            optional=True, choices=['SIGHUP', 'SIGUSR2'])
+        return schema
+
+    def validate_environment(self):
+        # Only look for evdev here; it is imported once the frontend starts
+        try:
+            imp.find_module('evdev')
+        except ImportError as e:
+            raise exceptions.ExtensionError('Unable to find evdev module', e)
+
+    def setup(self, registry):
+        from .frontend import EvtDevFrontend
+        registry.add('frontend', EvtDevFrontend)
@@ -1,27 +1,215 @@
 from __future__ import unicode_literals
 
 import logging
+import signal
+import time
+
 import pykka
-from agent import EvtDevAgent
+from mopidy.core import CoreListener
 
 logger = logging.getLogger(__name__)
 
 
-class EvtDevFrontend(pykka.ThreadingActor):
+def dump_traces(signum=None, frame=None):
+    """Ask every running frontend to dump its trace, e.g. on a signal."""
+    for ref in pykka.ActorRegistry.get_by_class(EvtDevFrontend):
+        ref.proxy().dump_trace()
+
+
+def toggle_profiling(signum=None, frame=None):
+    """Switch profiling of every running frontend on or off."""
+    for ref in pykka.ActorRegistry.get_by_class(EvtDevFrontend):
+        ref.proxy().toggle_profiling()
+
+
+def _handle_signal(name, handler):
+    if (not name):
+        return
+    try:
+        signal.signal(getattr(signal, name), handler)
+    except (AttributeError, ValueError) as e:
+        logger.warning('Unable to handle %s: %s', name, e)
+
+
+class EvtDevFrontend(pykka.ThreadingActor, CoreListener):
 
     def __init__(self, config, core):
         super(EvtDevFrontend, self).__init__()
+        self.config = config
+        self.core = core
+        self.engine = None
+        self.agent = None
+        self.broker = None
+        self.gateway = None
+        self.profiling = False
+
+        # Signals are only handled if configured to be, as the handlers are
+        # the whole process's; only the main thread, in which Mopidy makes
+        # its frontends, may set them
+        _handle_signal(config['evtdev']['trace_signal'], dump_traces)
+        _handle_signal(config['evtdev']['profile_signal'], toggle_profiling)
+
+    def on_start(self):
+        # Everything is set up from the actor's own thread, and devices are
+        # then discovered from the engine, so neither importing evdev nor
+        # probing devices holds up Mopidy's startup
+        from .agent import EvtDevAgent
+        from .engine import EpollEngine, GObjectEngine
+
+        config = self.config
         dev_dir = config['evtdev']['dev_dir']
         devices = config['evtdev']['devices']
         vol_step_size = config['evtdev']['vol_step_size']
         refresh = config['evtdev']['refresh']
+        refresh_min = config['evtdev']['refresh_min']
+        refresh_max = config['evtdev']['refresh_max']
+        hotplug = config['evtdev']['hotplug']
+        bulk_read = config['evtdev']['bulk_read']
+        vol_coalesce = config['evtdev']['vol_coalesce']
+        dispatch_queue = config['evtdev']['dispatch_queue']
+        latency_stats = config['evtdev']['latency_stats']
+        record_file = config['evtdev']['record_file']
+        event_limit = config['evtdev']['event_limit']
+        action_limit = config['evtdev']['action_limit']
+        read_batch = config['evtdev']['read_batch']
+        keymap = config['evtdev']['keymap']
+        long_press = config['evtdev']['long_press']
+        broker_socket = config['evtdev']['broker_socket']
+        gateway_host = config['evtdev']['gateway_host']
+        gateway_port = config['evtdev']['gateway_port']
+        gateway_secret = config['evtdev']['gateway_secret']
+        trace_size = config['evtdev']['trace_size']
+        trace_file = config['evtdev']['trace_file']
+        profile = config['evtdev']['profile']
+        profile_sample = config['evtdev']['profile_sample']
+        profile_file = config['evtdev']['profile_file']
+        self.profiling = profile
+
+        # The engine runs the agent's io watches and timeouts, either from
+        # Mopidy's GLib main loop or from our own epoll thread
+        if (config['evtdev']['engine'] == 'epoll'):
+            self.engine = EpollEngine()
+        else:
+            self.engine = GObjectEngine()
+        self.engine.start()
 
         # EvtDevAgent performs all the handling of device
         # key presses on our behalf
-        self.agent = EvtDevAgent(core, dev_dir, devices,
-                                 vol_step_size, refresh)
+        self.agent = EvtDevAgent(self.core, dev_dir, devices,
+                                 vol_step_size, refresh,
+                                 hotplug=hotplug, bulk_read=bulk_read,
+                                 vol_coalesce=vol_coalesce,
+                                 dispatch_queue=dispatch_queue,
+                                 engine=self.engine,
+                                 latency_stats=latency_stats,
+                                 record_file=record_file,
+                                 event_limit=event_limit,
+                                 action_limit=action_limit,
+                                 read_batch=read_batch,
+                                 autostart=False,
+                                 refresh_min=refresh_min,
+                                 refresh_max=refresh_max,
+                                 keymap=keymap, long_press=long_press,
+                                 trace_size=trace_size,
+                                 trace_file=trace_file,
+                                 profile=profile,
+                                 profile_sample=profile_sample,
+                                 profile_file=profile_file)
+
+        # Seed the agent's shadow of the playback state; from here on it is
+        # kept up to date by the CoreListener events below so that key
+        # presses never have to wait on core
+        state = self.core.playback.state
+        volume = self.core.playback.volume
+        mute = self.core.playback.mute
+        self.agent.update_playback_state(state.get())
+        self.agent.update_volume(volume.get())
+        self.agent.update_mute(mute.get())
+
+        # With a broker, it reads the devices and we only perform the
+        # actions it sends us for the devices we are configured for
+        if (broker_socket):
+            from .broker import BrokerClient
+            if (keymap):
+                logger.warning('Ignoring keymap: key bindings are the '
+                               'broker\'s when broker_socket is set')
+            self.broker = BrokerClient(self.engine, broker_socket, devices,
+                                       self._broker_callback)
+            self.broker.start()
+        else:
+            self.agent.start()
+
+        # Gateway nodes forward the actions for devices on other hosts
+        if (gateway_port):
+            from .gateway import GatewayReceiver
+            self.gateway = GatewayReceiver(self.engine, gateway_host,
+                                           gateway_port,
+                                           self._gateway_callback,
+                                           gateway_secret)
+            self.gateway.start()
         logger.info('EvtDevAgent started')
 
+    def _broker_callback(self, message):
+        self.agent.perform_action(message.get('device'), message['action'],
+                                  message.get('arg'), message.get('gesture'),
+                                  message.get('time'))
+
+    def _gateway_callback(self, node, action):
+        # Devices are named after their node, so they can't be mistaken for
+        # one of ours, and their timestamps are from our own clock
+        self.agent.perform_action('%s:%s' % (node, action.get('device')),
+                                  action['action'], action.get('arg'),
+                                  action.get('gesture'),
+                                  time.time() - action.get('age', 0))
+
+    def dump_trace(self, path=None):
+        return self.agent.dump_trace(path)
+
+    def set_profiling(self, enabled, sample=None):
+        """
+        Switch profiling of the agent's callbacks on, afresh, or off.  The
+        configured ``profile_sample`` is used unless ``sample`` is given;
+        when switched off the sampled profile, if any, is dumped once the
+        agent has stopped adding to it.
+        """
+        if (enabled):
+            if (sample is None):
+                sample = self.config['evtdev']['profile_sample']
+            self.agent.enable_profiling(sample)
+        elif (self.profiling):
+            self.agent.disable_profiling(dump=True)
+        self.profiling = enabled
+
+    def toggle_profiling(self):
+        self.set_profiling(not self.profiling)
+
+    def get_profile_stats(self):
+        return self.agent.get_profile_stats()
+
+    def dump_profile(self, path=None):
+        return self.agent.dump_profile(path)
+
+    def get_dispatch_stats(self):
+        return self.agent.get_dispatch_stats()
+
+    def get_command_stats(self):
+        return self.agent.get_command_stats()
+
+    def get_latency_stats(self):
+        return self.agent.get_latency_stats()
+
+    def get_rate_limit_stats(self):
+        return self.agent.get_rate_limit_stats()
+
+    def playback_state_changed(self, old_state, new_state):
+        self.agent.update_playback_state(new_state)
+
+    def volume_changed(self, volume):
+        self.agent.update_volume(volume)
+
+    def mute_changed(self, mute):
+        self.agent.update_mute(mute)
+
     def on_stop(self):
         """
         Hook for doing any cleanup that should be done *after* the actor has
@@ -36,5 +224,10 @@ class EvtDevFrontend(pykka.ThreadingActor):
         If an exception is raised by this method the stack trace will be
         logged, and the actor will stop.
         """
+        if (self.broker is not None):
+            self.broker.stop()
+        if (self.gateway is not None):
+            self.gateway.stop()
         self.agent.stop()
+        self.engine.stop()
         logger.info('EvtDevAgent stopped')
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+import pykka
+
+logger = logging.getLogger(__name__)
+
+
+class FutureWatcher(object):
+    """
+    Calls back when Pykka futures resolve, without ever blocking on them.
+
+    Pending futures are polled from a single engine timeout which only runs
+    while there is something to watch.  Callbacks are invoked from the
+    engine as ``callback(value, *args)``; a future that failed is passed
+    its exception as the value.
+    """
+
+    POLL_INTERVAL = 10   # milliseconds
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.pending = []
+        self.lock = threading.Lock()
+        self.tag = None
+
+    def watch(self, future, callback, *args):
+        with self.lock:
+            self.pending.append((future, callback, args))
+            if (self.tag is None):
+                self.tag = self.engine.timeout_add(
+                    FutureWatcher.POLL_INTERVAL, self._poll_timeout_callback)
+
+    def stop(self):
+        with self.lock:
+            self.pending = []
+            if (self.tag is not None):
+                self.engine.source_remove(self.tag)
+                self.tag = None
+
+    def _poll_timeout_callback(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        waiting = []
+        for (future, callback, args) in pending:
+            try:
+                value = future.get(timeout=0)
+            except pykka.Timeout:
+                waiting.append((future, callback, args))
+                continue
+            except Exception as e:
+                value = e
+            try:
+                callback(value, *args)
+            except Exception:
+                logger.exception('Future callback failed')
+        with self.lock:
+            self.pending.extend(waiting)
+            if (not self.pending):
+                self.tag = None
+                return False
+        return True
@@ -0,0 +1,478 @@
+from __future__ import unicode_literals
+
+import argparse
+import collections
+import errno
+import hmac
+import logging
+import random
+import socket
+import time
+
+from .broker import (add_agent_arguments, decode_lines, encode, parse_args,
+                     run_agent)
+from .engine import EpollEngine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 6690
+
+# Node and Mopidy exchange lines of JSON over one TCP connection.  The node
+# introduces itself with
+#
+#   {"hello": <node>, "session": <session>, "secret": <secret>}
+#
+# and then sends batches of actions
+#
+#   {"seq": <n>, "actions": [{"device": <path>, "name": <name>, ...,
+#                             "action": <action>, "arg": <arg>,
+#                             "gesture": <gesture>, "age": <seconds>}, ...]}
+#
+# which Mopidy acknowledges with {"ack": <n>}, meaning every batch up to n
+# of the session.  The session is chosen afresh whenever the node starts,
+# so its batches are numbered from 1 again.
+
+
+def _action_message(identity, action, age):
+    (path, name, phys, uniq) = identity
+    return {'device': path, 'name': name, 'phys': phys, 'uniq': uniq,
+            'action': action.action, 'arg': action.arg,
+            'gesture': action.gesture, 'age': age}
+
+
+class GatewaySender(object):
+    """
+    Forwards actions published by a :class:`~.broker.PublishingAgent` on a
+    node to the Mopidy gateway at ``host``:``port``, over a single
+    connection that is kept open and reconnected to whenever it is lost.
+
+    Actions are gathered for up to :attr:`BATCH_DELAY` milliseconds into
+    numbered batches.  At most :attr:`WINDOW` batches are sent ahead of
+    the acknowledgements, with at most :attr:`MAX_PENDING` actions queued
+    behind them, the oldest being dropped when Mopidy can't keep up.
+    Batches that are not acknowledged are sent again after reconnecting,
+    Mopidy ignoring those it already had, but any action older than
+    :attr:`MAX_AGE` seconds is dropped rather than sent late.
+    """
+
+    BATCH_DELAY = 10      # milliseconds
+    BATCH_SIZE = 16
+    WINDOW = 4
+    MAX_PENDING = 64
+    MAX_AGE = 2.0         # seconds
+    RETRY = 2000          # milliseconds
+    CONNECT_TIMEOUT = 2.0
+
+    def __init__(self, engine, host, port, node, secret=None):
+        self.engine = engine
+        self.address = (host, port)
+        self.node = node
+        self.secret = secret
+        self.session = '%08x' % random.getrandbits(32)
+        self.seq = 0
+        self.pending = collections.deque()
+        self.unacked = collections.OrderedDict()
+        self.sock = None
+        self.read_tag = None
+        self.retry_tag = None
+        self.flush_tag = None
+        self.buf = b''
+        self.out = b''
+        self.warned = False
+        self.stats = {'sent': 0, 'acked': 0, 'stale': 0, 'overflow': 0,
+                      'connects': 0}
+
+    def start(self):
+        if (not self._connect()):
+            self._schedule_retry()
+
+    def stop(self):
+        self._disconnect()
+        for tag in (self.retry_tag, self.flush_tag):
+            if (tag is not None):
+                self.engine.source_remove(tag)
+        self.retry_tag = None
+        self.flush_tag = None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = len(self.pending)
+        stats['unacked'] = len(self.unacked)
+        return stats
+
+    def publish(self, identity, action, timestamp):
+        if (len(self.pending) >= GatewaySender.MAX_PENDING):
+            self.pending.popleft()
+            self.stats['overflow'] += 1
+        self.pending.append((identity, action, timestamp))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if (self.flush_tag is None and self.sock is not None):
+            self.flush_tag = self.engine.timeout_add(
+                GatewaySender.BATCH_DELAY, self._flush_timeout_callback)
+
+    def _flush_timeout_callback(self):
+        self.flush_tag = None
+        self._flush()
+        return False
+
+    def _flush(self):
+        if (self.sock is None or not self._send_out()):
+            return
+        now = time.time()
+        while (self.pending and len(self.unacked) < GatewaySender.WINDOW):
+            batch = []
+            while (self.pending and len(batch) < GatewaySender.BATCH_SIZE):
+                item = self.pending.popleft()
+                if (now - item[2] > GatewaySender.MAX_AGE):
+                    self.stats['stale'] += 1
+                else:
+                    batch.append(item)
+            if (batch):
+                self.seq += 1
+                self.unacked[self.seq] = batch
+                if (not self._send_batch(self.seq, batch, now)):
+                    return
+
+    def _send_batch(self, seq, batch, now):
+        self.out += encode({
+            'seq': seq,
+            'actions': [_action_message(identity, action, now - timestamp)
+                        for (identity, action, timestamp) in batch]})
+        self.stats['sent'] += 1
+        return self._send_out()
+
+    def _send_out(self):
+        # Returns False while there is still data waiting to be sent, in
+        # which case we try again shortly
+        while (self.out):
+            try:
+                sent = self.sock.send(self.out)
+            except socket.error as e:
+                if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                    self._schedule_flush()
+                    return False
+                self._lost(e)
+                return False
+            self.out = self.out[sent:]
+        return True
+
+    def _connect(self):
+        # The node does nothing else, so waiting briefly on the connection
+        # only holds up actions that would be stale by the time they went
+        try:
+            sock = socket.create_connection(self.address,
+                                            GatewaySender.CONNECT_TIMEOUT)
+        except socket.error as e:
+            if (not self.warned):
+                logger.warning('Unable to connect to gateway at %s:%d: %s',
+                               self.address[0], self.address[1], e)
+                self.warned = True
+            return False
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        self.sock = sock
+        self.buf = b''
+        self.out = encode({'hello': self.node, 'session': self.session,
+                           'secret': self.secret})
+        self.warned = False
+        self.stats['connects'] += 1
+        self.read_tag = self.engine.io_add_watch(sock.fileno(),
+                                                 self._read_callback)
+        logger.info('Connected to gateway at %s:%d', *self.address)
+
+        # Whatever was not acknowledged before is sent again, bar any
+        # actions that have gone stale meanwhile
+        now = time.time()
+        for (seq, batch) in list(self.unacked.items()):
+            fresh = [item for item in batch
+                     if now - item[2] <= GatewaySender.MAX_AGE]
+            self.stats['stale'] += len(batch) - len(fresh)
+            if (not fresh):
+                del self.unacked[seq]
+                continue
+            self.unacked[seq] = fresh
+            if (not self._send_batch(seq, fresh, now)):
+                return True
+        self._flush()
+        return True
+
+    def _disconnect(self):
+        if (self.sock is not None):
+            if (self.read_tag is not None):
+                self.engine.source_remove(self.read_tag)
+                self.read_tag = None
+            self.sock.close()
+            self.sock = None
+            self.out = b''
+
+    def _lost(self, reason):
+        logger.warning('Lost connection to gateway at %s:%d: %s',
+                       self.address[0], self.address[1], reason)
+        self._disconnect()
+        self._schedule_retry()
+
+    def _schedule_retry(self):
+        if (self.retry_tag is None):
+            self.retry_tag = self.engine.timeout_add(
+                GatewaySender.RETRY, self._retry_timeout_callback)
+
+    def _retry_timeout_callback(self):
+        self.retry_tag = None
+        if (not self._connect()):
+            self._schedule_retry()
+        return False
+
+    def _read_callback(self, source, cb_condition):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error as e:
+            if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                return True
+            data = b''
+        if (not data):
+            # The watch is removed by returning False
+            self.read_tag = None
+            self._lost('closed by peer')
+            return False
+        (messages, self.buf) = decode_lines(self.buf, data)
+        for message in messages:
+            if (isinstance(message, dict) and 'ack' in message):
+                for seq in list(self.unacked.keys()):
+                    if (seq > message['ack']):
+                        break
+                    del self.unacked[seq]
+                    self.stats['acked'] += 1
+        self._flush()
+        return True
+
+
+class GatewayReceiver(object):
+    """
+    Accepts connections from gateway nodes on ``host``:``port`` and calls
+    ``callback(node, action)`` from the engine for every action they send,
+    ``action`` being a dict as described above.  Batches are acknowledged
+    once their actions have been handled, and batches seen before, which a
+    node sends again after reconnecting, are only acknowledged.
+
+    If a ``secret`` is set, nodes must give the same one, and without one
+    only the loopback interface is listened on.  Nodes that don't say
+    hello within :attr:`HELLO_TIMEOUT` milliseconds, or send a line longer
+    than :attr:`MAX_LINE` bytes, are disconnected.
+    """
+
+    HELLO_TIMEOUT = 5000  # milliseconds
+    MAX_LINE = 65536
+
+    def __init__(self, engine, host, port, callback, secret=None):
+        self.engine = engine
+        self.address = (host, port)
+        self.callback = callback
+        self.secret = secret
+        self.sock = None
+        self.tag = None
+        self.port = None
+        self.nodes = {}
+        self.sessions = {}
+        self.stats = {'batches': 0, 'actions': 0, 'duplicates': 0}
+
+    def start(self):
+        if (not self.secret and not _is_loopback(self.address[0])):
+            logger.error('Not listening for gateway nodes on %s: '
+                         'gateway_secret must be set to listen on other '
+                         'than the loopback interface', self.address[0])
+            return
+        family = socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.address)
+        self.sock.listen(16)
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        self.tag = self.engine.io_add_watch(self.sock.fileno(),
+                                            self._accept_callback)
+        logger.info('Gateway listening on %s:%d', self.address[0], self.port)
+
+    def stop(self):
+        for fd in list(self.nodes.keys()):
+            self._close_node(fd)
+        if (self.sock is not None):
+            self.engine.source_remove(self.tag)
+            self.sock.close()
+            self.sock = None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['nodes'] = len(self.nodes)
+        return stats
+
+    def _accept_callback(self, source, cb_condition):
+        try:
+            (sock, address) = self.sock.accept()
+        except socket.error as e:
+            if (e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                logger.warning('Failed to accept gateway node: %s', e)
+            return True
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        fd = sock.fileno()
+        tag = self.engine.io_add_watch(fd, self._node_callback, fd)
+        # Socket, io watch tag, node name (None until it says hello),
+        # partial line received and when it was accepted
+        self.nodes[fd] = [sock, tag, None, b'', time.time()]
+        self.engine.timeout_add(GatewayReceiver.HELLO_TIMEOUT,
+                                self._hello_timeout_callback, fd, sock)
+        logger.debug('Accepted gateway node from %s', address[0])
+        return True
+
+    def _hello_timeout_callback(self, fd, sock):
+        node = self.nodes.get(fd)
+        if (node is None or node[0] is not sock or node[2] is not None):
+            return False
+        if (time.time() - node[4] < GatewayReceiver.HELLO_TIMEOUT / 1000.0):
+            return True
+        logger.warning('Dropped gateway node %s: no hello',
+                       self._peer(sock))
+        self._close_node(fd)
+        return False
+
+    @staticmethod
+    def _peer(sock):
+        try:
+            return sock.getpeername()[0]
+        except socket.error:
+            return None
+
+    def _node_callback(self, source, cb_condition, fd):
+        node = self.nodes.get(fd)
+        if (node is None):
+            return False
+        try:
+            data = node[0].recv(65536)
+        except socket.error as e:
+            if (e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                return True
+            data = b''
+        if (not data):
+            logger.info('Gateway node %s disconnected', node[2])
+            self._close_node(fd)
+            return False
+        (messages, node[3]) = decode_lines(node[3], data)
+        if (len(node[3]) > GatewayReceiver.MAX_LINE):
+            logger.warning('Dropped gateway node %s: line too long',
+                           node[2] or self._peer(node[0]))
+            self._close_node(fd)
+            return False
+        for message in messages:
+            if (not isinstance(message, dict)):
+                continue
+            if ('hello' in message):
+                if (not self._hello(node, message)):
+                    self._close_node(fd)
+                    return False
+            elif ('seq' in message and node[2] is not None):
+                self._batch(node, message)
+        return True
+
+    def _hello(self, node, message):
+        if (self.secret and not _same_secret(message.get('secret'),
+                                             self.secret)):
+            logger.warning('Rejected gateway node %s: wrong secret',
+                           message['hello'])
+            return False
+        name = node[2] = message['hello']
+        session = message.get('session')
+        # Only a node's latest session is remembered, so this stays as
+        # small as the number of nodes
+        if (self.sessions.get(name, (None,))[0] != session):
+            self.sessions[name] = (session, 0)
+        logger.info('Gateway node %s connected', name)
+        return True
+
+    def _batch(self, node, message):
+        name = node[2]
+        (session, last) = self.sessions[name]
+        seq = message['seq']
+        if (seq <= last):
+            self.stats['duplicates'] += 1
+        else:
+            self.sessions[name] = (session, seq)
+            self.stats['batches'] += 1
+            for action in message.get('actions', []):
+                self.stats['actions'] += 1
+                try:
+                    self.callback(name, action)
+                except Exception:
+                    logger.exception('Failed to handle action from %s', name)
+        try:
+            node[0].send(encode({'ack': self.sessions[name][1]}))
+        except socket.error:
+            # Acks are cumulative, so the next one makes up for this
+            pass
+
+    def _close_node(self, fd):
+        node = self.nodes.pop(fd, None)
+        if (node is not None):
+            self.engine.source_remove(node[1])
+            node[0].close()
+
+
+def _is_loopback(host):
+    try:
+        addresses = socket.getaddrinfo(host, None)
+    except socket.error:
+        return False
+    return all(address[4][0].startswith('127.') or address[4][0] == '::1'
+               for address in addresses)
+
+
+def _same_secret(given, secret):
+    # Compared in constant time, so the secret can't be guessed a character
+    # at a time
+    if (not isinstance(given, unicode)):
+        return False
+    return hmac.compare_digest(given.encode('utf-8'), secret.encode('utf-8'))
+
+
+def _address(text):
+    if (text.endswith(']') or ':' not in text):
+        return (text.strip('[]'), DEFAULT_PORT)
+    (host, _, port) = text.rpartition(':')
+    try:
+        return (host.strip('[]'), int(port))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Expected <host>[:<port>]: %s' %
+                                         text)
+
+
+def main(argv=None):
+    """
+    Run a gateway node which reads the input devices on this host and
+    forwards the actions their keys perform to Mopidy-EvtDev on another.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m mopidy_evtdev.gateway',
+        description='Forward input device key actions to Mopidy-EvtDev.')
+    parser.add_argument('connect', type=_address,
+                        help='Mopidy host and gateway_port, as '
+                             '<host>[:<port>] (default port: %d)' %
+                             DEFAULT_PORT)
+    parser.add_argument('--name', default=socket.gethostname(),
+                        help='name of this node (default: %(default)s)')
+    parser.add_argument('--secret', help='as for "gateway_secret"')
+    add_agent_arguments(parser)
+    args = parse_args(parser, argv)
+
+    engine = EpollEngine()
+    sender = GatewaySender(engine, args.connect[0], args.connect[1],
+                           args.name, args.secret)
+    sender.start()
+    run_agent(args, engine, sender.publish)
+    sender.stop()
+    engine.stop()
+    logger.info('Gateway stopped: %s', sender.get_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+# Flags taken from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_WATCH_MASK = (IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+               IN_DELETE | IN_DELETE_SELF)
+_EVENT_HEADER = struct.Struct(str('iIII'))
+_READ_SIZE = 4096
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library(str('c')), use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    return libc
+
+
+class HotplugMonitor(object):
+    """
+    Watches a device directory with inotify and reports input device
+    nodes that were added to or removed from it.
+
+    The monitor never blocks: :meth:`read_changes` should be called when
+    :meth:`fileno` becomes readable, e.g. from a GLib io watch.
+    """
+
+    ADDED = 'added'
+    REMOVED = 'removed'
+    RESCAN = 'rescan'
+
+    def __init__(self, dev_dir, prefix='event'):
+        self.dev_dir = dev_dir
+        self.prefix = prefix
+        libc = _load_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if (self.fd < 0):
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        path = dev_dir
+        if (not isinstance(path, bytes)):
+            path = path.encode('utf-8')
+        if (libc.inotify_add_watch(self.fd, path, _WATCH_MASK) < 0):
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            self.fd = -1
+            raise OSError(err, os.strerror(err), dev_dir)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if (self.fd >= 0):
+            os.close(self.fd)
+            self.fd = -1
+
+    def read_changes(self):
+        """
+        Drain all pending inotify events and return a list of
+        ``(action, path)`` tuples in the order they occurred.  An action of
+        :attr:`RESCAN` means events were lost and the caller should fall back
+        to a full scan of the device directory.
+        """
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.fd, _READ_SIZE)
+            except OSError as e:
+                if (e.errno in (errno.EAGAIN, errno.EINTR)):
+                    break
+                raise
+            if (not chunk):
+                break
+            data += chunk
+        return self._parse(data)
+
+    def _parse(self, data):
+        changes = []
+        offset = 0
+        while (offset + _EVENT_HEADER.size <= len(data)):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            name = name.decode('utf-8', 'replace')
+            if (mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_IGNORED)):
+                changes.append((HotplugMonitor.RESCAN, None))
+            elif (not name.startswith(self.prefix)):
+                continue
+            elif (mask & (IN_DELETE | IN_MOVED_FROM)):
+                changes.append((HotplugMonitor.REMOVED,
+                                os.path.join(self.dev_dir, name)))
+            elif (mask & (IN_CREATE | IN_MOVED_TO | IN_ATTRIB)):
+                # udev usually creates the node and then fixes up its
+                # permissions, so IN_ATTRIB is treated as a (re)try to add
+                changes.append((HotplugMonitor.ADDED,
+                                os.path.join(self.dev_dir, name)))
+        return changes
@@ -0,0 +1,182 @@
+from __future__ import unicode_literals
+
+import collections
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Actions which may be bound to keys, and the EvtDevAgent method performing
+# each; 'none' removes a binding
+ACTIONS = {
+    'play_pause': '_play_pause',
+    'stop': '_stop',
+    'next_track': '_next_track',
+    'prev_track': '_prev_track',
+    'volume_up': '_volume_up',
+    'volume_down': '_volume_down',
+    'mute': '_mute',
+    'seek_forward': '_seek_forward',
+    'seek_backward': '_seek_backward',
+    'toggle_random': '_toggle_random',
+    'toggle_repeat': '_toggle_repeat',
+    'toggle_single': '_toggle_single',
+    'shuffle': '_shuffle',
+    'clear_tracklist': '_clear_tracklist',
+    'load_playlist': '_load_playlist',
+    'none': None,
+}
+
+# Actions taking an argument after a ':', and whether it is required
+ARGUMENTS = {
+    'seek_forward': False,
+    'seek_backward': False,
+    'load_playlist': True,
+}
+
+# Actions performed differently while a key is held, and the method for
+# each; any other action is simply repeated
+HOLD_ACTIONS = {
+    'seek_forward': '_hold_seek_forward',
+    'seek_backward': '_hold_seek_backward',
+}
+
+PRESS = 'press'
+LONG = 'long'
+HOLD = 'hold'
+
+DEFAULT_KEYMAP = (
+    'KEY_PLAYCD = play_pause',
+    'KEY_PLAY = play_pause',
+    'KEY_PLAYPAUSE = play_pause',
+    'KEY_PAUSE = play_pause',
+    'KEY_PAUSECD = play_pause',
+    'KEY_STOP = stop',
+    'KEY_STOPCD = stop',
+    'KEY_NEXTSONG = next_track',
+    'KEY_PREVIOUSSONG = prev_track',
+    'KEY_VOLUMEUP = volume_up',
+    'KEY_VOLUMEDOWN = volume_down',
+    'KEY_MUTE = mute',
+    'KEY_FASTFORWARD = seek_forward',
+    'KEY_FASTFORWARD:hold = seek_forward',
+    'KEY_REWIND = seek_backward',
+    'KEY_REWIND:hold = seek_backward',
+)
+
+# Key codes are below KEY_CNT in <linux/input.h>
+KEY_CNT = 0x300
+
+_KEY_NAME = re.compile(r'^((KEY|BTN)_[A-Z0-9_]+|\d+)$')
+
+Binding = collections.namedtuple('Binding',
+                                 ['keys', 'gesture', 'action', 'arg'])
+
+
+def parse_binding(text):
+    """
+    Parse a binding of the form ``KEY[+KEY...][:long|:hold] =
+    action[:arg]``, e.g. ``KEY_NEXTSONG:long = seek_forward:30000``.  Keys
+    are evdev key names or numeric key codes.  Raises :exc:`ValueError` if
+    the binding is not valid.
+    """
+    if ('=' not in text):
+        raise ValueError('Key binding must be <keys> = <action>: %s' % text)
+    (keys, action) = [s.strip() for s in text.split('=', 1)]
+    gesture = PRESS
+    if (':' in keys):
+        (keys, gesture) = [s.strip() for s in keys.rsplit(':', 1)]
+        if (gesture not in (PRESS, LONG, HOLD)):
+            raise ValueError('Unknown key gesture %r in %s' % (gesture, text))
+    keys = tuple(k.strip() for k in keys.split('+'))
+    for key in keys:
+        if (not _KEY_NAME.match(key)):
+            raise ValueError('Invalid key name %r in %s' % (key, text))
+    if (len(set(keys)) != len(keys)):
+        raise ValueError('Repeated key in %s' % text)
+    if (len(keys) > 1 and gesture != PRESS):
+        raise ValueError('Chords can only be pressed: %s' % text)
+    arg = None
+    if (':' in action):
+        (action, arg) = [s.strip() for s in action.split(':', 1)]
+    try:
+        arg = parse_action(action, arg)
+    except ValueError as e:
+        raise ValueError('%s in %s' % (e, text))
+    return Binding(keys, gesture, action, arg)
+
+
+def parse_action(action, arg=None):
+    """
+    Check ``action`` and ``arg``, the text after its ``:`` in a binding or
+    None, and return the argument as the action takes it.  Raises
+    :exc:`ValueError` if the action or argument is not valid.
+    """
+    if (action not in ACTIONS):
+        raise ValueError('Unknown action %r' % action)
+    if (action not in ARGUMENTS):
+        if (arg is not None):
+            raise ValueError('Action %r takes no argument' % action)
+    elif (ARGUMENTS[action] and not arg):
+        raise ValueError('Action %r needs an argument' % action)
+    elif (arg is not None and action != 'load_playlist'):
+        arg = int(arg)
+    return arg
+
+
+class KeyTable(object):
+    """
+    Key bindings compiled into flat tables indexed by key code, so finding
+    what a key does costs the same however many bindings there are.
+
+    ``press[code]``, ``long[code]`` and ``hold[code]`` hold the handler for
+    a press, long press or repeat while held of a key, and ``chords[code]``
+    a list of ``(codes, handler)`` for the chords that the key is part of.
+    ``bound[code]`` is set for keys which take part in any binding.  Later
+    bindings replace earlier ones for the same keys and gesture.
+
+    ``resolve_key(name)`` returns the code for a key name, and
+    ``resolve_action(action, arg, gesture)`` the handler for an action
+    performed by a gesture; either may return None, in which case the
+    binding is dropped.
+    """
+
+    def __init__(self, bindings, resolve_key, resolve_action):
+        self.bound = bytearray(KEY_CNT)
+        self.press = [None] * KEY_CNT
+        self.long = [None] * KEY_CNT
+        self.hold = [None] * KEY_CNT
+        self.chords = [None] * KEY_CNT
+        chords = collections.OrderedDict()
+        for binding in bindings:
+            codes = tuple(resolve_key(key) for key in binding.keys)
+            if (None in codes or max(codes) >= KEY_CNT):
+                logger.warning('Ignoring binding for unknown key: %s',
+                               '+'.join(binding.keys))
+                continue
+            handler = resolve_action(binding.action, binding.arg,
+                                     binding.gesture)
+            if (len(codes) > 1):
+                chords[frozenset(codes)] = handler
+            elif (binding.gesture == LONG):
+                self.long[codes[0]] = handler
+            elif (binding.gesture == HOLD):
+                self.hold[codes[0]] = handler
+            else:
+                self.press[codes[0]] = handler
+        for (codes, handler) in chords.items():
+            if (handler is None):
+                continue
+            for code in codes:
+                if (self.chords[code] is None):
+                    self.chords[code] = []
+                self.chords[code].append((codes, handler))
+        for code in range(KEY_CNT):
+            if (self.press[code] is not None or
+                    self.long[code] is not None or
+                    self.hold[code] is not None or
+                    self.chords[code] is not None):
+                self.bound[code] = 1
+
+    def is_bound(self, code):
+        return code < KEY_CNT and self.bound[code] == 1
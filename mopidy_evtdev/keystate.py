@@ -0,0 +1,128 @@
+from __future__ import unicode_literals
+
+KEY_UP = 0x0
+KEY_DOWN = 0x1
+
+
+class KeyState(object):
+    """
+    Last state and timestamp seen for one key on one device, how many times
+    it has been pressed, whether the current press has already been acted
+    on (e.g. as part of a chord) and whether that was by holding it down.
+    """
+
+    __slots__ = ('value', 'sec', 'usec', 'presses', 'consumed', 'holding')
+
+    def __init__(self):
+        self.value = KEY_UP
+        self.sec = 0
+        self.usec = 0
+        self.presses = 0
+        self.consumed = False
+        self.holding = False
+
+
+class KeyStateTable(object):
+    """
+    Press/release state machines kept per device and per keycode, so events
+    interleaved from several devices, or overlapping keys on one device,
+    don't reset each other.
+
+    Each device is given a small integer slot on :meth:`allocate` which is
+    reused once the device is released, so the table stays bounded as
+    devices come and go.  :class:`KeyState` records are reused for repeated
+    presses of the same key, so steady state updates do not allocate.
+    """
+
+    # Results of update()
+    NONE = 0
+    COMPLETE = 1
+    EXPIRED = 2
+
+    def __init__(self, max_interval):
+        self.max_interval = max_interval
+        self.slots = []
+        self.free = []
+        self.names = {}
+
+    def allocate(self, device_name):
+        slot = self.names.get(device_name)
+        if (slot is None):
+            if (self.free):
+                slot = self.free.pop()
+            else:
+                slot = len(self.slots)
+                self.slots.append(None)
+            self.slots[slot] = {}
+            self.names[device_name] = slot
+        return slot
+
+    def release(self, device_name):
+        slot = self.names.pop(device_name, None)
+        if (slot is not None):
+            self.slots[slot] = None
+            self.free.append(slot)
+
+    def reset(self, slot):
+        """Forget all key state for a slot, e.g. after lost events."""
+        for state in self.slots[slot].values():
+            state.value = KEY_UP
+
+    def resync(self, slot, active_codes, sec, usec):
+        """
+        Make a slot's key state match the keys that are actually down, e.g.
+        after events were lost.  Keys found to be down are treated as
+        having been pressed at ``sec``, ``usec``.
+        """
+        keys = self.slots[slot]
+        for (code, state) in keys.items():
+            if (code not in active_codes):
+                state.value = KEY_UP
+        for code in active_codes:
+            state = keys.get(code)
+            if (state is None):
+                state = keys[code] = KeyState()
+            if (state.value == KEY_UP):
+                state.value = KEY_DOWN
+                state.sec = sec
+                state.usec = usec
+                state.presses += 1
+                state.consumed = False
+                state.holding = False
+
+    def get(self, slot, code):
+        return self.slots[slot].get(code)
+
+    def is_down(self, slot, code):
+        state = self.slots[slot].get(code)
+        return state is not None and state.value != KEY_UP
+
+    def update(self, slot, code, sec, usec, value):
+        """
+        Apply a key event and return :attr:`COMPLETE` if it completed a
+        press (down or hold followed by up within ``max_interval``) that
+        was not consumed, :attr:`EXPIRED` if it completed one too slowly,
+        else :attr:`NONE`.
+        """
+        keys = self.slots[slot]
+        state = keys.get(code)
+        if (state is None):
+            state = keys[code] = KeyState()
+        if (value != KEY_UP):
+            if (value == KEY_DOWN or state.value == KEY_UP):
+                state.presses += 1
+                state.consumed = False
+                state.holding = False
+            state.value = value
+            state.sec = sec
+            state.usec = usec
+            return KeyStateTable.NONE
+        if (state.value == KEY_UP):
+            return KeyStateTable.NONE
+        state.value = KEY_UP
+        if (state.consumed):
+            return KeyStateTable.NONE
+        if ((sec - state.sec) + (usec - state.usec) * 1e-6 >
+                self.max_interval):
+            return KeyStateTable.EXPIRED
+        return KeyStateTable.COMPLETE
@@ -0,0 +1,108 @@
+from __future__ import division, unicode_literals
+
+import array
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies in power of two microsecond buckets, stored in a
+    fixed size array so recording a sample never allocates.  Bucket ``n``
+    counts samples in ``[2 ** (n - 1), 2 ** n)`` microseconds.
+    """
+
+    NUM_BUCKETS = 32
+
+    def __init__(self):
+        self.counts = array.array(str('L'), [0] * self.NUM_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        usec = max(0, int(seconds * 1000000))
+        self.counts[min(usec.bit_length(), self.NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += usec
+        if (usec > self.max):
+            self.max = usec
+
+    def percentile(self, p):
+        """
+        Return an upper bound in microseconds for the ``p`` th percentile.
+        """
+        if (not self.count):
+            return 0
+        target = self.count * p / 100
+        seen = 0
+        for (bucket, count) in enumerate(self.counts):
+            seen += count
+            if (count and seen >= target):
+                return min(1 << bucket, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count,
+                'mean': self.total // self.count if self.count else 0,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+class LatencyStats(object):
+    """
+    Per device and per action latency histograms for each stage of the
+    pipeline, all measured from the kernel's event timestamp:
+
+    - ``wakeup``: the device's fd was found readable and the event read,
+    - ``complete``: the event completed a key press,
+    - ``dispatch``: the key press's action started running,
+    - ``ack``: core resolved the future returned by the action.
+    """
+
+    DEVICE_STAGES = ('wakeup', 'complete')
+    ACTION_STAGES = ('dispatch', 'ack')
+
+    def __init__(self):
+        self.devices = {}
+        self.actions = {}
+
+    @staticmethod
+    def _get_histogram(table, key, stage):
+        histograms = table.get(key)
+        if (histograms is None):
+            histograms = table[key] = {}
+        histogram = histograms.get(stage)
+        if (histogram is None):
+            histogram = histograms[stage] = LatencyHistogram()
+        return histogram
+
+    def record_device(self, device, stage, seconds):
+        self._get_histogram(self.devices, device, stage).add(seconds)
+
+    def record_action(self, action, stage, seconds):
+        self._get_histogram(self.actions, action, stage).add(seconds)
+
+    def snapshot(self):
+        """Return all statistics as nested dicts, in microseconds."""
+        return {
+            'devices': dict((device, dict((stage, h.to_dict())
+                                          for (stage, h) in stages.items()))
+                            for (device, stages) in self.devices.items()),
+            'actions': dict((action, dict((stage, h.to_dict())
+                                          for (stage, h) in stages.items()))
+                            for (action, stages) in self.actions.items()),
+        }
+
+    def log(self, level=logging.INFO):
+        for (table, stage_names) in ((self.devices, self.DEVICE_STAGES),
+                                     (self.actions, self.ACTION_STAGES)):
+            for key in sorted(table):
+                for stage in stage_names:
+                    h = table[key].get(stage)
+                    if (h is not None):
+                        logger.log(level, 'Latency %s/%s: %s', key, stage,
+                                   h.to_dict())
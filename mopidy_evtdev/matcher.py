@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+import fnmatch
+import re
+
+
+class DeviceMatcher(object):
+    """
+    Matches device identities (path, name, physical address, unique id)
+    against the configured list of permitted devices.
+
+    Each pattern is one of:
+
+    - ``re:<regex>``, a regular expression searched for in the value,
+    - a glob if it contains any of ``*?[``, e.g. ``/dev/input/event*``,
+    - otherwise an exact string.
+
+    Exact strings are kept in a set and pattern results are memoized per
+    value, so matching costs a few hash lookups however many devices and
+    patterns there are.
+    """
+
+    REGEX_PREFIX = 're:'
+    GLOB_CHARS = '*?['
+    MAX_MEMO = 4096
+
+    def __init__(self, patterns):
+        self.exact = set()
+        self.patterns = []
+        self.memo = {}
+        for pattern in patterns or []:
+            if (pattern.startswith(DeviceMatcher.REGEX_PREFIX)):
+                self.patterns.append(
+                    re.compile(pattern[len(DeviceMatcher.REGEX_PREFIX):]))
+            elif (any(c in pattern for c in DeviceMatcher.GLOB_CHARS)):
+                self.patterns.append(re.compile(fnmatch.translate(pattern)))
+            else:
+                self.exact.add(pattern)
+
+    def __len__(self):
+        return len(self.exact) + len(self.patterns)
+
+    def _match_patterns(self, value):
+        result = self.memo.get(value)
+        if (result is None):
+            result = any(p.search(value) for p in self.patterns)
+            if (len(self.memo) >= DeviceMatcher.MAX_MEMO):
+                self.memo.clear()
+            self.memo[value] = result
+        return result
+
+    def match(self, *values):
+        """Return ``True`` if any of ``values`` is permitted."""
+        for value in values:
+            if (value in self.exact):
+                return True
+        if (self.patterns):
+            for value in values:
+                if (self._match_patterns(value)):
+                    return True
+        return False
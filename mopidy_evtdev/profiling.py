@@ -0,0 +1,148 @@
+from __future__ import division, unicode_literals
+
+import cProfile
+import ctypes
+import ctypes.util
+import functools
+import logging
+import marshal
+import resource
+import threading
+import time
+
+from .trace import open_dump
+
+logger = logging.getLogger(__name__)
+
+# From <time.h> and <sys/resource.h> on Linux
+CLOCK_THREAD_CPUTIME_ID = 3
+RUSAGE_THREAD = 1
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _thread_cpu_clock():
+    # Python 2 has no clock for the CPU time of the calling thread, so it
+    # is asked of clock_gettime() or, failing that, getrusage().  The
+    # clock of the whole process would count the time of every other
+    # thread as well.
+    clock = getattr(time, 'thread_time', None)
+    if (clock is not None):
+        return clock
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library(str('c')), use_errno=True)
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+        timespec = _Timespec()
+        if (clock_gettime(CLOCK_THREAD_CPUTIME_ID,
+                          ctypes.byref(timespec)) == 0):
+            def clock():
+                timespec = _Timespec()
+                clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(timespec))
+                return timespec.tv_sec + timespec.tv_nsec / 1000000000
+            return clock
+    except (OSError, AttributeError):
+        pass
+    try:
+        resource.getrusage(RUSAGE_THREAD)
+
+        def clock():
+            usage = resource.getrusage(RUSAGE_THREAD)
+            return usage.ru_utime + usage.ru_stime
+        return clock
+    except (ValueError, resource.error):
+        pass
+    logger.warning('Thread CPU time not available: CPU times will be zero')
+    return lambda: 0.0
+
+
+_cpu_time = _thread_cpu_clock()
+
+
+class CallbackProfiler(object):
+    """
+    Cumulative wall and CPU time spent in each of a set of callbacks, which
+    are wrapped with :meth:`wrap`.  Times include those of any wrapped
+    callbacks a callback calls.
+
+    With ``sample`` set, every ``sample`` th outermost call to a wrapped
+    callback is also run under :mod:`cProfile`, all of them into one
+    profile.  Only one thread is profiled at a time; a call due to be
+    sampled while another thread is being profiled is just timed.
+    """
+
+    def __init__(self, sample=0):
+        self.sample = sample
+        self.stats = {}
+        self.calls = 0
+        self.profile = None
+        self.profile_lock = threading.Lock()
+        self.local = threading.local()
+        if (sample):
+            self.profile = cProfile.Profile()
+
+    def wrap(self, name, callback):
+        # Calls, wall and CPU time and longest wall time, in seconds
+        stats = self.stats.setdefault(name, [0, 0.0, 0.0, 0.0])
+
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            local = self.local
+            depth = getattr(local, 'depth', 0)
+            profiling = False
+            if (self.profile is not None and not depth):
+                self.calls += 1
+                if (self.calls % self.sample == 0):
+                    profiling = self.profile_lock.acquire(False)
+            local.depth = depth + 1
+            wall = time.time()
+            cpu = _cpu_time()
+            try:
+                if (profiling):
+                    self.profile.enable()
+                try:
+                    return callback(*args, **kwargs)
+                finally:
+                    if (profiling):
+                        self.profile.disable()
+                        self.profile_lock.release()
+            finally:
+                cpu = _cpu_time() - cpu
+                wall = time.time() - wall
+                local.depth = depth
+                stats[0] += 1
+                stats[1] += wall
+                stats[2] += cpu
+                if (wall > stats[3]):
+                    stats[3] = wall
+        return wrapper
+
+    def snapshot(self):
+        """Return the statistics for each callback, in microseconds."""
+        return dict(
+            (name, {'calls': calls,
+                    'wall': int(wall * 1000000),
+                    'cpu': int(cpu * 1000000),
+                    'max': int(longest * 1000000)})
+            for (name, (calls, wall, cpu, longest)) in self.stats.items())
+
+    def dump(self, path):
+        """
+        Write the sampled profile to ``path``, for :mod:`pstats`, and return
+        the path, or None when not sampling.
+        """
+        if (self.profile is None):
+            return None
+        # As Profile.dump_stats(), but never writing by way of a link
+        with self.profile_lock:
+            self.profile.create_stats()
+            with open_dump(path) as f:
+                f.write(marshal.dumps(self.profile.stats))
+        return path
+
+    def log(self, level=logging.INFO):
+        for (name, stats) in sorted(self.snapshot().items()):
+            if (stats['calls']):
+                logger.log(level, 'Profile %s: %s', name, stats)
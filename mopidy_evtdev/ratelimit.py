@@ -0,0 +1,104 @@
+from __future__ import division, unicode_literals
+
+
+class TokenBucket(object):
+    """
+    Allows ``rate`` units per second on average, with bursts of up to
+    ``burst`` units.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def consume(self, n, now):
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        self.stamp = now
+        if (tokens > self.burst):
+            tokens = self.burst
+        if (tokens < n):
+            # Whatever was over the limit is still spent, so a device which
+            # keeps flooding stays over it
+            self.tokens = max(0, tokens - n)
+            return False
+        self.tokens = tokens - n
+        return True
+
+
+class RateLimiter(object):
+    """
+    Per device token buckets for raw events and for the actions they
+    trigger, along with the backoff for devices that are quarantined for
+    exceeding them.
+
+    A device's backoff doubles each time it is quarantined, from
+    ``backoff`` up to ``max_backoff`` seconds, and starts again from
+    ``backoff`` once it has behaved for ``max_backoff`` seconds.  A rate of
+    0 leaves that kind of input unlimited.
+    """
+
+    BURST = 2.0   # Seconds' worth of input allowed in a burst
+
+    def __init__(self, event_rate, action_rate, backoff=1.0,
+                 max_backoff=300.0):
+        self.event_rate = event_rate
+        self.action_rate = action_rate
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.event_buckets = {}
+        self.action_buckets = {}
+        self.strikes = {}
+        self.released = {}
+        self.quarantines = 0
+
+    @staticmethod
+    def _consume(buckets, rate, device_name, n, now):
+        bucket = buckets.get(device_name)
+        if (bucket is None):
+            bucket = buckets[device_name] = TokenBucket(
+                rate, max(1, rate * RateLimiter.BURST), now)
+        return bucket.consume(n, now)
+
+    def allow_events(self, device_name, n, now):
+        if (not self.event_rate):
+            return True
+        return self._consume(self.event_buckets, self.event_rate,
+                             device_name, n, now)
+
+    def allow_action(self, device_name, now):
+        if (not self.action_rate):
+            return True
+        return self._consume(self.action_buckets, self.action_rate,
+                             device_name, 1, now)
+
+    def quarantine(self, device_name, now):
+        """
+        Record that a device is being quarantined and return how many
+        seconds it should stay quarantined for.
+        """
+        strikes = self.strikes.get(device_name, 0)
+        if (now - self.released.get(device_name, now) > self.max_backoff):
+            strikes = 0
+        self.strikes[device_name] = strikes + 1
+        self.quarantines += 1
+        delay = min(self.backoff * 2 ** strikes, self.max_backoff)
+        self.released[device_name] = now + delay
+        return delay
+
+    def release(self, device_name):
+        """Start a released device with full buckets."""
+        self.event_buckets.pop(device_name, None)
+        self.action_buckets.pop(device_name, None)
+
+    def forget(self, device_name):
+        for table in (self.event_buckets, self.action_buckets, self.strikes,
+                      self.released):
+            table.pop(device_name, None)
+
+    def get_stats(self):
+        return {'quarantines': self.quarantines,
+                'strikes': dict(self.strikes)}
@@ -0,0 +1,60 @@
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import io
+import os
+import struct
+
+# struct input_event from <linux/input.h>: a struct timeval followed by
+# type, code and value, laid out with the platform's native alignment
+INPUT_EVENT = struct.Struct(str('llHHi'))
+
+
+class EventReader(object):
+    """
+    Reads raw ``struct input_event`` records from an input device fd in
+    bulk.
+
+    Each call to :meth:`read` drains the fd with as few ``read()`` calls as
+    the buffer size allows, into a buffer that is allocated once and reused,
+    and decodes the records in place to plain
+    ``(sec, usec, type, code, value)`` tuples.
+    """
+
+    def __init__(self, fd, fn=None, max_events=64):
+        self.fd = fd
+        self.fn = fn
+        self.buf = bytearray(INPUT_EVENT.size * max_events)
+        self.view = memoryview(self.buf)
+        self.file = io.FileIO(fd, 'rb', closefd=False)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def read(self, limit=None):
+        """
+        Return all events currently queued on the fd, or at most ``limit``
+        of them, oldest first.  An empty list means the fd had nothing to
+        read.
+        """
+        events = []
+        size = INPUT_EVENT.size
+        unpack_from = INPUT_EVENT.unpack_from
+        want = len(self.buf)
+        while True:
+            if (limit is not None):
+                want = min(len(self.buf), (limit - len(events)) * size)
+            try:
+                n = self.file.readinto(self.view[:want])
+            except (IOError, OSError) as e:
+                if (e.errno in (errno.EAGAIN, errno.EINTR)):
+                    break
+                raise
+            if (not n):
+                break
+            view = self.view
+            for offset in range(0, n - n % size, size):
+                events.append(unpack_from(view, offset))
+            if (n < want or (limit is not None and len(events) >= limit)):
+                break
+        return events
@@ -0,0 +1,120 @@
+from __future__ import division, unicode_literals
+
+import io
+import logging
+import mmap
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# A log is a header followed by fixed size records, so it can be appended
+# to cheaply and memory-mapped for reading.  Device names are kept in a
+# '<log>.devices' file alongside, one per line, indexed by record 'device'.
+# Header: magic, version, record size
+HEADER = struct.Struct(str('<4sHH'))
+# Record: sec, usec, device, type, code, value
+RECORD = struct.Struct(str('<qIHHHi2x'))
+MAGIC = b'EVTR'
+VERSION = 1
+
+
+def _devices_path(path):
+    return path + '.devices'
+
+
+class EventRecorder(object):
+    """
+    Appends raw input events, tagged with the device they came from, to a
+    binary event log.  An existing log is appended to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.devices = {}
+        if (os.path.exists(_devices_path(path))):
+            with io.open(_devices_path(path), encoding='utf-8') as f:
+                for (i, device_name) in enumerate(f.read().splitlines()):
+                    self.devices[device_name] = i
+        self.file = io.open(path, 'ab')
+        if (self.file.tell() == 0):
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.devices_file = io.open(_devices_path(path), 'a',
+                                    encoding='utf-8')
+
+    def record(self, device_name, sec, usec, etype, code, value):
+        device = self.devices.get(device_name)
+        if (device is None):
+            device = self.devices[device_name] = len(self.devices)
+            self.devices_file.write(device_name + '\n')
+            self.devices_file.flush()
+        self.file.write(RECORD.pack(sec, usec, device, etype, code, value))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        self.devices_file.close()
+
+
+class EventLog(object):
+    """
+    Read-only, memory-mapped view of an event log.  Records are returned as
+    ``(device_name, sec, usec, type, code, value)`` tuples.
+    """
+
+    def __init__(self, path):
+        with io.open(_devices_path(path), encoding='utf-8') as f:
+            self.devices = f.read().splitlines()
+        with io.open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, size) = HEADER.unpack_from(self.map, 0)
+        if (magic != MAGIC or version != VERSION or size != RECORD.size):
+            self.map.close()
+            raise ValueError('Not a supported event log: %s' % path)
+        # A partially written trailing record is ignored
+        self.count = (len(self.map) - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if (i < 0):
+            i += self.count
+        if (not 0 <= i < self.count):
+            raise IndexError(i)
+        (sec, usec, device, etype, code, value) = RECORD.unpack_from(
+            self.map, HEADER.size + i * RECORD.size)
+        return (self.devices[device], sec, usec, etype, code, value)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def close(self):
+        self.map.close()
+
+
+def replay(agent, log, speed=None):
+    """
+    Feed the events in ``log`` through ``agent`` as if they had just been
+    read from their devices.  With ``speed`` set, the original spacing of
+    the events is reproduced (scaled by ``speed``); otherwise they are
+    replayed as fast as possible.  Returns the number of events replayed.
+    """
+    start = None
+    first = None
+    for (device_name, sec, usec, etype, code, value) in log:
+        if (speed):
+            timestamp = sec + usec / 1000000
+            if (first is None):
+                first = timestamp
+                start = time.time()
+            delay = start + (timestamp - first) / speed - time.time()
+            if (delay > 0):
+                time.sleep(delay)
+        agent._select_device(device_name)
+        agent._handle_event(sec, usec, etype, code, value)
+    return len(log)
@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+# sysfs prints capability bitmaps as space separated unsigned longs
+BITS_PER_LONG = struct.calcsize(str('l')) * 8
+
+
+def parse_bitmap(text):
+    """
+    Return the set of bit numbers set in a sysfs capability bitmap such as
+    ``capabilities/key``, where the most significant word comes first.
+    """
+    bits = set()
+    for (i, word) in enumerate(reversed(text.split())):
+        value = int(word, 16)
+        bit = i * BITS_PER_LONG
+        while (value):
+            if (value & 1):
+                bits.add(bit)
+            value >>= 1
+            bit += 1
+    return bits
+
+
+class DeviceInfo(object):
+    """
+    Identity of an input device node as published by the kernel in sysfs,
+    i.e. the same ``name``, ``phys`` and ``uniq`` strings evdev would
+    return after opening the node, along with the ``EV_KEY`` codes it can
+    emit (``None`` if unknown).
+    """
+
+    def __init__(self, fn, name, phys, uniq, key_codes=None):
+        self.fn = fn
+        self.name = name
+        self.phys = phys
+        self.uniq = uniq
+        self.key_codes = key_codes
+
+    def __repr__(self):
+        return 'DeviceInfo(fn=%r, name=%r, phys=%r, uniq=%r)' % \
+            (self.fn, self.name, self.phys, self.uniq)
+
+
+class DeviceInfoCache(object):
+    """
+    Cache of :class:`DeviceInfo` read from ``/sys/class/input`` so input
+    device nodes can be identified without opening them.
+
+    Entries are keyed by node path and validated against the node's device
+    number and inode, so a node that is re-created for a different device
+    is read again.
+    """
+
+    SYS_DIR = '/sys/class/input'
+
+    def __init__(self, sys_dir=SYS_DIR):
+        self.sys_dir = sys_dir
+        self.entries = {}
+
+    @staticmethod
+    def _read_attr(path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read().decode('utf-8', 'replace').strip()
+        except (OSError, IOError):
+            return ''
+
+    def _read_info(self, device_name):
+        attr_dir = os.path.join(self.sys_dir, os.path.basename(device_name),
+                                'device')
+        if (not os.path.isdir(attr_dir)):
+            return None
+        key_codes = None
+        key_path = os.path.join(attr_dir, 'capabilities', 'key')
+        if (os.path.exists(key_path)):
+            try:
+                key_codes = frozenset(parse_bitmap(self._read_attr(key_path)))
+            except ValueError:
+                pass
+        return DeviceInfo(device_name,
+                          self._read_attr(os.path.join(attr_dir, 'name')),
+                          self._read_attr(os.path.join(attr_dir, 'phys')),
+                          self._read_attr(os.path.join(attr_dir, 'uniq')),
+                          key_codes)
+
+    def lookup(self, device_name):
+        """
+        Return the :class:`DeviceInfo` for ``device_name`` or ``None`` if
+        the node or its sysfs attributes are not available.
+        """
+        try:
+            st = os.stat(device_name)
+        except OSError:
+            self.entries.pop(device_name, None)
+            return None
+        key = (st.st_rdev, st.st_ino)
+        entry = self.entries.get(device_name)
+        if (entry is not None and entry[0] == key):
+            return entry[1]
+        info = self._read_info(device_name)
+        if (info is not None):
+            logger.debug('Read sysfs metadata: %s', info)
+            self.entries[device_name] = (key, info)
+        return info
+
+    def invalidate(self, device_name):
+        self.entries.pop(device_name, None)
+
+    def prune(self, device_names):
+        """Drop cached entries for nodes not present in ``device_names``."""
+        for device_name in set(self.entries) - set(device_names):
+            del self.entries[device_name]
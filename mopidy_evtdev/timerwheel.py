@@ -0,0 +1,67 @@
+from __future__ import division, unicode_literals
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel(object):
+    """
+    Many short timers sharing a single engine timeout.
+
+    Timers are placed in the bucket for the tick they expire on, so adding
+    one costs the same however many are pending, and the engine timeout
+    only runs while there is something pending.  Timers fire on the first
+    tick at or after they are due, so are accurate to a tick.  Callbacks are
+    invoked from the engine as ``callback(*args)``.
+    """
+
+    def __init__(self, engine, tick=50, size=64):
+        self.engine = engine
+        self.tick = tick
+        self.wheel = [[] for i in range(size)]
+        self.now = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.tag = None
+
+    def schedule(self, delay, callback, *args):
+        """Call ``callback(*args)`` after ``delay`` milliseconds."""
+        ticks = max(1, -(-int(delay) // self.tick))
+        with self.lock:
+            expires = self.now + ticks
+            self.wheel[expires % len(self.wheel)].append(
+                (expires, callback, args))
+            self.pending += 1
+            if (self.tag is None):
+                self.tag = self.engine.timeout_add(self.tick,
+                                                   self._tick_callback)
+
+    def stop(self):
+        with self.lock:
+            self.wheel = [[] for i in range(len(self.wheel))]
+            self.pending = 0
+            if (self.tag is not None):
+                self.engine.source_remove(self.tag)
+                self.tag = None
+
+    def _tick_callback(self):
+        with self.lock:
+            self.now += 1
+            bucket = self.wheel[self.now % len(self.wheel)]
+            due = [timer for timer in bucket if timer[0] <= self.now]
+            if (due):
+                bucket[:] = [timer for timer in bucket
+                             if timer[0] > self.now]
+                self.pending -= len(due)
+        for (_, callback, args) in due:
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Timer callback failed')
+        with self.lock:
+            if (not self.pending):
+                self.tag = None
+                return False
+        return True
@@ -0,0 +1,207 @@
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import array
+import io
+import logging
+import os
+import struct
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# A dump is a header, a table of device names, one 'slot<TAB>name' per
+# line, and then the records in the order they were made
+# Magic, version, record size, records and device table size
+HEADER = struct.Struct(str('<4sHHII'))
+# Seconds, microseconds, slot, type, code, value and decision
+RECORD = struct.Struct(str('<qIHHHiB3x'))
+MAGIC = b'EVTT'
+VERSION = 1
+
+# Records made for a device rather than one of its events have no slot
+NO_SLOT = 0xffff
+
+# Decisions; key events are recorded once, with what was made of them
+KEY = 1              # Key state updated, nothing more
+UNBOUND = 2          # Key with no binding, ignored
+RESYNCING = 3        # Key ignored while resynchronising after SYN_DROPPED
+DROPPED = 4          # SYN_DROPPED, the kernel lost events
+RESYNC = 5           # Key state read back from the device
+COMPLETE = 6         # Press completed
+EXPIRED = 7          # Press took too long
+CHORD = 8            # Chord completed
+LONG = 9             # Long press
+HOLD = 10            # Hold repeat
+WATCH = 11           # Device being read
+CLOSE = 12           # Device closed
+QUARANTINE = 13      # Device quarantined for value seconds
+RELEASE = 14         # Device released from quarantine
+
+DECISIONS = {
+    KEY: 'key',
+    UNBOUND: 'unbound',
+    RESYNCING: 'resyncing',
+    DROPPED: 'dropped',
+    RESYNC: 'resync',
+    COMPLETE: 'complete',
+    EXPIRED: 'expired',
+    CHORD: 'chord',
+    LONG: 'long',
+    HOLD: 'hold',
+    WATCH: 'watch',
+    CLOSE: 'close',
+    QUARANTINE: 'quarantine',
+    RELEASE: 'release',
+}
+
+
+class TraceRing(object):
+    """
+    The agent's most recent ``size`` decisions about events and devices.
+
+    Each field is kept in its own preallocated array, so recording costs a
+    few stores and allocates nothing, and the ring can be left running in
+    production and dumped when something goes wrong.  Device slots are
+    mapped back to names using the names they were last given.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.sec = array.array(str('l'), [0]) * size
+        self.usec = array.array(str('l'), [0]) * size
+        self.slot = array.array(str('H'), [0]) * size
+        self.type = array.array(str('H'), [0]) * size
+        self.code = array.array(str('H'), [0]) * size
+        self.value = array.array(str('i'), [0]) * size
+        self.decision = array.array(str('B'), [0]) * size
+        self.pos = 0
+        self.count = 0
+        self.devices = {}
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def record(self, sec, usec, slot, etype, code, value, decision):
+        i = self.pos
+        self.sec[i] = sec
+        self.usec[i] = usec
+        self.slot[i] = slot
+        self.type[i] = etype
+        self.code[i] = code
+        self.value[i] = value
+        self.decision[i] = decision
+        i += 1
+        self.pos = 0 if i == self.size else i
+        self.count += 1
+
+    def record_now(self, slot, etype, code, value, decision):
+        now = time.time()
+        self.record(int(now), int((now % 1) * 1000000), slot, etype, code,
+                    value, decision)
+
+    def name_slot(self, slot, device_name):
+        self.devices[slot] = device_name
+
+    def __iter__(self):
+        """Yield the records, oldest first, as tuples."""
+        n = len(self)
+        start = (self.pos - n) % self.size if n else 0
+        for j in range(n):
+            i = (start + j) % self.size
+            yield (self.sec[i], self.usec[i], self.slot[i], self.type[i],
+                   self.code[i], self.value[i], self.decision[i])
+
+    def dump(self, path):
+        """Write the records to ``path`` and return how many there were."""
+        records = list(self)
+        devices = ''.join('%d\t%s\n' % (slot, name)
+                          for (slot, name) in sorted(self.devices.items())
+                          if name is not None).encode('utf-8')
+        with open_dump(path) as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(records),
+                                len(devices)))
+            f.write(devices)
+            for record in records:
+                f.write(RECORD.pack(*record))
+        return len(records)
+
+
+def open_dump(path):
+    """
+    Open ``path`` to write a dump to, only readable by us, refusing to
+    follow a symbolic link there which could have us overwrite any file.
+    """
+    flags = (os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+             getattr(os, 'O_NOFOLLOW', 0))
+    return io.open(os.open(path, flags, 0o600), 'wb')
+
+
+def load(path):
+    """
+    Read a dump written by :meth:`TraceRing.dump`, returning the device
+    names by slot and the list of records.
+    """
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    (magic, version, size, count, devices_size) = HEADER.unpack_from(data, 0)
+    if (magic != MAGIC or version != VERSION or size != RECORD.size):
+        raise ValueError('Not a supported trace: %s' % path)
+    offset = HEADER.size
+    devices = {}
+    for line in data[offset:offset + devices_size].decode(
+            'utf-8').splitlines():
+        (slot, name) = line.split('\t', 1)
+        devices[int(slot)] = name
+    offset += devices_size
+    count = min(count, (len(data) - offset) // RECORD.size)
+    records = [RECORD.unpack_from(data, offset + i * RECORD.size)
+               for i in range(count)]
+    return (devices, records)
+
+
+def _names():
+    # Event types and codes are named when evdev is to hand, but a trace
+    # can be decoded without it
+    try:
+        from evdev import ecodes
+    except ImportError:
+        return ({}, {})
+    codes = {}
+    for table in (ecodes.KEY, ecodes.BTN):
+        for (code, name) in table.items():
+            if (isinstance(name, (list, tuple))):
+                name = name[0]
+            codes.setdefault(code, name)
+    return (ecodes.EV, codes)
+
+
+def format_record(record, devices, types=None, codes=None):
+    (sec, usec, slot, etype, code, value, decision) = record
+    device = devices.get(slot, '-' if slot == NO_SLOT else '#%d' % slot)
+    if (decision in (WATCH, CLOSE, QUARANTINE, RELEASE)):
+        event = ''
+    else:
+        event = '%s %s %d' % ((types or {}).get(etype, etype),
+                              (codes or {}).get(code, code), value)
+    return '%d.%06d %s %s %s' % (
+        sec, usec, device, DECISIONS.get(decision, decision), event)
+
+
+def main(argv=None, out=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m mopidy_evtdev.trace',
+        description='Decode a Mopidy-EvtDev trace dump.')
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+    out = out or sys.stdout
+    (devices, records) = load(args.path)
+    (types, codes) = _names()
+    for record in records:
+        print(format_record(record, devices, types, codes).rstrip(),
+              file=out)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,8 @@ setup(
     author_email='liamw9534@gmail.com',
     description='Mopidy extension for virtual input devices',
     long_description=open('README.rst').read(),
-    packages=find_packages(exclude=['tests', 'tests.*']),
+    packages=find_packages(
+        exclude=['tests', 'tests.*', 'benchmarks', 'benchmarks.*']),
     zip_safe=False,
     include_package_data=True,
     install_requires=[
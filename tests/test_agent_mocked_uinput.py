@@ -2,8 +2,11 @@ from __future__ import unicode_literals
 
 import mock
 import unittest
+import errno
 import json
+import os
 import socket
+import threading
 import time
 
 import gobject
@@ -15,7 +18,9 @@ except ImportError:
     evdev = False
 
 if evdev:
-    from mopidy_evtdev import agent
+    from mopidy_evtdev import agent, sysfs
+    from mopidy_evtdev import reader as reader_lib
+    from mopidy_evtdev import trace as trace_lib
 
 from mopidy.core import PlaybackState
 
@@ -48,6 +53,8 @@ class EvtDevAgentTestCorners(unittest.TestCase):
         mock_device.fn = self.dev
         mock_device.phys = 'Mock'
         mock_device.name = 'Mock Device'
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
         input_device.return_value = mock_device
         a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
                               self.refresh_period)
@@ -71,6 +78,8 @@ class EvtDevAgentTestCorners(unittest.TestCase):
         mock_device.fn = self.dev
         mock_device.phys = 'Mock'
         mock_device.name = 'Mock Device'
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
         input_device.return_value = mock_device
         a = agent.EvtDevAgent(self.core, self.path, [],
                               self.vol_step_size, self.refresh_period)
@@ -91,6 +100,8 @@ class EvtDevAgentTestCorners(unittest.TestCase):
         mock_device.fn = self.dev
         mock_device.phys = 'Mock'
         mock_device.name = 'Mock Device'
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
         input_device.return_value = mock_device
         a = agent.EvtDevAgent(self.core, self.path, [],
                               self.vol_step_size, self.refresh_period)
@@ -98,10 +109,939 @@ class EvtDevAgentTestCorners(unittest.TestCase):
         io_callback = io_add_watch.call_args_list[0][0][2]
         io_exception = IOError('Mocked IO Error')
         mock_device.read_one.side_effect = io_exception
-        value = io_callback('NA', 'NA', mock_device)
+        value = io_callback('NA', gobject.IO_IN, mock_device)
         self.assertTrue(value)
         a.stop()
 
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_bulk_read(self, input_device, source_remove,
+                       io_add_watch, list_devices, timeout_add):
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+        list_devices.return_value = [self.dev]
+        mock_device = mock.MagicMock()
+        mock_device.fd = rfd
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_STOP]}
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, bulk_read=True)
+        io_callback = io_add_watch.call_args_list[0][0][2]
+        reader = io_add_watch.call_args_list[0][0][3]
+        events = [(0, 0, evdev.ecodes.EV_REL, evdev.ecodes.REL_X, 5),
+                  (0, 0, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 1),
+                  (0, 0, evdev.ecodes.EV_SYN, evdev.ecodes.SYN_REPORT, 0),
+                  (0, 0, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 0)]
+        os.write(wfd, b''.join(reader_lib.INPUT_EVENT.pack(*e)
+                               for e in events))
+        self.assertTrue(io_callback('NA', gobject.IO_IN, reader))
+        self.core.playback.stop.assert_called_once_with()
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_quarantine(self, input_device, source_remove,
+                        io_add_watch, list_devices, timeout_add):
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+        list_devices.return_value = [self.dev]
+        mock_device = mock.MagicMock()
+        mock_device.fd = rfd
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_STOP]}
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, bulk_read=True,
+                              event_limit=100, action_limit=1)
+        io_callback = io_add_watch.call_args_list[0][0][2]
+        reader = io_add_watch.call_args_list[0][0][3]
+        click = [(0, 0, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 1),
+                 (0, 0, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 0)]
+
+        # Too many actions: the burst is allowed, then the device is
+        # quarantined
+        os.write(wfd, b''.join(reader_lib.INPUT_EVENT.pack(*e)
+                               for e in click * 3))
+        io_callback('NA', gobject.IO_IN, reader)
+        self.assertEqual(self.core.playback.stop.call_count, 2)
+        self.assertNotIn(self.dev, a.event_sources)
+        source_remove.assert_called_with(io_add_watch.return_value)
+        (timeout, release_callback, device_name) = \
+            timeout_add.call_args[0]
+        self.assertEqual(timeout, agent.EvtDevAgent.QUARANTINE_BACKOFF * 1000)
+        self.assertEqual(a.get_rate_limit_stats()['quarantines'], 1)
+
+        # Events queued while quarantined are discarded on release
+        os.write(wfd, b''.join(reader_lib.INPUT_EVENT.pack(*e)
+                               for e in click))
+        self.assertFalse(release_callback(device_name))
+        self.assertIn(self.dev, a.event_sources)
+        reader = io_add_watch.call_args[0][3]
+        self.assertEqual(reader.read(), [])
+
+        # Too many events: nothing is handled and the backoff doubles
+        os.write(wfd, b''.join(reader_lib.INPUT_EVENT.pack(*e)
+                               for e in click * 101))
+        self.assertFalse(io_callback('NA', gobject.IO_IN, reader))
+        self.assertEqual(self.core.playback.stop.call_count, 2)
+        self.assertNotIn(self.dev, a.event_sources)
+        self.assertEqual(timeout_add.call_args[0][0],
+                         agent.EvtDevAgent.QUARANTINE_BACKOFF * 2000)
+        self.assertEqual(a.get_rate_limit_stats(),
+                         {'quarantines': 2, 'strikes': {self.dev: 2}})
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_read_batch(self, input_device, source_remove,
+                        io_add_watch, list_devices, timeout_add):
+        list_devices.return_value = [self.dev]
+        mock_device = mock.MagicMock()
+        mock_device.fd = 'N/A'
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.BTN_LEFT]}
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [self.dev],
+                              self.vol_step_size, self.refresh_period,
+                              read_batch=2)
+        # Devices without supported keys are served last
+        self.assertEqual(io_add_watch.call_args[1]['priority'],
+                         agent.PRIORITY_LOW)
+        io_callback = io_add_watch.call_args[0][2]
+        mock_device.read_one.side_effect = [
+            evdev.events.InputEvent(0, 0, evdev.ecodes.EV_REL,
+                                    evdev.ecodes.REL_X, 1)] * 3
+        self.assertTrue(io_callback('NA', gobject.IO_IN, mock_device))
+        self.assertEqual(mock_device.read_one.call_count, 2)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_syn_dropped(self, input_device, source_remove,
+                         io_add_watch, list_devices, timeout_add):
+        list_devices.return_value = [self.dev]
+        mock_device = mock.MagicMock()
+        mock_device.fd = 'N/A'
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_STOP]}
+        mock_device.active_keys.return_value = [evdev.ecodes.KEY_NEXTSONG]
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        a._select_device(self.dev)
+        ev_key, ev_syn = evdev.ecodes.EV_KEY, evdev.ecodes.EV_SYN
+        a._handle_event(0, 0, ev_key, evdev.ecodes.KEY_STOP, 1)
+        a._handle_event(0, 1, ev_syn, evdev.ecodes.SYN_DROPPED, 0)
+        # The end of one contact's part of a report doesn't end the resync
+        a._handle_event(0, 2, ev_syn, evdev.ecodes.SYN_MT_REPORT, 0)
+        self.assertFalse(mock_device.active_keys.called)
+        for (usec, etype, code, value) in [
+                # Discarded up to the end of the report, then resynced
+                (2, ev_key, evdev.ecodes.KEY_NEXTSONG, 0),
+                (3, ev_syn, evdev.ecodes.SYN_REPORT, 0),
+                (4, ev_key, evdev.ecodes.KEY_STOP, 0),
+                (5, ev_key, evdev.ecodes.KEY_NEXTSONG, 0)]:
+            a._handle_event(0, usec, etype, code, value)
+        mock_device.active_keys.assert_called_once_with()
+        self.assertFalse(self.core.playback.stop.called)
+        self.core.playback.next.assert_called_once_with()
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_deferred_start(self, input_device, source_remove,
+                            io_add_watch, list_devices, timeout_add):
+        devices = ['event%d' % i for i in range(4)]
+        list_devices.return_value = devices
+
+        def open_device(device_name):
+            mock_device = mock.MagicMock()
+            mock_device.fd = device_name
+            mock_device.fn = device_name
+            mock_device.capabilities.return_value = {
+                evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
+            return mock_device
+
+        input_device.side_effect = open_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, autostart=False)
+        self.assertFalse(list_devices.called)
+        a.start()
+        (timeout, start_callback) = timeout_add.call_args[0]
+        self.assertEqual(timeout, 0)
+        self.assertFalse(list_devices.called)
+        self.assertFalse(start_callback())
+        # New devices are all probed, in parallel
+        self.assertEqual(sorted(a.curr_input_devices), devices)
+        self.assertEqual(sorted(c[0][0] for c in io_add_watch.call_args_list),
+                         devices)
+        self.assertEqual(timeout_add.call_args[0][0],
+                         self.refresh_period * 1000)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_adaptive_refresh(self, input_device, source_remove,
+                              io_add_watch, list_devices, timeout_add):
+        list_devices.return_value = []
+        mock_device = mock.MagicMock()
+        mock_device.fd = 'N/A'
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              10, refresh_min=1, refresh_max=40)
+
+        def next_refresh():
+            (timeout, callback) = timeout_add.call_args[0]
+            callback()
+            return timeout
+
+        # Backs off while nothing changes
+        self.assertEqual(timeout_add.call_args[0][0], 20000)
+        self.assertEqual(next_refresh(), 20000)
+        self.assertEqual(next_refresh(), 40000)
+        self.assertEqual(timeout_add.call_args[0][0], 40000)
+        # Back to the configured period when a device is added
+        list_devices.return_value = [self.dev]
+        next_refresh()
+        self.assertEqual(timeout_add.call_args[0][0], 10000)
+        # An I/O error from the device brings the refresh forward, once
+        io_callback = io_add_watch.call_args[0][2]
+        mock_device.read_one.side_effect = IOError(errno.ENODEV, 'Gone')
+        source_remove.reset_mock()
+        io_callback('NA', gobject.IO_IN, mock_device)
+        io_callback('NA', gobject.IO_IN, mock_device)
+        self.assertEqual(source_remove.call_count, 1)
+        self.assertEqual(timeout_add.call_args[0][0], 1000)
+        # Polls fast once the device has gone
+        next_refresh()
+        list_devices.return_value = []
+        next_refresh()
+        self.assertEqual(timeout_add.call_args[0][0], 1000)
+        next_refresh()
+        self.assertEqual(timeout_add.call_args[0][0], 2000)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_volume_coalesce(self, source_remove, list_devices,
+                             timeout_add):
+        list_devices.return_value = []
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, vol_coalesce=50)
+        timeout_add.reset_mock()
+        a.update_volume(50)
+        a.update_mute(False)
+        a._volume_up()
+        a._volume_up()
+        a._volume_up()
+        a._volume_down()
+        timeout_add.assert_called_once_with(50, a._volume_timeout_callback)
+        self.assertFalse(self.core.playback.set_volume.called)
+        self.assertFalse(a._volume_timeout_callback())
+        self.core.playback.set_volume.assert_called_once_with(70)
+        self.assertFalse(self.core.playback.set_mute.called)
+        self.assertEqual(a.volume, 70)
+        self.core.reset_mock()
+        a.update_volume(95)
+        a.update_mute(True)
+        a._volume_up()
+        a._volume_up()
+        a._volume_down()
+        a._volume_timeout_callback()
+        self.core.playback.set_volume.assert_called_once_with(90)
+        self.core.playback.set_mute.assert_called_once_with(False)
+        self.assertFalse(self.core.playback.volume.get.called)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_dispatch_queue(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        done = threading.Event()
+        self.core.playback.stop.side_effect = lambda: done.set()
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, dispatch_queue=4)
+        a._handle_event(0, 0, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 1)
+        a._handle_event(0, 1, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 0)
+        self.assertTrue(done.wait(1.0))
+        self.core.playback.stop.assert_called_once_with()
+        self.assertEqual(a.get_dispatch_stats()['submitted'], 1)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_latency_stats(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, latency_stats=True)
+        timeout_add.reset_mock()
+        a.current_device = self.dev
+        now = time.time()
+        sec, usec = int(now), int((now % 1) * 1e6)
+        a._handle_event(sec, usec, evdev.ecodes.EV_KEY,
+                        evdev.ecodes.KEY_STOP, 1)
+        a._handle_event(sec, usec, evdev.ecodes.EV_KEY,
+                        evdev.ecodes.KEY_STOP, 0)
+        stats = a.get_latency_stats()
+        self.assertEqual(stats['devices'][self.dev]['complete']['count'], 1)
+        self.assertEqual(stats['actions']['_stop']['dispatch']['count'], 1)
+        self.assertNotIn('ack', stats['actions']['_stop'])
+        poll_callback = timeout_add.call_args_list[0][0][1]
+        self.assertFalse(poll_callback())
+        stats = a.get_latency_stats()
+        self.assertEqual(stats['actions']['_stop']['ack']['count'], 1)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_interleaved_devices(self, source_remove, list_devices,
+                                 timeout_add):
+        list_devices.return_value = []
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        for (device, usec, code, value) in [
+                ('event0', 0, evdev.ecodes.KEY_STOP, 1),
+                ('event1', 1, evdev.ecodes.KEY_STOP, 1),
+                ('event1', 2, evdev.ecodes.KEY_NEXTSONG, 1),
+                ('event1', 3, evdev.ecodes.KEY_STOP, 0),
+                ('event0', 4, evdev.ecodes.KEY_STOP, 0),
+                ('event1', 5, evdev.ecodes.KEY_NEXTSONG, 0)]:
+            a._select_device(device)
+            a._handle_event(0, usec, evdev.ecodes.EV_KEY, code, value)
+        self.assertEqual(self.core.playback.stop.call_count, 2)
+        self.core.playback.next.assert_called_once_with()
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_keymap(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period,
+                              keymap=['KEY_STOP = none',
+                                      'KEY_F1 = load_playlist:m3u:a.m3u',
+                                      '%d = shuffle' % evdev.ecodes.KEY_N])
+        self.assertFalse(a.key_table.is_bound(evdev.ecodes.KEY_STOP))
+        self.assertTrue(a.key_table.is_bound(evdev.ecodes.KEY_NEXTSONG))
+        a._select_device(self.dev)
+        for code in (evdev.ecodes.KEY_STOP, evdev.ecodes.KEY_F1,
+                     evdev.ecodes.KEY_N):
+            a._handle_event(0, 0, evdev.ecodes.EV_KEY, code, 1)
+            a._handle_event(0, 1, evdev.ecodes.EV_KEY, code, 0)
+        self.assertFalse(self.core.playback.stop.called)
+        self.core.playlists.lookup.assert_called_once_with('m3u:a.m3u')
+        self.assertFalse(self.core.tracklist.add.called)
+        while (a.futures._poll_timeout_callback()):
+            pass
+        self.core.tracklist.add.assert_called_once_with(
+            tracks=self.core.playlists.lookup.return_value.get.return_value
+            .tracks)
+        self.core.tracklist.shuffle.assert_called_once_with()
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_toggle_mode(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        self.core.tracklist.random.get.return_value = True
+        self.core.tracklist.repeat.get.return_value = False
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        random = a._toggle_random()
+        a._toggle_repeat()
+        # Core's answers are only picked up by the future watcher
+        self.assertFalse(self.core.tracklist.set_random.called)
+        self.assertFalse(self.core.tracklist.set_repeat.called)
+        while (a.futures._poll_timeout_callback()):
+            pass
+        self.core.tracklist.random.get.assert_called_once_with(timeout=0)
+        self.core.tracklist.set_random.assert_called_once_with(False)
+        self.core.tracklist.set_repeat.assert_called_once_with(True)
+        self.assertEqual(
+            random.get(timeout=0),
+            self.core.tracklist.set_random.return_value.get.return_value)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_chord(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period,
+                              keymap=['KEY_LEFTCTRL+KEY_STOP = shuffle'])
+        a._select_device(self.dev)
+        for (usec, code, value) in [
+                (0, evdev.ecodes.KEY_LEFTCTRL, 1),
+                (1, evdev.ecodes.KEY_STOP, 1),
+                (2, evdev.ecodes.KEY_STOP, 0),
+                (3, evdev.ecodes.KEY_LEFTCTRL, 0)]:
+            a._handle_event(0, usec, evdev.ecodes.EV_KEY, code, value)
+        self.core.tracklist.shuffle.assert_called_once_with()
+        self.assertFalse(self.core.playback.stop.called)
+        # Without the modifier the key does what it did before
+        a._handle_event(0, 4, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 1)
+        a._handle_event(0, 5, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 0)
+        self.core.playback.stop.assert_called_once_with()
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_long_press(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        self.core.playback.time_position.get.return_value = 1000
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, long_press=100,
+                              keymap=['KEY_NEXTSONG:long = seek_forward'])
+        a._select_device(self.dev)
+        timeout_add.reset_mock()
+
+        def press(usec, hold):
+            a._handle_event(0, usec, evdev.ecodes.EV_KEY,
+                            evdev.ecodes.KEY_NEXTSONG, 1)
+            (timeout, tick_callback) = timeout_add.call_args[0]
+            while (hold and tick_callback()):
+                hold -= timeout
+            a._handle_event(0, usec + 1, evdev.ecodes.EV_KEY,
+                            evdev.ecodes.KEY_NEXTSONG, 0)
+            while (tick_callback()):
+                pass
+
+        press(0, 100)
+        while (a.futures._poll_timeout_callback()):
+            pass
+        self.core.playback.seek.assert_called_once_with(
+            1000 + a.SEEK_STEP)
+        self.assertFalse(self.core.playback.next.called)
+        self.core.reset_mock()
+        press(2, 0)
+        self.core.playback.next.assert_called_once_with()
+        self.assertFalse(self.core.playback.seek.called)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_seek_coalesce(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        self.core.playback.time_position.get.return_value = 60000
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        a._seek_forward()
+        a._seek_forward()
+        a._seek_backward(5000)
+        a._seek_forward()
+        # Steps add up while core is asked where playback is
+        self.assertFalse(self.core.playback.seek.called)
+        self.assertTrue(a.futures._poll_timeout_callback())
+        self.core.playback.seek.assert_called_once_with(85000)
+        self.assertEqual(self.core.playback.time_position.get.call_count, 1)
+        self.core.playback.seek.reset_mock()
+        a._seek_forward()
+        a._seek_backward(5000)
+        self.assertTrue(a.futures._poll_timeout_callback())
+        self.core.playback.seek.assert_called_once_with(90000)
+        self.core.playback.seek.reset_mock()
+        self.assertFalse(a.futures._poll_timeout_callback())
+        self.assertFalse(self.core.playback.seek.called)
+        self.assertIsNone(a.seek_target)
+        a.stop()
+
+    @mock.patch('mopidy_evtdev.agent.time')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_hold_seek(self, source_remove, list_devices, timeout_add,
+                       time_mock):
+        list_devices.return_value = []
+        self.core.playback.time_position.get.return_value = 60000
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        a._select_device(self.dev)
+        code = evdev.ecodes.KEY_FASTFORWARD
+        positions = []
+        time_mock.time.return_value = 0.0
+        a._handle_event(0, 0, evdev.ecodes.EV_KEY, code, 1)
+        for i in range(1, 10):
+            time_mock.time.return_value = 0.25 * i
+            a._handle_event(0, 250000 * i, evdev.ecodes.EV_KEY, code, 2)
+            while (a.futures._poll_timeout_callback()):
+                pass
+            positions.append(self.core.playback.seek.call_args[0][0])
+        a._handle_event(2, 500000, evdev.ecodes.EV_KEY, code, 0)
+        # One step, then a step per second held, doubling every second
+        self.assertEqual(positions, [70000, 62500, 62500, 62500, 65000,
+                                     65000, 65000, 65000, 70000])
+        self.assertEqual(self.core.playback.seek.call_count, 9)
+        # A press still seeks a single step
+        time_mock.time.return_value = 10.0
+        a._handle_event(10, 0, evdev.ecodes.EV_KEY, code, 1)
+        a._handle_event(10, 1, evdev.ecodes.EV_KEY, code, 0)
+        while (a.futures._poll_timeout_callback()):
+            pass
+        self.core.playback.seek.assert_called_with(70000)
+        self.assertEqual(self.core.playback.seek.call_count, 10)
+        a.stop()
+
+    @mock.patch('mopidy_evtdev.agent.time')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_hold_rate_limit(self, source_remove, list_devices, timeout_add,
+                             time_mock):
+        list_devices.return_value = []
+        self.core.playback.time_position.get.return_value = 60000
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, event_limit=1000,
+                              action_limit=20)
+        a._select_device(self.dev)
+        code = evdev.ecodes.KEY_FASTFORWARD
+        time_mock.time.return_value = 0.0
+        a._handle_event(0, 0, evdev.ecodes.EV_KEY, code, 1)
+        # Autorepeat every 33ms for six seconds is one action, not 180
+        for i in range(1, 181):
+            time_mock.time.return_value = 0.033 * i
+            a._handle_event(0, 33000 * i, evdev.ecodes.EV_KEY, code, 2)
+            while (a.futures._poll_timeout_callback()):
+                pass
+        a._handle_event(6, 0, evdev.ecodes.EV_KEY, code, 0)
+        self.assertEqual(self.core.playback.seek.call_count, 180)
+        self.assertEqual(a.get_rate_limit_stats()['quarantines'], 0)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_perform_action(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        self.core.playback.time_position.get.return_value = 60000
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, latency_stats=True)
+        a.perform_action('/dev/input/event3', 'next_track', timestamp=1.0)
+        self.core.playback.next.assert_called_once_with()
+        a.perform_action('/dev/input/event3', 'seek_forward', 5000, 'hold')
+        while (a.futures._poll_timeout_callback()):
+            pass
+        self.core.playback.seek.assert_called_once_with(65000)
+        self.assertIn(('seek_forward', 5000, 'hold'), a.remote_handlers)
+        # Arguments are taken as text, as in key bindings
+        a.perform_action('/dev/input/event3', 'seek_forward', '5000', 'hold')
+        a.perform_action('/dev/input/event3', 'next_track', gesture=None)
+        self.assertEqual(len(a.remote_handlers), 2)
+        # Anything else is rejected rather than cached
+        for (action, arg, gesture) in [
+                ('dance', None, 'press'),
+                (['next_track'], None, 'press'),
+                ('next_track', None, 'tap'),
+                ('next_track', 1, 'press'),
+                ('seek_forward', [5000], 'press'),
+                ('seek_forward', {}, 'press'),
+                ('seek_forward', True, 'press'),
+                ('seek_forward', 'far', 'press'),
+                ('load_playlist', None, 'press')]:
+            a.perform_action('/dev/input/event3', action, arg, gesture)
+        self.assertEqual(len(a.remote_handlers), 2)
+        a.perform_action('/dev/input/event3', 'none')
+        # The cache is bounded however many arguments are sent
+        for i in range(a.REMOTE_HANDLERS + 1):
+            a.perform_action('/dev/input/event3', 'load_playlist',
+                             'm3u:%d' % i)
+        self.assertLessEqual(len(a.remote_handlers), a.REMOTE_HANDLERS)
+        stats = a.get_latency_stats()
+        self.assertEqual(
+            stats['devices']['/dev/input/event3']['complete']['count'], 1)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_skip_single_flight(self, source_remove, list_devices,
+                                timeout_add):
+        list_devices.return_value = []
+        tl_tracks = ['tl%d' % i for i in range(10)]
+        self.core.playback.current_tl_track.get.return_value = tl_tracks[2]
+        self.core.tracklist.next_track.side_effect = lambda tl_track: (
+            mock.Mock(**{'get.return_value':
+                         tl_tracks[tl_tracks.index(tl_track) + 1]}))
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        a.update_playback_state(PlaybackState.PLAYING)
+        for i in range(4):
+            a._next_track()
+        a._prev_track()
+        self.core.playback.next.assert_called_once_with()
+        # Once the first is done the rest are sent as one skip, core being
+        # asked where to a track at a time without ever waiting on it
+        while (a.futures._poll_timeout_callback()):
+            pass
+        self.assertEqual(self.core.tracklist.next_track.call_args_list,
+                         [mock.call('tl2'), mock.call('tl3')])
+        self.core.playback.play.assert_called_once_with(tl_track='tl4')
+        self.core.playback.current_tl_track.get.assert_called_once_with(
+            timeout=0)
+        self.assertEqual(a.get_command_stats()['skips'], 2)
+        self.assertEqual(a.get_command_stats()['skips_collapsed'], 4)
+        self.assertIsNone(a.skip_time)
+        # Skips that cancel out are not sent at all
+        a._next_track()
+        a._next_track()
+        a._prev_track()
+        a.futures._poll_timeout_callback()
+        self.assertEqual(self.core.playback.next.call_count, 2)
+        self.assertEqual(self.core.playback.play.call_count, 1)
+        self.assertFalse(self.core.playback.previous.called)
+        self.assertIsNone(a.skip_time)
+        # Where core can't tell us the next track, it is asked to change
+        # track once for each
+        del self.core.tracklist.next_track
+        for i in range(3):
+            a._next_track()
+        while (a.futures._poll_timeout_callback()):
+            pass
+        self.assertEqual(self.core.playback.next.call_count, 5)
+        self.assertEqual(self.core.playback.play.call_count, 1)
+        a.stop()
+
+    @mock.patch('mopidy_evtdev.agent.time')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_play_pause_single_flight(self, source_remove, list_devices,
+                                      timeout_add, time_mock):
+        list_devices.return_value = []
+        time_mock.time.return_value = 0.0
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        a.update_playback_state(PlaybackState.PLAYING)
+        a._play_pause()
+        a._play_pause()
+        self.core.playback.pause.assert_called_once_with()
+        # Acknowledged, but the state has yet to change
+        a.futures._poll_timeout_callback()
+        a._play_pause()
+        self.assertEqual(self.core.playback.pause.call_count, 1)
+        a.update_playback_state(PlaybackState.PAUSED)
+        a._play_pause()
+        self.core.playback.resume.assert_called_once_with()
+        # A toggle core never acts on holds the next one up for so long
+        time_mock.time.return_value = a.TOGGLE_TIMEOUT
+        a._play_pause()
+        self.assertEqual(self.core.playback.resume.call_count, 2)
+        self.assertEqual(a.get_command_stats()['toggles'], 3)
+        self.assertEqual(a.get_command_stats()['toggles_ignored'], 2)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.source_remove')
+    def test_trace(self, source_remove, list_devices, timeout_add):
+        list_devices.return_value = []
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, trace_size=4,
+                              keymap=['KEY_LEFTCTRL+KEY_STOP = shuffle'])
+        a._select_device(self.dev)
+        for (usec, etype, code, value) in [
+                (0, evdev.ecodes.EV_REL, evdev.ecodes.REL_X, 1),
+                (1, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_A, 1),
+                (2, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_LEFTCTRL, 1),
+                (3, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 1),
+                (4, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_STOP, 0),
+                (5, evdev.ecodes.EV_KEY, evdev.ecodes.KEY_LEFTCTRL, 0)]:
+            a._handle_event(0, usec, etype, code, value)
+        # Only the last events, each with what became of it
+        self.assertEqual(
+            [(record[1], record[6]) for record in a.trace],
+            [(2, trace_lib.KEY), (3, trace_lib.CHORD), (4, trace_lib.KEY),
+             (5, trace_lib.KEY)])
+        self.assertEqual(a.trace.count, 5)
+        # There is nowhere to dump it without a trace file
+        self.assertIsNone(a.dump_trace())
+        self.assertIsNone(
+            agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period).dump_trace())
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_profiling(self, input_device, source_remove, io_add_watch,
+                       list_devices, timeout_add):
+        list_devices.return_value = [self.dev]
+        mock_device = mock.MagicMock()
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_STOP]}
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        self.assertIsNone(a.get_profile_stats())
+        a.enable_profiling()
+        (timeout, callback, profiler) = timeout_add.call_args[0]
+        self.assertEqual(timeout, 0)
+        io_add_watch.reset_mock()
+        self.assertFalse(callback(profiler))
+        self.assertTrue(a.profiling)
+        # The device is watched again, through the profiled callback
+        (fd, condition, fd_callback, device) = io_add_watch.call_args[0]
+        self.assertEqual(condition,
+                         gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR)
+        self.assertIs(fd_callback, a._fd_ready_callback)
+        mock_device.read_one.side_effect = [
+            evdev.events.InputEvent(0, 0, evdev.ecodes.EV_KEY,
+                                    evdev.ecodes.KEY_STOP, 1),
+            evdev.events.InputEvent(0, 1, evdev.ecodes.EV_KEY,
+                                    evdev.ecodes.KEY_STOP, 0),
+            None]
+        fd_callback(fd, gobject.IO_IN, device)
+        stats = a.get_profile_stats()
+        self.assertEqual(stats['_fd_ready_callback']['calls'], 1)
+        self.assertEqual(stats['_run_action']['calls'], 1)
+        self.core.playback.stop.assert_called_once_with()
+        # The profile is dumped once profiling has stopped
+        a.dump_profile = mock.Mock(
+            side_effect=lambda: self.assertFalse(a.profiling))
+        a.disable_profiling(dump=True)
+        (timeout, callback, dump) = timeout_add.call_args[0]
+        self.assertFalse(a.dump_profile.called)
+        self.assertFalse(callback(dump))
+        a.dump_profile.assert_called_once_with()
+        self.assertFalse(a.profiling)
+        self.assertNotIn('_fd_ready_callback', a.__dict__)
+        self.assertEqual(a.get_profile_stats(), stats)
+        a.stop()
+
+    @mock.patch('mopidy_evtdev.agent.DeviceInfoCache')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_sysfs_identifies_devices(self, input_device, source_remove,
+                                      io_add_watch, list_devices,
+                                      timeout_add, device_info_cache):
+        list_devices.return_value = [self.dev]
+        info = sysfs.DeviceInfo(self.dev, 'Other Device', 'Other', '')
+        device_info_cache.return_value.lookup.return_value = info
+        a = agent.EvtDevAgent(self.core, self.path, ['Mock Device'],
+                              self.vol_step_size, self.refresh_period)
+        self.assertFalse(input_device.called)
+        self.assertEqual(a.curr_input_devices, {})
+        info.name = 'Mock Device'
+        a._refresh_timeout_callback()
+        input_device.assert_called_with(self.dev)
+        self.assertIn(self.dev, a.curr_input_devices)
+        a.stop()
+
+    @mock.patch('mopidy_evtdev.agent.DeviceInfoCache')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_skip_incapable_devices(self, input_device, source_remove,
+                                    io_add_watch, list_devices,
+                                    timeout_add, device_info_cache):
+        mouse = '/dev/input/event1'
+        remote = '/dev/input/event2'
+        unknown = '/dev/input/event3'
+        list_devices.return_value = [mouse, remote, unknown]
+        infos = {
+            mouse: sysfs.DeviceInfo(mouse, 'Mouse', '', '',
+                                    frozenset([evdev.ecodes.BTN_LEFT])),
+            remote: sysfs.DeviceInfo(remote, 'Remote', '', '',
+                                     frozenset([evdev.ecodes.KEY_PLAY])),
+            unknown: sysfs.DeviceInfo(unknown, 'Unknown', '', '')}
+        device_info_cache.return_value.lookup.side_effect = infos.get
+        unknown_device = mock.MagicMock()
+        unknown_device.fn = unknown
+        unknown_device.name = 'Unknown'
+        unknown_device.capabilities.return_value = {
+            evdev.ecodes.EV_REL: [evdev.ecodes.REL_X]}
+        input_device.side_effect = lambda fn: \
+            unknown_device if fn == unknown else mock.MagicMock(fn=fn)
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        self.assertEqual(set(a.curr_input_devices), set([remote]))
+        self.assertEqual(a.skipped_devices, set([mouse, unknown]))
+        unknown_device.close.assert_called_with()
+        a.stop()
+
+    @mock.patch.object(agent.EvtDevAgent, '_node_key')
+    @mock.patch('mopidy_evtdev.agent.DeviceInfoCache')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_rejected_devices_not_probed(self, input_device, source_remove,
+                                         io_add_watch, list_devices,
+                                         timeout_add, device_info_cache,
+                                         node_key):
+        mice = ['/dev/input/event%d' % i for i in range(1, 4)]
+        remote = '/dev/input/event4'
+        list_devices.return_value = mice + [remote]
+        lookup = device_info_cache.return_value.lookup
+        lookup.side_effect = lambda fn: sysfs.DeviceInfo(
+            fn, 'Remote' if fn == remote else 'Mouse', '', '',
+            frozenset([evdev.ecodes.KEY_PLAY if fn == remote
+                       else evdev.ecodes.BTN_LEFT]))
+        keys = dict((fn, (1, i)) for (i, fn) in enumerate(mice))
+        node_key.side_effect = keys.get
+        input_device.side_effect = lambda fn: mock.MagicMock(fn=fn)
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period)
+        self.assertEqual(set(a.curr_input_devices), set([remote]))
+        pool = a.probe_pool
+        self.assertIsNotNone(pool)
+        # Nodes that were not wanted are left alone from then on
+        lookup.reset_mock()
+        self.assertEqual(a._reconcile_devices(), (set(), set()))
+        self.assertFalse(lookup.called)
+        # unless they are re-created
+        keys[mice[0]] = (1, 10)
+        keys[mice[1]] = (1, 11)
+        a._reconcile_devices()
+        self.assertEqual(sorted(c[0][0] for c in lookup.call_args_list),
+                         mice[:2])
+        self.assertIs(a.probe_pool, pool)
+        a.stop()
+        self.assertIsNone(a.probe_pool)
+
+    @mock.patch('mopidy_evtdev.agent.HotplugMonitor')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_hotplug_add_remove(self, input_device, source_remove,
+                                io_add_watch, list_devices, timeout_add,
+                                hotplug_monitor):
+        list_devices.return_value = []
+        mock_device = mock.MagicMock()
+        mock_device.fd = 'N/A'
+        mock_device.fn = self.dev
+        mock_device.phys = 'Mock'
+        mock_device.name = 'Mock Device'
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
+        input_device.return_value = mock_device
+        monitor = hotplug_monitor.return_value
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              self.refresh_period, hotplug=True)
+        hotplug_callback = io_add_watch.call_args_list[0][0][2]
+        timeout = timeout_add.call_args_list[0][0][0]
+        self.assertEqual(timeout, agent.EvtDevAgent.HOTPLUG_REFRESH * 1000)
+        monitor.read_changes.return_value = [
+            (agent.HotplugMonitor.ADDED, self.dev)]
+        self.assertTrue(hotplug_callback('NA', 'NA'))
+        input_device.assert_called_with(self.dev)
+        self.assertIn(self.dev, a.curr_input_devices)
+        self.assertIn(self.dev, a.event_sources)
+        monitor.read_changes.return_value = [
+            (agent.HotplugMonitor.REMOVED, self.dev)]
+        self.assertTrue(hotplug_callback('NA', 'NA'))
+        mock_device.close.assert_called_with()
+        self.assertNotIn(self.dev, a.curr_input_devices)
+        a.stop()
+        monitor.close.assert_called_with()
+
+    @mock.patch('mopidy_evtdev.agent.HotplugMonitor')
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_hotplug_refresh_soon(self, input_device, source_remove,
+                                  io_add_watch, list_devices, timeout_add,
+                                  hotplug_monitor):
+        list_devices.return_value = [self.dev]
+        mock_device = mock.MagicMock()
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              10, hotplug=True, refresh_min=1)
+        self.assertEqual(timeout_add.call_args[0][0],
+                         agent.EvtDevAgent.HOTPLUG_REFRESH * 1000)
+        # A device failing without its node going brings the refresh
+        # forward to refresh_min all the same
+        io_callback = io_add_watch.call_args[0][2]
+        mock_device.read_one.side_effect = IOError(errno.EIO, 'Failed')
+        io_callback('NA', gobject.IO_IN, mock_device)
+        (timeout, callback) = timeout_add.call_args[0]
+        self.assertEqual(timeout, 1000)
+        callback()
+        self.assertEqual(timeout_add.call_args[0][0],
+                         agent.EvtDevAgent.HOTPLUG_REFRESH * 1000)
+        a.stop()
+
+    @mock.patch('gobject.timeout_add')
+    @mock.patch('evdev.util.list_devices')
+    @mock.patch('gobject.io_add_watch')
+    @mock.patch('gobject.source_remove')
+    @mock.patch('evdev.device.InputDevice', autospec=True)
+    def test_hang_up(self, input_device, source_remove, io_add_watch,
+                     list_devices, timeout_add):
+        list_devices.return_value = [self.dev]
+        mock_device = mock.MagicMock()
+        mock_device.fn = self.dev
+        mock_device.capabilities.return_value = {
+            evdev.ecodes.EV_KEY: [evdev.ecodes.KEY_PLAY]}
+        input_device.return_value = mock_device
+        a = agent.EvtDevAgent(self.core, self.path, [], self.vol_step_size,
+                              10, refresh_min=1)
+        io_callback = io_add_watch.call_args[0][2]
+        source_remove.reset_mock()
+        # The device is closed and its watch removed by returning False,
+        # without reading it, and the next refresh brought forward
+        self.assertFalse(io_callback('NA', gobject.IO_HUP, mock_device))
+        self.assertFalse(mock_device.read_one.called)
+        mock_device.close.assert_called_once_with()
+        self.assertNotIn(self.dev, a.curr_input_devices)
+        self.assertNotIn(self.dev, a.event_sources)
+        self.assertEqual(timeout_add.call_args[0][0], 1000)
+        # Only the refresh timeout was removed, not the device's watch
+        self.assertEqual(source_remove.call_count, 1)
+        a.stop()
+
 
 @unittest.skipUnless(evdev, 'evdev not found')
 class EvtDevAgentTest(unittest.TestCase):
@@ -130,45 +1070,61 @@ class EvtDevAgentTest(unittest.TestCase):
     def tearDown(self):
         self.agent.stop()
 
+    def _ack(self):
+        # Core acknowledges the commands sent so far
+        self.agent.futures._poll_timeout_callback()
+
     def test_play(self):
         self.core.playback.state.get.return_value = PlaybackState.STOPPED
         self.devices[0].send_play()
+        self._ack()
         self.core.playback.play.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PAUSED
         self.devices[0].send_play()
+        self._ack()
         self.core.playback.resume.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PLAYING
         self.devices[0].send_play()
+        self._ack()
         self.core.playback.pause.assert_called_once_with()
         self.core.reset_mock()
         self.core.playback.state.get.return_value = PlaybackState.STOPPED
         self.devices[0].send_play_cd()
+        self._ack()
         self.core.playback.play.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PAUSED
         self.devices[0].send_play_cd()
+        self._ack()
         self.core.playback.resume.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PLAYING
         self.devices[0].send_play_cd()
+        self._ack()
         self.core.playback.pause.assert_called_once_with()
         self.core.reset_mock()
         self.core.playback.state.get.return_value = PlaybackState.STOPPED
         self.devices[0].send_play_pause()
+        self._ack()
         self.core.playback.play.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PAUSED
         self.devices[0].send_play_pause()
+        self._ack()
         self.core.playback.resume.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PLAYING
         self.devices[0].send_play_pause()
+        self._ack()
         self.core.playback.pause.assert_called_once_with()
         self.core.reset_mock()
         self.core.playback.state.get.return_value = PlaybackState.STOPPED
         self.devices[0].send_pause()
+        self._ack()
         self.core.playback.play.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PAUSED
         self.devices[0].send_pause()
+        self._ack()
         self.core.playback.resume.assert_called_once_with()
         self.core.playback.state.get.return_value = PlaybackState.PLAYING
         self.devices[0].send_pause()
+        self._ack()
         self.core.playback.pause.assert_called_once_with()
 
     def test_stop(self):
@@ -217,6 +1173,21 @@ class EvtDevAgentTest(unittest.TestCase):
         self.devices[0].send_mute()
         self.core.playback.set_mute.assert_called_once_with(True)
 
+    def test_shadow_state(self):
+        self.agent.update_playback_state(PlaybackState.PLAYING)
+        self.devices[0].send_play()
+        self.core.playback.pause.assert_called_once_with()
+        self.agent.update_volume(50)
+        self.devices[0].send_volume_up()
+        self.core.playback.set_volume.assert_called_once_with(
+            50 + self.vol_step_size)
+        self.agent.update_mute(True)
+        self.devices[0].send_mute()
+        self.core.playback.set_mute.assert_called_with(False)
+        self.assertFalse(self.core.playback.state.get.called)
+        self.assertFalse(self.core.playback.volume.get.called)
+        self.assertFalse(self.core.playback.mute.get.called)
+
     def test_next_song(self):
         self.devices[0].send_next_song()
         self.core.playback.next.assert_called_once_with()
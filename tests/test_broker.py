@@ -0,0 +1,175 @@
+from __future__ import unicode_literals
+
+import itertools
+import mock
+import os
+import select
+import shutil
+import socket
+import tempfile
+import unittest
+
+try:
+    import evdev
+except ImportError:
+    evdev = False
+
+from mopidy_evtdev import broker as broker_lib
+from mopidy_evtdev.broker import Action, BrokerClient, BrokerServer
+
+IDENTITY = ('/dev/input/event3', 'Living Room Remote', 'usb-1/input0', '')
+
+
+class SelectEngine(object):
+    """Runs io watches on demand; timeouts are only recorded."""
+
+    def __init__(self):
+        self.tags = itertools.count(1)
+        self.watches = {}
+        self.timeouts = {}
+
+    def io_add_watch(self, fd, callback, *args, **kwargs):
+        tag = next(self.tags)
+        self.watches[tag] = (fd, callback, args)
+        return tag
+
+    def timeout_add(self, interval, callback, *args):
+        tag = next(self.tags)
+        self.timeouts[tag] = (interval, callback, args)
+        return tag
+
+    def source_remove(self, tag):
+        self.watches.pop(tag, None)
+        self.timeouts.pop(tag, None)
+
+    def iterate(self, timeout=0.1):
+        fds = dict((watch[0], tag) for (tag, watch) in self.watches.items())
+        (ready, _, _) = select.select(list(fds.keys()), [], [], timeout)
+        for fd in ready:
+            tag = fds[fd]
+            watch = self.watches.get(tag)
+            if (watch is not None and not watch[1](fd, 1, *watch[2])):
+                self.source_remove(tag)
+
+    def fire_timeouts(self):
+        for (tag, (interval, callback, args)) in list(self.timeouts.items()):
+            if (not callback(*args)):
+                self.source_remove(tag)
+
+
+class BrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'broker.sock')
+        self.engine = SelectEngine()
+        self.server = BrokerServer(self.engine, self.path)
+        self.messages = []
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def _subscribe(self, devices):
+        client = BrokerClient(self.engine, self.path, devices,
+                              self.messages.append)
+        client.start()
+        self.addCleanup(client.stop)
+        while (not any(s[2] is not None
+                       for s in self.server.subscribers.values())):
+            self.engine.iterate()
+        return client
+
+    def test_publish(self):
+        self.server.start()
+        self._subscribe(['re:Remote'])
+        self.server.publish(IDENTITY, Action('seek_forward', 5000, 'hold'),
+                            1.5)
+        self.server.publish(('/dev/input/event4', 'Keyboard', '', ''),
+                            Action('stop', None, 'press'), 2.0)
+        self.engine.iterate()
+        self.assertEqual(self.messages, [{
+            'device': '/dev/input/event3', 'name': 'Living Room Remote',
+            'phys': 'usb-1/input0', 'uniq': '', 'action': 'seek_forward',
+            'arg': 5000, 'gesture': 'hold', 'time': 1.5}])
+        self.assertEqual(self.server.get_stats(),
+                         {'subscribers': 1, 'published': 1, 'dropped': 0})
+
+    def test_subscribe_all(self):
+        self.server.start()
+        self._subscribe([])
+        self.server.publish(IDENTITY, Action('stop', None, 'press'), 1.0)
+        self.engine.iterate()
+        self.assertEqual(len(self.messages), 1)
+
+    def test_slow_subscriber(self):
+        self.server.start()
+        self._subscribe([])
+        # The subscriber is never read from, but publishing never blocks
+        # and the subscriber is dropped once its backlog is full
+        for i in range(20000):
+            self.server.publish(IDENTITY, Action('stop', None, 'press'), i)
+        stats = self.server.get_stats()
+        self.assertLess(stats['published'], 1000)
+        self.assertEqual(stats['subscribers'], 0)
+        self.assertEqual(stats['dropped'], 1)
+
+    def test_permissions(self):
+        self.server.path = os.path.join(self.dir, 'run', 'broker.sock')
+        self.server.start()
+        self.assertEqual(os.stat(self.server.path).st_mode & 0o777, 0o660)
+        mode = os.stat(os.path.dirname(self.server.path)).st_mode
+        self.assertEqual(mode & 0o007, 0)
+
+    def test_reconnect(self):
+        client = BrokerClient(self.engine, self.path, [],
+                              self.messages.append)
+        client.start()
+        self.addCleanup(client.stop)
+        self.assertIsNone(client.sock)
+        self.assertEqual(len(self.engine.timeouts), 1)
+        self.server.start()
+        self.engine.fire_timeouts()
+        self.assertIsNotNone(client.sock)
+        self.assertEqual(len(self.engine.timeouts), 0)
+        self.engine.iterate()
+        self.server.stop()
+        self.engine.iterate()
+        self.assertIsNone(client.sock)
+        self.assertEqual(len(self.engine.timeouts), 1)
+
+    def test_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        self.server.start()
+        other = BrokerServer(self.engine, self.path)
+        self.assertRaises(IOError, other.start)
+
+    def test_malformed_messages(self):
+        (messages, buf) = broker_lib.decode_lines(b'{"a"', b':1}\n\nxx\n{')
+        self.assertEqual(messages, [{'a': 1}])
+        self.assertEqual(buf, b'{')
+
+
+@unittest.skipUnless(evdev, 'evdev is not available')
+class PublishingAgentTest(unittest.TestCase):
+
+    @mock.patch('evdev.util.list_devices')
+    def test_publish(self, list_devices):
+        list_devices.return_value = []
+        publish = mock.Mock()
+        a = broker_lib.PublishingAgent(publish, '/dev/input', [], 0, 10,
+                                       engine=mock.Mock())
+        a._select_device('/dev/input/event3')
+        for (code, value) in [(evdev.ecodes.KEY_STOP, 1),
+                              (evdev.ecodes.KEY_STOP, 0),
+                              (evdev.ecodes.KEY_FASTFORWARD, 1),
+                              (evdev.ecodes.KEY_FASTFORWARD, 2),
+                              (evdev.ecodes.KEY_FASTFORWARD, 0)]:
+            a._handle_event(1, 500000, evdev.ecodes.EV_KEY, code, value)
+        identity = ('/dev/input/event3', '', '', '')
+        self.assertEqual(publish.call_args_list, [
+            mock.call(identity, Action('stop', None, 'press'), 1.5),
+            mock.call(identity, Action('seek_forward', None, 'hold'), 1.5)])
+        a.stop()
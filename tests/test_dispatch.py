@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+from mopidy_evtdev.dispatch import CommandDispatcher
+
+
+class CommandDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.dispatcher = CommandDispatcher(
+            4, {'volume': CommandDispatcher.LATEST,
+                'toggle': CommandDispatcher.DEDUPE}, dedupe_threshold=2)
+
+    def tearDown(self):
+        self.dispatcher.stop()
+
+    def _command(self, *args):
+        self.calls.append(args)
+
+    def test_fifo(self):
+        self.assertTrue(self.dispatcher.submit('next', self._command, 1))
+        self.assertTrue(self.dispatcher.submit('next', self._command, 2))
+        self.assertEqual(self.dispatcher.depth, 2)
+
+    def test_latest(self):
+        self.dispatcher.submit('volume', self._command, 10)
+        self.dispatcher.submit('next', self._command)
+        self.dispatcher.submit('volume', self._command, 30)
+        self.assertEqual(self.dispatcher.depth, 2)
+        self.assertEqual(self.dispatcher.queue[0][2], (30,))
+        self.assertEqual(self.dispatcher.replaced, 1)
+
+    def test_dedupe(self):
+        self.assertTrue(self.dispatcher.submit('toggle', self._command))
+        self.assertTrue(self.dispatcher.submit('toggle', self._command))
+        self.assertFalse(self.dispatcher.submit('toggle', self._command))
+        self.assertEqual(self.dispatcher.dropped, 1)
+
+    def test_bounded(self):
+        for i in range(4):
+            self.assertTrue(self.dispatcher.submit('next', self._command))
+        self.assertFalse(self.dispatcher.submit('next', self._command))
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats['depth'], 4)
+        self.assertEqual(stats['max_depth'], 4)
+        self.assertEqual(stats['dropped'], 1)
+
+    def test_worker(self):
+        done = threading.Event()
+        self.dispatcher.start()
+        self.dispatcher.submit('fail', self._fail)
+        self.dispatcher.submit('next', self._command, 1)
+        self.dispatcher.submit('next', done.set)
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(self.calls, [(1,)])
+        self.assertEqual(self.dispatcher.depth, 0)
+
+    def _fail(self):
+        raise RuntimeError('Mocked failure')
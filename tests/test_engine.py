@@ -0,0 +1,100 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+import unittest
+
+from mopidy_evtdev import engine
+from mopidy_evtdev.engine import EpollEngine
+
+
+class EpollEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = EpollEngine()
+        self.engine.start()
+        self.rfd, self.wfd = os.pipe()
+
+    def tearDown(self):
+        self.engine.stop()
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+    def test_io_watch(self):
+        done = threading.Event()
+        received = []
+
+        def callback(fd, condition, data):
+            received.append((fd, os.read(fd, 1), data))
+            done.set()
+            return True
+
+        self.engine.io_add_watch(self.rfd, callback, 'data')
+        os.write(self.wfd, b'x')
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(received, [(self.rfd, b'x', 'data')])
+
+    def test_io_watch_removed_on_false(self):
+        done = threading.Event()
+
+        def callback(fd, condition):
+            os.read(fd, 1)
+            done.set()
+            return False
+
+        tag = self.engine.io_add_watch(self.rfd, callback)
+        os.write(self.wfd, b'x')
+        self.assertTrue(done.wait(1.0))
+        for i in range(100):
+            if (tag not in self.engine.watches):
+                break
+            time.sleep(0.01)
+        self.assertNotIn(tag, self.engine.watches)
+
+    def test_io_watch_priority(self):
+        done = threading.Event()
+        order = []
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+
+        def callback(fd, condition, name):
+            os.read(fd, 1)
+            order.append(name)
+            if (len(order) == 2):
+                done.set()
+            return True
+
+        self.engine.io_add_watch(self.rfd, callback, 'low',
+                                 priority=engine.PRIORITY_LOW)
+        self.engine.io_add_watch(rfd, callback, 'default')
+        # Both are made ready together while the loop is busy
+        self.engine.timeout_add(0, lambda: time.sleep(0.1))
+        time.sleep(0.05)
+        os.write(self.wfd, b'x')
+        os.write(wfd, b'x')
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(order, ['default', 'low'])
+
+    def test_timeout(self):
+        done = threading.Event()
+        calls = []
+
+        def callback(arg):
+            calls.append(arg)
+            if (len(calls) == 3):
+                done.set()
+                return False
+            return True
+
+        tag = self.engine.timeout_add(1, callback, 'arg')
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(calls, ['arg'] * 3)
+        self.assertNotIn(tag, self.engine.timeouts)
+
+    def test_source_remove(self):
+        fired = threading.Event()
+        tag = self.engine.timeout_add(50, fired.set)
+        self.engine.source_remove(tag)
+        self.assertFalse(fired.wait(0.2))
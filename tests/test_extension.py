@@ -17,7 +17,32 @@ class ExtensionTest(unittest.TestCase):
         self.assertIn('enabled = true', config)
         self.assertIn('dev_dir = /dev/input', config)
         self.assertIn('devices =', config)
+        self.assertIn('refresh_min =', config)
+        self.assertIn('refresh_max =', config)
         self.assertIn('vol_step_size = 10', config)
+        self.assertIn('hotplug = false', config)
+        self.assertIn('bulk_read = false', config)
+        self.assertIn('vol_coalesce = 0', config)
+        self.assertIn('dispatch_queue = 0', config)
+        self.assertIn('engine = gobject', config)
+        self.assertIn('latency_stats = false', config)
+        self.assertIn('record_file =', config)
+        self.assertIn('event_limit = 0', config)
+        self.assertIn('action_limit = 0', config)
+        self.assertIn('read_batch = 0', config)
+        self.assertIn('keymap =', config)
+        self.assertIn('long_press = 800', config)
+        self.assertIn('broker_socket =', config)
+        self.assertIn('gateway_host = 127.0.0.1', config)
+        self.assertIn('gateway_port =', config)
+        self.assertIn('gateway_secret =', config)
+        self.assertIn('trace_size = 0', config)
+        self.assertIn('trace_file =', config)
+        self.assertIn('profile = false', config)
+        self.assertIn('profile_sample = 0', config)
+        self.assertIn('profile_file =', config)
+        self.assertIn('trace_signal =', config)
+        self.assertIn('profile_signal =', config)
 
     def test_get_config_schema(self):
         ext = Extension()
@@ -25,8 +50,33 @@ class ExtensionTest(unittest.TestCase):
         schema = ext.get_config_schema()
         self.assertIn('devices', schema)
         self.assertIn('refresh', schema)
+        self.assertIn('refresh_min', schema)
+        self.assertIn('refresh_max', schema)
         self.assertIn('vol_step_size', schema)
         self.assertIn('dev_dir', schema)
+        self.assertIn('hotplug', schema)
+        self.assertIn('bulk_read', schema)
+        self.assertIn('vol_coalesce', schema)
+        self.assertIn('dispatch_queue', schema)
+        self.assertIn('engine', schema)
+        self.assertIn('latency_stats', schema)
+        self.assertIn('record_file', schema)
+        self.assertIn('event_limit', schema)
+        self.assertIn('action_limit', schema)
+        self.assertIn('read_batch', schema)
+        self.assertIn('keymap', schema)
+        self.assertIn('long_press', schema)
+        self.assertIn('broker_socket', schema)
+        self.assertIn('gateway_host', schema)
+        self.assertIn('gateway_port', schema)
+        self.assertIn('gateway_secret', schema)
+        self.assertIn('trace_size', schema)
+        self.assertIn('trace_file', schema)
+        self.assertIn('profile', schema)
+        self.assertIn('profile_sample', schema)
+        self.assertIn('profile_file', schema)
+        self.assertIn('trace_signal', schema)
+        self.assertIn('profile_signal', schema)
 
     def test_setup(self):
         registry = mock.Mock()
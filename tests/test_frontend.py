@@ -0,0 +1,178 @@
+from __future__ import unicode_literals
+
+import ConfigParser
+import io
+import mock
+import signal
+import unittest
+
+from mopidy.core import PlaybackState
+
+from mopidy_evtdev import Extension, agent as agent_lib
+from mopidy_evtdev import broker as broker_lib
+from mopidy_evtdev import frontend as frontend_lib
+from mopidy_evtdev import gateway as gateway_lib
+
+
+def get_default_config():
+    ext = Extension()
+    parser = ConfigParser.RawConfigParser()
+    parser.readfp(io.BytesIO(ext.get_default_config()))
+    config, errors = ext.get_config_schema().deserialize(
+        dict(parser.items(ext.ext_name)))
+    assert not errors, errors
+    return {ext.ext_name: config}
+
+
+class EvtDevFrontendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = get_default_config()
+        self.core = mock.Mock()
+        patcher = mock.patch.object(agent_lib, 'EvtDevAgent')
+        self.agent_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.frontend = frontend_lib.EvtDevFrontend(self.config, self.core)
+        self.agent = self.agent_class.return_value
+
+    def test_starts_agent_after_actor(self):
+        self.assertFalse(self.agent_class.called)
+        self.frontend.on_start()
+        self.assertFalse(self.agent_class.call_args[1]['autostart'])
+        self.agent.start.assert_called_once_with()
+
+    @mock.patch.object(frontend_lib, 'logger')
+    @mock.patch.object(broker_lib, 'BrokerClient')
+    def test_broker(self, client_class, logger):
+        self.config['evtdev']['broker_socket'] = '/run/evtdev.sock'
+        self.config['evtdev']['devices'] = ('re:Remote',)
+        self.config['evtdev']['keymap'] = ['KEY_A = stop']
+        self.frontend.on_start()
+        self.assertFalse(self.agent.start.called)
+        self.assertTrue(logger.warning.called)
+        client_class.assert_called_once_with(
+            self.frontend.engine, '/run/evtdev.sock', ('re:Remote',),
+            mock.ANY)
+        client = client_class.return_value
+        client.start.assert_called_once_with()
+        callback = client_class.call_args[0][3]
+        callback({'device': '/dev/input/event3', 'action': 'seek_forward',
+                  'arg': 5000, 'gesture': 'hold', 'time': 1.5})
+        self.agent.perform_action.assert_called_once_with(
+            '/dev/input/event3', 'seek_forward', 5000, 'hold', 1.5)
+        self.frontend.on_stop()
+        client.stop.assert_called_once_with()
+
+    @mock.patch('time.time')
+    @mock.patch.object(gateway_lib, 'GatewayReceiver')
+    def test_gateway(self, receiver_class, time_mock):
+        time_mock.return_value = 10.0
+        self.config['evtdev']['gateway_port'] = 6690
+        self.config['evtdev']['gateway_secret'] = 'sesame'
+        self.frontend.on_start()
+        self.agent.start.assert_called_once_with()
+        receiver_class.assert_called_once_with(
+            self.frontend.engine, '127.0.0.1', 6690, mock.ANY, 'sesame')
+        receiver = receiver_class.return_value
+        receiver.start.assert_called_once_with()
+        callback = receiver_class.call_args[0][3]
+        callback('kitchen', {'device': '/dev/input/event3',
+                             'action': 'volume_up', 'arg': None,
+                             'gesture': 'press', 'age': 0.5})
+        self.agent.perform_action.assert_called_once_with(
+            'kitchen:/dev/input/event3', 'volume_up', None, 'press', 9.5)
+        self.frontend.on_stop()
+        receiver.stop.assert_called_once_with()
+
+    def test_on_start_seeds_state(self):
+        self.core.playback.state.get.return_value = PlaybackState.PAUSED
+        self.core.playback.volume.get.return_value = 42
+        self.core.playback.mute.get.return_value = False
+        self.frontend.on_start()
+        self.agent.update_playback_state.assert_called_with(
+            PlaybackState.PAUSED)
+        self.agent.update_volume.assert_called_with(42)
+        self.agent.update_mute.assert_called_with(False)
+
+    def test_core_events(self):
+        self.frontend.on_start()
+        self.frontend.playback_state_changed(PlaybackState.PAUSED,
+                                             PlaybackState.PLAYING)
+        self.agent.update_playback_state.assert_called_with(
+            PlaybackState.PLAYING)
+        self.frontend.volume_changed(7)
+        self.agent.update_volume.assert_called_with(7)
+        self.frontend.mute_changed(True)
+        self.agent.update_mute.assert_called_with(True)
+
+    def test_get_rate_limit_stats(self):
+        self.frontend.on_start()
+        self.agent.get_rate_limit_stats.return_value = {}
+        self.assertEqual(self.frontend.get_rate_limit_stats(), {})
+
+    def test_get_dispatch_stats(self):
+        self.frontend.on_start()
+        self.agent.get_dispatch_stats.return_value = {}
+        self.assertEqual(self.frontend.get_dispatch_stats(), {})
+
+    def test_get_command_stats(self):
+        self.frontend.on_start()
+        self.agent.get_command_stats.return_value = {}
+        self.assertEqual(self.frontend.get_command_stats(), {})
+
+    def test_get_latency_stats(self):
+        self.frontend.on_start()
+        self.agent.get_latency_stats.return_value = {}
+        self.assertEqual(self.frontend.get_latency_stats(), {})
+
+    def test_dump_trace(self):
+        self.config['evtdev']['trace_size'] = 4096
+        self.frontend.on_start()
+        self.assertEqual(self.agent_class.call_args[1]['trace_size'], 4096)
+        self.agent.dump_trace.return_value = '/tmp/evtdev.trace'
+        self.assertEqual(self.frontend.dump_trace('/tmp/evtdev.trace'),
+                         '/tmp/evtdev.trace')
+        self.agent.dump_trace.assert_called_once_with('/tmp/evtdev.trace')
+
+    @mock.patch('pykka.ActorRegistry.get_by_class')
+    def test_dump_traces(self, get_by_class):
+        ref = mock.Mock()
+        get_by_class.return_value = [ref]
+        frontend_lib.dump_traces()
+        get_by_class.assert_called_once_with(frontend_lib.EvtDevFrontend)
+        ref.proxy.return_value.dump_trace.assert_called_once_with()
+
+    def test_profiling(self):
+        self.frontend.on_start()
+        self.assertFalse(self.agent_class.call_args[1]['profile'])
+        self.frontend.toggle_profiling()
+        self.agent.enable_profiling.assert_called_once_with(0)
+        self.frontend.set_profiling(True, sample=100)
+        self.agent.enable_profiling.assert_called_with(100)
+        self.frontend.toggle_profiling()
+        self.agent.disable_profiling.assert_called_once_with(dump=True)
+        self.agent.get_profile_stats.return_value = {}
+        self.assertEqual(self.frontend.get_profile_stats(), {})
+
+    @mock.patch('signal.signal')
+    def test_signals(self, signal_mock):
+        frontend_lib.EvtDevFrontend(self.config, self.core)
+        self.assertFalse(signal_mock.called)
+        self.config['evtdev']['trace_signal'] = 'SIGUSR2'
+        self.config['evtdev']['profile_signal'] = 'SIGHUP'
+        frontend_lib.EvtDevFrontend(self.config, self.core)
+        signal_mock.assert_has_calls([
+            mock.call(signal.SIGUSR2, frontend_lib.dump_traces),
+            mock.call(signal.SIGHUP, frontend_lib.toggle_profiling)])
+
+    @mock.patch('pykka.ActorRegistry.get_by_class')
+    def test_toggle_profiling(self, get_by_class):
+        ref = mock.Mock()
+        get_by_class.return_value = [ref]
+        frontend_lib.toggle_profiling()
+        ref.proxy.return_value.toggle_profiling.assert_called_once_with()
+
+    def test_on_stop(self):
+        self.frontend.on_start()
+        self.frontend.on_stop()
+        self.agent.stop.assert_called_with()
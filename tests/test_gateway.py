@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+
+import socket
+import time
+import unittest
+
+import mock
+
+from mopidy_evtdev.broker import Action
+from mopidy_evtdev.gateway import GatewayReceiver, GatewaySender
+
+from .test_broker import IDENTITY, SelectEngine
+
+
+class GatewayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SelectEngine()
+        self.actions = []
+        self.receiver = GatewayReceiver(
+            self.engine, '127.0.0.1', 0,
+            lambda node, action: self.actions.append((node, action)),
+            secret='sesame')
+        self.receiver.start()
+        self.addCleanup(self.receiver.stop)
+
+    def _sender(self, secret='sesame'):
+        # A stand-in for a node, sharing our engine
+        sender = GatewaySender(self.engine, '127.0.0.1', self.receiver.port,
+                               'kitchen', secret)
+        sender.start()
+        self.addCleanup(sender.stop)
+        return sender
+
+    def _publish(self, sender, n, age=0):
+        for i in range(n):
+            sender.publish(IDENTITY, Action('volume_up', None, 'press'),
+                           time.time() - age)
+
+    def _run(self, sender):
+        # Flush whatever is pending and run until all of it is acknowledged
+        for i in range(100):
+            self.engine.fire_timeouts()
+            self.engine.iterate(0.01)
+            if (not sender.pending and not sender.unacked):
+                break
+
+    def test_loopback(self):
+        sender = self._sender()
+        self._publish(sender, 3)
+        sender.publish(IDENTITY, Action('seek_forward', 5000, 'hold'),
+                       time.time())
+        self._run(sender)
+        self.assertEqual(len(self.actions), 4)
+        (node, action) = self.actions[3]
+        self.assertEqual(node, 'kitchen')
+        self.assertEqual(action['device'], IDENTITY[0])
+        self.assertEqual(action['action'], 'seek_forward')
+        self.assertEqual(action['arg'], 5000)
+        self.assertEqual(action['gesture'], 'hold')
+        self.assertLess(action['age'], 1.0)
+        # Everything published within the batch delay goes in one batch
+        self.assertEqual(self.receiver.get_stats(),
+                         {'batches': 1, 'actions': 4, 'duplicates': 0,
+                          'nodes': 1})
+        self.assertEqual(sender.get_stats()['acked'], 1)
+
+    def test_backpressure(self):
+        sender = self._sender()
+        self._publish(sender, 100)
+        self.assertEqual(sender.get_stats()['overflow'], 36)
+        # Without acknowledgements only a window of batches is sent
+        self.engine.fire_timeouts()
+        self._publish(sender, 20)
+        self.engine.fire_timeouts()
+        stats = sender.get_stats()
+        self.assertEqual(stats['unacked'], GatewaySender.WINDOW)
+        self.assertEqual(stats['pending'], 20)
+        self._run(sender)
+        self.assertEqual(len(self.actions), 84)
+
+    def test_reconnect(self):
+        sender = self._sender()
+        self._publish(sender, 2)
+        self.engine.fire_timeouts()
+        # The batch is received but the connection is lost before the node
+        # sees it acknowledged, so it is sent again
+        self.engine.source_remove(sender.read_tag)
+        sender.read_tag = None
+        while (len(self.actions) < 2):
+            self.engine.iterate()
+        sender._lost('test')
+        self.assertIsNone(sender.sock)
+        self._publish(sender, 1)
+        self._publish(sender, 1, age=10)
+        self.engine.fire_timeouts()
+        self._run(sender)
+        self.assertEqual(len(self.actions), 3)
+        self.assertEqual(self.receiver.get_stats()['duplicates'], 1)
+        stats = sender.get_stats()
+        self.assertEqual(stats['connects'], 2)
+        self.assertEqual(stats['stale'], 1)
+
+    def test_wrong_secret(self):
+        sender = self._sender(secret='guess')
+        self._publish(sender, 1)
+        self.engine.fire_timeouts()
+        for i in range(10):
+            self.engine.iterate(0.01)
+        self.assertEqual(self.actions, [])
+        self.assertIsNone(sender.sock)
+        self.assertIsNotNone(sender.retry_tag)
+
+    def _connect(self):
+        # A node that never says hello
+        sock = socket.create_connection(('127.0.0.1', self.receiver.port))
+        self.addCleanup(sock.close)
+        self.engine.iterate()
+        self.assertEqual(self.receiver.get_stats()['nodes'], 1)
+        return sock
+
+    def test_hello_timeout(self):
+        self._connect()
+        self.engine.fire_timeouts()
+        self.assertEqual(self.receiver.get_stats()['nodes'], 1)
+        with mock.patch('mopidy_evtdev.gateway.time') as time_mock:
+            time_mock.time.return_value = time.time() + 10
+            self.engine.fire_timeouts()
+        self.assertEqual(self.receiver.get_stats()['nodes'], 0)
+        self.assertEqual(self.engine.timeouts, {})
+
+    def test_line_too_long(self):
+        sock = self._connect()
+        sock.sendall(b'x' * (GatewayReceiver.MAX_LINE + 1))
+        for i in range(10):
+            self.engine.iterate(0.01)
+        self.assertEqual(self.receiver.get_stats()['nodes'], 0)
+
+    def test_secret_required(self):
+        # Without a secret only the loopback interface is listened on
+        receiver = GatewayReceiver(self.engine, '0.0.0.0', 0, None)
+        receiver.start()
+        self.assertIsNone(receiver.sock)
+        receiver.stop()
+        receiver = GatewayReceiver(self.engine, 'localhost', 0, None)
+        receiver.start()
+        self.assertIsNotNone(receiver.sock)
+        receiver.stop()
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mopidy_evtdev.hotplug import HotplugMonitor
+
+
+class HotplugMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dev_dir = tempfile.mkdtemp()
+        self.monitor = HotplugMonitor(self.dev_dir)
+
+    def tearDown(self):
+        self.monitor.close()
+        shutil.rmtree(self.dev_dir)
+
+    def _touch(self, name):
+        path = os.path.join(self.dev_dir, name)
+        open(path, 'w').close()
+        return path
+
+    def test_no_changes(self):
+        self.assertEqual(self.monitor.read_changes(), [])
+
+    def test_added_and_removed(self):
+        path = self._touch('event0')
+        self.assertIn((HotplugMonitor.ADDED, path),
+                      self.monitor.read_changes())
+        os.unlink(path)
+        self.assertEqual(self.monitor.read_changes(),
+                         [(HotplugMonitor.REMOVED, path)])
+
+    def test_ignores_other_nodes(self):
+        path = self._touch('mouse0')
+        os.unlink(path)
+        self.assertEqual(self.monitor.read_changes(), [])
+
+    def test_missing_directory(self):
+        self.assertRaises(OSError, HotplugMonitor,
+                          os.path.join(self.dev_dir, 'missing'))
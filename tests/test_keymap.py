@@ -0,0 +1,104 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from mopidy_evtdev.extension import Keymap
+from mopidy_evtdev.keymap import (
+    Binding, DEFAULT_KEYMAP, HOLD, KEY_CNT, KeyTable, LONG, PRESS,
+    parse_action, parse_binding)
+
+CODES = {'KEY_A': 30, 'KEY_B': 48, 'KEY_C': 46}
+
+
+def resolve_action(action, arg, gesture):
+    if (action == 'none'):
+        return None
+    return (action, arg)
+
+
+class ParseBindingTest(unittest.TestCase):
+
+    def test_press(self):
+        self.assertEqual(parse_binding('KEY_A = next_track'),
+                         Binding(('KEY_A',), PRESS, 'next_track', None))
+
+    def test_long_press_with_argument(self):
+        self.assertEqual(parse_binding('KEY_A:long = seek_forward:30000'),
+                         Binding(('KEY_A',), LONG, 'seek_forward', 30000))
+
+    def test_hold(self):
+        self.assertEqual(parse_binding('KEY_A:hold = volume_up'),
+                         Binding(('KEY_A',), HOLD, 'volume_up', None))
+
+    def test_chord(self):
+        self.assertEqual(parse_binding('KEY_A + 48 = shuffle'),
+                         Binding(('KEY_A', '48'), PRESS, 'shuffle', None))
+
+    def test_playlist_uri(self):
+        self.assertEqual(parse_binding('KEY_A = load_playlist:m3u:a.m3u'),
+                         Binding(('KEY_A',), PRESS, 'load_playlist',
+                                 'm3u:a.m3u'))
+
+    def test_defaults(self):
+        for binding in DEFAULT_KEYMAP:
+            parse_binding(binding)
+
+    def test_invalid(self):
+        for text in ['KEY_A', 'KEY_A = dance', 'key_a = stop',
+                     'KEY_A:short = stop', 'KEY_A+KEY_A = stop',
+                     'KEY_A+KEY_B:long = stop', 'KEY_A+KEY_B:hold = stop',
+                     'KEY_A = stop:1',
+                     'KEY_A = load_playlist', 'KEY_A = seek_forward:far']:
+            self.assertRaises(ValueError, parse_binding, text)
+
+    def test_action(self):
+        self.assertEqual(parse_action('seek_forward', '30000'), 30000)
+        self.assertIsNone(parse_action('next_track'))
+        self.assertRaises(ValueError, parse_action, 'dance')
+        self.assertRaises(ValueError, parse_action, 'stop', '1')
+
+
+class KeymapTest(unittest.TestCase):
+
+    def test_deserialize(self):
+        value = Keymap(optional=True).deserialize(
+            b'\n  KEY_A = stop\n  KEY_B:long = mute')
+        self.assertEqual(value, ('KEY_A = stop', 'KEY_B:long = mute'))
+
+    def test_deserialize_invalid(self):
+        self.assertRaises(ValueError, Keymap().deserialize, b'KEY_A = dance')
+
+
+class KeyTableTest(unittest.TestCase):
+
+    def _compile(self, bindings):
+        return KeyTable([parse_binding(b) for b in bindings], CODES.get,
+                        resolve_action)
+
+    def test_tables(self):
+        table = self._compile(['KEY_A = stop', 'KEY_B:long = mute',
+                               'KEY_C:hold = volume_up',
+                               'KEY_A+KEY_C = shuffle'])
+        self.assertEqual(len(table.press), KEY_CNT)
+        self.assertEqual(table.press[30], ('stop', None))
+        self.assertIsNone(table.press[48])
+        self.assertEqual(table.long[48], ('mute', None))
+        self.assertEqual(table.hold[46], ('volume_up', None))
+        self.assertIsNone(table.press[46])
+        chord = [(frozenset([30, 46]), ('shuffle', None))]
+        self.assertEqual(table.chords[30], chord)
+        self.assertEqual(table.chords[46], chord)
+        self.assertTrue(table.is_bound(46))
+        self.assertFalse(table.is_bound(1))
+        self.assertFalse(table.is_bound(KEY_CNT))
+
+    def test_override(self):
+        table = self._compile(['KEY_A = stop', 'KEY_B = mute',
+                               'KEY_A = next_track', 'KEY_B = none'])
+        self.assertEqual(table.press[30], ('next_track', None))
+        self.assertIsNone(table.press[48])
+        self.assertFalse(table.is_bound(48))
+
+    def test_unknown_key(self):
+        table = self._compile(['KEY_Z = stop', '9999 = stop'])
+        self.assertFalse(any(table.bound))
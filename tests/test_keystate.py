@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from mopidy_evtdev.keystate import KeyStateTable
+
+
+class KeyStateTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = KeyStateTable(5.0)
+
+    def test_press(self):
+        slot = self.table.allocate('/dev/input/event0')
+        self.assertEqual(self.table.update(slot, 164, 0, 0, 1),
+                         KeyStateTable.NONE)
+        self.assertEqual(self.table.update(slot, 164, 0, 10, 2),
+                         KeyStateTable.NONE)
+        self.assertEqual(self.table.update(slot, 164, 0, 20, 0),
+                         KeyStateTable.COMPLETE)
+        # A release without a press is ignored
+        self.assertEqual(self.table.update(slot, 164, 0, 30, 0),
+                         KeyStateTable.NONE)
+
+    def test_expired(self):
+        slot = self.table.allocate('/dev/input/event0')
+        self.table.update(slot, 164, 0, 0, 1)
+        self.assertEqual(self.table.update(slot, 164, 5, 1, 0),
+                         KeyStateTable.EXPIRED)
+
+    def test_overlapping_keys(self):
+        slot = self.table.allocate('/dev/input/event0')
+        self.table.update(slot, 164, 0, 0, 1)
+        self.table.update(slot, 163, 0, 1, 1)
+        self.assertEqual(self.table.update(slot, 164, 0, 2, 0),
+                         KeyStateTable.COMPLETE)
+        self.assertEqual(self.table.update(slot, 163, 0, 3, 0),
+                         KeyStateTable.COMPLETE)
+
+    def test_interleaved_devices(self):
+        slot0 = self.table.allocate('/dev/input/event0')
+        slot1 = self.table.allocate('/dev/input/event1')
+        self.assertNotEqual(slot0, slot1)
+        self.table.update(slot0, 164, 0, 0, 1)
+        self.table.update(slot1, 164, 0, 1, 1)
+        self.assertEqual(self.table.update(slot1, 164, 0, 2, 0),
+                         KeyStateTable.COMPLETE)
+        self.assertEqual(self.table.update(slot0, 164, 0, 3, 0),
+                         KeyStateTable.COMPLETE)
+
+    def test_reset(self):
+        slot = self.table.allocate('/dev/input/event0')
+        self.table.update(slot, 164, 0, 0, 1)
+        self.table.reset(slot)
+        self.assertEqual(self.table.update(slot, 164, 0, 1, 0),
+                         KeyStateTable.NONE)
+
+    def test_resync(self):
+        slot = self.table.allocate('/dev/input/event0')
+        self.table.update(slot, 164, 0, 0, 1)
+        self.table.resync(slot, [163], 1, 0)
+        # The release of 164 was lost, 163 was pressed meanwhile
+        self.assertEqual(self.table.update(slot, 164, 1, 1, 0),
+                         KeyStateTable.NONE)
+        self.assertEqual(self.table.update(slot, 163, 1, 2, 0),
+                         KeyStateTable.COMPLETE)
+
+    def test_slots_reused(self):
+        slot = self.table.allocate('/dev/input/event0')
+        self.assertEqual(self.table.allocate('/dev/input/event0'), slot)
+        self.table.update(slot, 164, 0, 0, 1)
+        self.table.release('/dev/input/event0')
+        self.table.release('/dev/input/event0')
+        self.assertEqual(self.table.allocate('/dev/input/event1'), slot)
+        self.assertEqual(self.table.update(slot, 164, 0, 1, 0),
+                         KeyStateTable.NONE)
+        self.assertEqual(len(self.table.slots), 1)
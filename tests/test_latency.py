@@ -0,0 +1,46 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from mopidy_evtdev.latency import LatencyHistogram, LatencyStats
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        h = LatencyHistogram()
+        self.assertEqual(h.percentile(50), 0)
+        self.assertEqual(h.to_dict()['count'], 0)
+
+    def test_add(self):
+        h = LatencyHistogram()
+        for i in range(99):
+            h.add(0.0001)
+        h.add(0.5)
+        d = h.to_dict()
+        self.assertEqual(d['count'], 100)
+        self.assertEqual(d['max'], 500000)
+        self.assertEqual(d['p50'], 128)
+        self.assertEqual(d['p99'], 128)
+        self.assertEqual(h.percentile(100), 500000)
+
+    def test_negative_and_huge(self):
+        h = LatencyHistogram()
+        h.add(-1)
+        h.add(1e9)
+        self.assertEqual(h.counts[0], 1)
+        self.assertEqual(h.counts[-1], 1)
+
+
+class LatencyStatsTest(unittest.TestCase):
+
+    def test_snapshot(self):
+        stats = LatencyStats()
+        stats.record_device('/dev/input/event0', 'wakeup', 0.001)
+        stats.record_action('_stop', 'dispatch', 0.002)
+        stats.record_action('_stop', 'ack', 0.003)
+        snapshot = stats.snapshot()
+        self.assertEqual(
+            snapshot['devices']['/dev/input/event0']['wakeup']['count'], 1)
+        self.assertEqual(snapshot['actions']['_stop']['ack']['max'], 3000)
+        stats.log()
@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from mopidy_evtdev.matcher import DeviceMatcher
+
+
+class DeviceMatcherTest(unittest.TestCase):
+
+    def test_empty(self):
+        matcher = DeviceMatcher([])
+        self.assertFalse(matcher)
+        self.assertFalse(matcher.match('/dev/input/event0'))
+
+    def test_exact(self):
+        matcher = DeviceMatcher(['AT Translated Set 2 keyboard',
+                                 '00:11:67:D2:AB:EE'])
+        self.assertTrue(matcher)
+        self.assertTrue(matcher.match('/dev/input/event0',
+                                      'AT Translated Set 2 keyboard'))
+        self.assertTrue(matcher.match('00:11:67:D2:AB:EE'))
+        self.assertFalse(matcher.match('AT Translated Set 2'))
+
+    def test_glob(self):
+        matcher = DeviceMatcher(['/dev/input/event1*', '*Remote*'])
+        self.assertTrue(matcher.match('/dev/input/event12'))
+        self.assertTrue(matcher.match('/dev/input/event0', 'IR Remote'))
+        self.assertFalse(matcher.match('/dev/input/event2', 'Keyboard'))
+
+    def test_regex(self):
+        matcher = DeviceMatcher(['re:^usb-.*/input[01]$'])
+        self.assertTrue(matcher.match('usb-0000:00:14.0-2/input1'))
+        self.assertFalse(matcher.match('usb-0000:00:14.0-2/input2'))
+        self.assertFalse(matcher.match('re:^usb-.*/input[01]$'))
@@ -0,0 +1,70 @@
+from __future__ import unicode_literals
+
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mopidy_evtdev.profiling import CallbackProfiler
+
+
+class CallbackProfilerTest(unittest.TestCase):
+
+    def test_timing(self):
+        profiler = CallbackProfiler()
+        outer = profiler.wrap('outer', lambda: inner() + 1)
+        inner = profiler.wrap('inner', lambda: 1)
+        for i in range(3):
+            self.assertEqual(outer(), 2)
+        stats = profiler.snapshot()
+        self.assertEqual(stats['outer']['calls'], 3)
+        self.assertEqual(stats['inner']['calls'], 3)
+        self.assertGreaterEqual(stats['outer']['wall'], stats['inner']['wall'])
+        self.assertGreaterEqual(stats['outer']['wall'], stats['outer']['max'])
+        self.assertIsNone(profiler.dump('/nonexistent'))
+
+    def test_thread_cpu(self):
+        # CPU spent by other threads meanwhile is not the callback's
+        stop = threading.Event()
+
+        def spin():
+            while (not stop.is_set()):
+                pass
+        thread = threading.Thread(target=spin)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.set)
+        profiler = CallbackProfiler()
+        profiler.wrap('sleep', time.sleep)(0.2)
+        stats = profiler.snapshot()['sleep']
+        self.assertGreaterEqual(stats['wall'], 200000)
+        self.assertLess(stats['cpu'], 50000)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError()
+        profiler = CallbackProfiler(sample=1)
+        wrapped = profiler.wrap('fail', fail)
+        self.assertRaises(ValueError, wrapped)
+        self.assertEqual(profiler.snapshot()['fail']['calls'], 1)
+        # The profile is left ready for the next sample
+        self.assertTrue(profiler.profile_lock.acquire(False))
+
+    def test_sample(self):
+        def work():
+            return sum(range(100))
+        profiler = CallbackProfiler(sample=2)
+        wrapped = profiler.wrap('work', work)
+        self.assertEqual(wrapped.__name__, 'work')
+        for i in range(4):
+            wrapped()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        path = profiler.dump(os.path.join(path, 'evtdev.prof'))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        calls = [stat[1] for (func, stat) in pstats.Stats(path).stats.items()
+                 if func[2] == 'work']
+        self.assertEqual(calls, [2])
@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from mopidy_evtdev.ratelimit import RateLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(10, 20, 0.0)
+        self.assertTrue(bucket.consume(20, 0.0))
+        self.assertFalse(bucket.consume(1, 0.0))
+        self.assertTrue(bucket.consume(1, 0.1))
+        self.assertFalse(bucket.consume(1, 0.1))
+
+    def test_burst_is_capped(self):
+        bucket = TokenBucket(10, 20, 0.0)
+        self.assertFalse(bucket.consume(21, 100.0))
+
+    def test_overrun_is_spent(self):
+        bucket = TokenBucket(10, 20, 0.0)
+        self.assertFalse(bucket.consume(30, 0.0))
+        self.assertFalse(bucket.consume(1, 0.05))
+        self.assertTrue(bucket.consume(1, 0.25))
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_unlimited(self):
+        limiter = RateLimiter(0, 0)
+        self.assertTrue(limiter.allow_events('event0', 10 ** 6, 0.0))
+        self.assertTrue(limiter.allow_action('event0', 0.0))
+
+    def test_per_device(self):
+        limiter = RateLimiter(10, 1)
+        self.assertTrue(limiter.allow_events('event0', 20, 0.0))
+        self.assertFalse(limiter.allow_events('event0', 1, 0.0))
+        self.assertTrue(limiter.allow_events('event1', 20, 0.0))
+        self.assertTrue(limiter.allow_action('event0', 0.0))
+        self.assertTrue(limiter.allow_action('event0', 0.0))
+        self.assertFalse(limiter.allow_action('event0', 0.0))
+
+    def test_backoff(self):
+        limiter = RateLimiter(10, 1, backoff=1.0, max_backoff=4.0)
+        self.assertEqual(limiter.quarantine('event0', 0.0), 1.0)
+        self.assertEqual(limiter.quarantine('event0', 1.0), 2.0)
+        self.assertEqual(limiter.quarantine('event0', 3.0), 4.0)
+        self.assertEqual(limiter.quarantine('event0', 7.0), 4.0)
+        # Behaving for max_backoff after release resets the backoff
+        self.assertEqual(limiter.quarantine('event0', 20.0), 1.0)
+        self.assertEqual(limiter.get_stats(),
+                         {'quarantines': 5, 'strikes': {'event0': 1}})
+
+    def test_release_and_forget(self):
+        limiter = RateLimiter(10, 1)
+        limiter.allow_events('event0', 20, 0.0)
+        limiter.quarantine('event0', 0.0)
+        limiter.release('event0')
+        self.assertTrue(limiter.allow_events('event0', 20, 0.0))
+        limiter.forget('event0')
+        self.assertEqual(limiter.get_stats()['strikes'], {})
@@ -0,0 +1,46 @@
+from __future__ import unicode_literals
+
+import os
+import unittest
+
+from mopidy_evtdev.reader import EventReader, INPUT_EVENT
+
+
+class EventReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rfd, self.wfd = os.pipe()
+        self.reader = EventReader(self.rfd, max_events=4)
+
+    def tearDown(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+    def _write(self, events):
+        os.write(self.wfd, b''.join(INPUT_EVENT.pack(*e) for e in events))
+
+    def test_empty(self):
+        self.assertEqual(self.reader.read(), [])
+
+    def test_read(self):
+        events = [(1, 2, 1, 164, 1), (1, 3, 0, 0, 0), (1, 4, 1, 164, 0)]
+        self._write(events)
+        self.assertEqual(self.reader.read(), events)
+        self.assertEqual(self.reader.read(), [])
+
+    def test_drains_beyond_buffer(self):
+        events = [(i, 0, 2, 0, -i) for i in range(10)]
+        self._write(events)
+        self.assertEqual(self.reader.read(), events)
+
+    def test_limit(self):
+        events = [(i, 0, 2, 0, -i) for i in range(10)]
+        self._write(events)
+        self.assertEqual(self.reader.read(6), events[:6])
+        self.assertEqual(self.reader.read(2), events[6:8])
+        self.assertEqual(self.reader.read(6), events[8:])
+
+    def test_closed(self):
+        os.close(self.wfd)
+        self.wfd = os.open(os.devnull, os.O_WRONLY)
+        self.assertEqual(self.reader.read(), [])
@@ -0,0 +1,72 @@
+from __future__ import unicode_literals
+
+import mock
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mopidy_evtdev.record import EventLog, EventRecorder, replay
+
+
+class EventRecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'events.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _record(self, events):
+        recorder = EventRecorder(self.path)
+        for event in events:
+            recorder.record(*event)
+        recorder.close()
+
+    def test_record_and_read(self):
+        events = [('/dev/input/event0', 10, 1, 1, 164, 1),
+                  ('/dev/input/event1', 10, 2, 2, 0, -5),
+                  ('/dev/input/event0', 10, 3, 1, 164, 0)]
+        self._record(events)
+        log = EventLog(self.path)
+        self.assertEqual(len(log), 3)
+        self.assertEqual(list(log), events)
+        self.assertEqual(log[-1], events[-1])
+        self.assertRaises(IndexError, log.__getitem__, 3)
+        log.close()
+
+    def test_append(self):
+        self._record([('/dev/input/event0', 1, 0, 1, 164, 1)])
+        self._record([('/dev/input/event1', 2, 0, 1, 164, 0),
+                      ('/dev/input/event0', 3, 0, 1, 164, 0)])
+        log = EventLog(self.path)
+        self.assertEqual([e[0] for e in log],
+                         ['/dev/input/event0', '/dev/input/event1',
+                          '/dev/input/event0'])
+        self.assertEqual(log.devices,
+                         ['/dev/input/event0', '/dev/input/event1'])
+        log.close()
+
+    def test_bad_log(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'NOPE\0\0\0\0')
+        open(self.path + '.devices', 'w').close()
+        self.assertRaises(ValueError, EventLog, self.path)
+
+    def test_replay(self):
+        events = [('/dev/input/event0', 10, 0, 1, 164, 1),
+                  ('/dev/input/event0', 10, 50000, 1, 164, 0)]
+        self._record(events)
+        agent = mock.Mock()
+        log = EventLog(self.path)
+        self.assertEqual(replay(agent, log), 2)
+        agent._handle_event.assert_called_with(10, 50000, 1, 164, 0)
+        agent._select_device.assert_called_with('/dev/input/event0')
+        agent.reset_mock()
+        start = time.time()
+        replay(agent, log, speed=1.0)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        self.assertEqual(agent._handle_event.call_count, 2)
+        log.close()
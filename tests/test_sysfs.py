@@ -0,0 +1,80 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mopidy_evtdev.sysfs import BITS_PER_LONG, DeviceInfoCache, parse_bitmap
+
+
+class DeviceInfoCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dev_dir = os.path.join(self.root, 'dev')
+        self.sys_dir = os.path.join(self.root, 'sys')
+        os.mkdir(self.dev_dir)
+        self.cache = DeviceInfoCache(self.sys_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _make_device(self, node, name, phys='', uniq='', key=None):
+        path = os.path.join(self.dev_dir, node)
+        open(path, 'w').close()
+        attr_dir = os.path.join(self.sys_dir, node, 'device')
+        if (not os.path.isdir(attr_dir)):
+            os.makedirs(attr_dir)
+        for (attr, value) in (('name', name), ('phys', phys),
+                              ('uniq', uniq)):
+            with open(os.path.join(attr_dir, attr), 'w') as f:
+                f.write(value + '\n')
+        if (key is not None):
+            os.mkdir(os.path.join(attr_dir, 'capabilities'))
+            with open(os.path.join(attr_dir, 'capabilities', 'key'),
+                      'w') as f:
+                f.write(key + '\n')
+        return path
+
+    def test_lookup(self):
+        path = self._make_device('event0', 'Mock Device', 'mock/input0',
+                                 '00:11:67:D2:AB:EE')
+        info = self.cache.lookup(path)
+        self.assertEqual(info.fn, path)
+        self.assertEqual(info.name, 'Mock Device')
+        self.assertEqual(info.phys, 'mock/input0')
+        self.assertEqual(info.uniq, '00:11:67:D2:AB:EE')
+
+    def test_lookup_key_codes(self):
+        path = self._make_device('event0', 'Remote', key='1 0 30000')
+        info = self.cache.lookup(path)
+        self.assertEqual(info.key_codes,
+                         frozenset([16, 17, 2 * BITS_PER_LONG]))
+        path = self._make_device('event1', 'Unknown')
+        self.assertIsNone(self.cache.lookup(path).key_codes)
+
+    def test_parse_bitmap(self):
+        self.assertEqual(parse_bitmap('0'), set())
+        self.assertEqual(parse_bitmap('5'), set([0, 2]))
+        self.assertEqual(parse_bitmap('1 0'), set([BITS_PER_LONG]))
+
+    def test_lookup_is_cached(self):
+        path = self._make_device('event0', 'Mock Device')
+        info = self.cache.lookup(path)
+        self._make_device('event0', 'Changed')
+        self.assertIs(self.cache.lookup(path), info)
+        self.cache.invalidate(path)
+        self.assertEqual(self.cache.lookup(path).name, 'Changed')
+
+    def test_lookup_missing(self):
+        path = os.path.join(self.dev_dir, 'event1')
+        self.assertIsNone(self.cache.lookup(path))
+        open(path, 'w').close()
+        self.assertIsNone(self.cache.lookup(path))
+
+    def test_prune(self):
+        path = self._make_device('event0', 'Mock Device')
+        self.cache.lookup(path)
+        self.cache.prune([])
+        self.assertEqual(self.cache.entries, {})
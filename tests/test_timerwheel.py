@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+
+import mock
+import unittest
+
+from mopidy_evtdev.timerwheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = mock.Mock()
+        self.wheel = TimerWheel(self.engine, tick=10, size=4)
+
+    def _tick(self):
+        return self.engine.timeout_add.call_args[0][1]()
+
+    def test_single_engine_timeout(self):
+        callback = mock.Mock()
+        for delay in (10, 25, 50, 95):
+            self.wheel.schedule(delay, callback, delay)
+        self.engine.timeout_add.assert_called_once_with(10, mock.ANY)
+        fired = []
+        for i in range(10):
+            callback.reset_mock()
+            keep = self._tick()
+            fired.append([c[0][0] for c in callback.call_args_list])
+        # Timers beyond one turn of the wheel wait for their own turn
+        self.assertEqual(fired, [[10], [], [25], [], [50], [], [], [], [],
+                                 [95]])
+        self.assertFalse(keep)
+        self.assertIsNone(self.wheel.tag)
+
+    def test_schedule_from_callback(self):
+        calls = []
+
+        def callback():
+            calls.append(self.wheel.now)
+            if (len(calls) < 3):
+                self.wheel.schedule(10, callback)
+
+        self.wheel.schedule(10, callback)
+        while (self._tick()):
+            pass
+        self.assertEqual(calls, [1, 2, 3])
+
+    def test_failing_callback(self):
+        callback = mock.Mock()
+        self.wheel.schedule(10, mock.Mock(side_effect=Exception('Failed')))
+        self.wheel.schedule(10, callback)
+        self.assertFalse(self._tick())
+        callback.assert_called_once_with()
+
+    def test_stop(self):
+        self.wheel.schedule(10, mock.Mock())
+        self.wheel.stop()
+        self.engine.source_remove.assert_called_once_with(
+            self.engine.timeout_add.return_value)
+        self.assertEqual(self.wheel.pending, 0)
@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mopidy_evtdev
+from mopidy_evtdev import trace as trace_lib
+from mopidy_evtdev.trace import TraceRing
+
+
+class TraceRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'evtdev.trace')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_wrap(self):
+        ring = TraceRing(3)
+        self.assertEqual(list(ring), [])
+        for i in range(5):
+            ring.record(i, 0, 0, 1, 30, 1, trace_lib.KEY)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.count, 5)
+        self.assertEqual([record[0] for record in ring], [2, 3, 4])
+
+    def test_dump_and_load(self):
+        ring = TraceRing(8)
+        ring.name_slot(1, '/dev/input/event3')
+        ring.record(10, 500, 1, 1, 164, 1, trace_lib.KEY)
+        ring.record(10, 600, 1, 1, 164, 0, trace_lib.COMPLETE)
+        ring.record(11, 0, 2, 1, 30, -1, trace_lib.UNBOUND)
+        self.assertEqual(ring.dump(self.path), 3)
+        (devices, records) = trace_lib.load(self.path)
+        self.assertEqual(devices, {1: '/dev/input/event3'})
+        self.assertEqual(records, list(ring))
+
+    def test_dump_not_through_link(self):
+        ring = TraceRing(8)
+        ring.record(10, 500, 1, 1, 164, 1, trace_lib.KEY)
+        ring.dump(self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        target = os.path.join(self.dir, 'target')
+        os.symlink(target, self.path + '.link')
+        self.assertRaises(OSError, ring.dump, self.path + '.link')
+        self.assertFalse(os.path.exists(target))
+
+    def test_not_a_trace(self):
+        with io.open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ValueError, trace_lib.load, self.path)
+
+    def test_decode(self):
+        ring = TraceRing(8)
+        ring.name_slot(1, '/dev/input/event3')
+        ring.record(10, 500, 1, 1, 164, 0, trace_lib.COMPLETE)
+        ring.record(11, 0, 1, 0, 0, 0, trace_lib.CLOSE)
+        ring.dump(self.path)
+        out = io.StringIO()
+        trace_lib.main([self.path], out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith(
+            '10.000500 /dev/input/event3 complete '))
+        self.assertEqual(lines[1], '11.000000 /dev/input/event3 close')
+
+    def test_decode_without_mopidy(self):
+        # Traces are decoded on hosts without Mopidy, GLib or evdev
+        ring = TraceRing(8)
+        ring.record(11, 0, 1, 0, 0, 0, trace_lib.CLOSE)
+        ring.dump(self.path)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(
+            os.path.dirname(os.path.abspath(mopidy_evtdev.__file__)))
+        out = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys\n'
+            'for name in ("mopidy", "gobject", "evdev"):\n'
+            '    sys.modules[name] = None\n'
+            'from mopidy_evtdev import trace\n'
+            'trace.main(sys.argv[1:])\n',
+            self.path], env=env)
+        self.assertEqual(out.splitlines(), [b'11.000000 #1 close'])